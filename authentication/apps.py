@@ -1,6 +1,16 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete
 
 
 class AuthenticationConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'authentication'
+
+    def ready(self):
+        from rest_framework.authtoken.models import Token
+
+        from webservices.auth import forget_deleted_token
+
+        post_delete.connect(
+            forget_deleted_token, sender=Token, dispatch_uid='forget_deleted_token'
+        )
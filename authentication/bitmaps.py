@@ -0,0 +1,108 @@
+from datetime import timedelta
+from decimal import Decimal
+from typing import Dict, List, Optional
+
+import numpy as np
+from authentication.models import User, user_bitmaps
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+FETCH_CHUNK_SIZE = 50000
+FOREIGN_KEY_DIMENSIONS = ['metro', 'industry', 'job_title']
+INT_DIMENSIONS = FOREIGN_KEY_DIMENSIONS + ['level']
+
+
+def _columns_sql() -> str:
+    return ', '.join(
+        "coalesce({column}::text, '')".format(
+            column=f'{name}_id' if name in FOREIGN_KEY_DIMENSIONS else name
+        )
+        for name in User.BITMAP_DIMENSIONS
+    )
+
+
+def rebuild_user_bitmaps() -> dict:
+    """
+    Rebuilds the user bitmaps (see `User.BITMAP_DIMENSIONS`) from every user,
+    then replays the users saved while it ran
+    """
+    started = timezone.now()
+    sql = f'SELECT id, {_columns_sql()} FROM users WHERE id > %s ORDER BY id LIMIT %s'
+    ids: List[np.ndarray] = []
+    columns: Dict[str, list] = {name: [] for name in User.BITMAP_DIMENSIONS}
+    position = 0
+    with connection.cursor() as cursor:
+        while True:
+            cursor.execute(sql, [position, FETCH_CHUNK_SIZE])
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            values = list(zip(*rows))
+            ids.append(np.array(values[0], dtype=np.int64))
+            for name, column in zip(User.BITMAP_DIMENSIONS, values[1:]):
+                columns[name].extend(column)
+            position = rows[-1][0]
+    ids = np.concatenate(ids) if ids else np.array([], dtype=np.int64)
+    user_bitmaps.rebuild(ids, columns)
+
+    # NOTE: a save that committed after its chunk was read has already been
+    #  overwritten by the rebuild
+    since = started - timedelta(seconds=settings.USER_SNAPSHOT_DELTA_OVERLAP)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT id, {_columns_sql()} FROM users WHERE updated >= %s', [since]
+        )
+        replayed = cursor.fetchall()
+    for row in replayed:
+        user_bitmaps.set_row(row[0], dict(zip(User.BITMAP_DIMENSIONS, row[1:])))
+    return dict(users=len(ids), replayed=len(replayed))
+
+
+def ensure_user_bitmaps() -> Optional[dict]:
+    """Rebuilds the user bitmaps when they were never built or invalidated"""
+    if user_bitmaps.is_built():
+        return None
+    return rebuild_user_bitmaps()
+
+
+def _encode(name: str, value) -> Optional[str]:
+    # NOTE: exact filters on foreign keys clean to model instances
+    value = getattr(value, 'pk', value)
+    if name in INT_DIMENSIONS:
+        try:
+            number = Decimal(str(value))
+            # NOTE: no user has a fractional id or level
+            return str(int(number)) if number == int(number) else None
+        except ArithmeticError:
+            return None
+    return user_bitmaps.encode(value)
+
+
+def is_bitmap_param(name: str) -> bool:
+    """Whether a `UserFilter` param is an exact or `in` lookup on a dimension"""
+    field, _, lookup = name.partition('__')
+    return field in User.BITMAP_DIMENSIONS and lookup in ('', 'in')
+
+
+def bitmap_constraints(cleaned_data: dict) -> Optional[Dict[str, List[str]]]:
+    """
+    Encoded values allowed per dimension by the cleaned `UserFilter` data, None
+    when a param is not one of `is_bitmap_param`
+    """
+    constraints: Dict[str, List[str]] = {}
+    for name, value in cleaned_data.items():
+        if value is None or value == '' or value == []:
+            continue
+        if not is_bitmap_param(name):
+            return None
+        field, _, lookup = name.partition('__')
+        values = [
+            encoded
+            for encoded in (_encode(field, v) for v in (value if lookup else [value]))
+            if encoded is not None
+        ]
+        if field in constraints:
+            values = [v for v in constraints[field] if v in values]
+        constraints[field] = values
+    return constraints
@@ -1,5 +1,25 @@
+from typing import Dict
+from uuid import UUID
+
 from authentication.models import Industry, JobTitle, MetropolitanArea, User
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db import connection
+from django.db.models import Case, FloatField, Q, Value, When
 from django_filters import rest_framework as filters
+from rest_framework.filters import SearchFilter
+
+# NOTE: whether pg_trgm is installed, per database, see `trigram_available`
+_trigram_available: Dict[str, bool] = {}
+
+
+def trigram_available() -> bool:
+    """Whether the pg_trgm extension is installed, see migration 0012"""
+    name = connection.settings_dict['NAME']
+    if name not in _trigram_available:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+            _trigram_available[name] = cursor.fetchone() is not None
+    return _trigram_available[name]
 
 
 class UserFilter(filters.FilterSet):
@@ -83,6 +103,42 @@ class UserFilter(filters.FilterSet):
     net_monthly_profit_loss__gte = filters.NumberFilter(
         field_name='net_monthly_profit_loss', lookup_expr='gte'
     )
+    inc_total_monthly_net__lt = filters.NumberFilter(
+        field_name='inc_total_monthly_net', lookup_expr='lt'
+    )
+    inc_total_monthly_net__lte = filters.NumberFilter(
+        field_name='inc_total_monthly_net', lookup_expr='lte'
+    )
+    inc_total_monthly_net__gt = filters.NumberFilter(
+        field_name='inc_total_monthly_net', lookup_expr='gt'
+    )
+    inc_total_monthly_net__gte = filters.NumberFilter(
+        field_name='inc_total_monthly_net', lookup_expr='gte'
+    )
+    inc_annual_tax_net__lt = filters.NumberFilter(
+        field_name='inc_annual_tax_net', lookup_expr='lt'
+    )
+    inc_annual_tax_net__lte = filters.NumberFilter(
+        field_name='inc_annual_tax_net', lookup_expr='lte'
+    )
+    inc_annual_tax_net__gt = filters.NumberFilter(
+        field_name='inc_annual_tax_net', lookup_expr='gt'
+    )
+    inc_annual_tax_net__gte = filters.NumberFilter(
+        field_name='inc_annual_tax_net', lookup_expr='gte'
+    )
+    exp_total__lt = filters.NumberFilter(field_name='exp_total', lookup_expr='lt')
+    exp_total__lte = filters.NumberFilter(field_name='exp_total', lookup_expr='lte')
+    exp_total__gt = filters.NumberFilter(field_name='exp_total', lookup_expr='gt')
+    exp_total__gte = filters.NumberFilter(field_name='exp_total', lookup_expr='gte')
+    sav_total__lt = filters.NumberFilter(field_name='sav_total', lookup_expr='lt')
+    sav_total__lte = filters.NumberFilter(field_name='sav_total', lookup_expr='lte')
+    sav_total__gt = filters.NumberFilter(field_name='sav_total', lookup_expr='gt')
+    sav_total__gte = filters.NumberFilter(field_name='sav_total', lookup_expr='gte')
+    sav_rate__lt = filters.NumberFilter(field_name='sav_rate', lookup_expr='lt')
+    sav_rate__lte = filters.NumberFilter(field_name='sav_rate', lookup_expr='lte')
+    sav_rate__gt = filters.NumberFilter(field_name='sav_rate', lookup_expr='gt')
+    sav_rate__gte = filters.NumberFilter(field_name='sav_rate', lookup_expr='gte')
     assets_total__lt = filters.NumberFilter(field_name='assets_total', lookup_expr='lt')
     assets_total__lte = filters.NumberFilter(
         field_name='assets_total', lookup_expr='lte'
@@ -116,11 +172,70 @@ class UserFilter(filters.FilterSet):
             'exp_housing',
             'inc_total_annual',
             'net_monthly_profit_loss',
+            'inc_total_monthly_net',
+            'inc_annual_tax_net',
+            'exp_total',
+            'sav_total',
+            'sav_rate',
             'assets_total',
             'lia_total',
             'net_worth',
         ]
 
+    def get_form_class(self):
+        # NOTE: none of the fields depend on the request, building the form
+        #  class out of ~100 filters took most of the time of a cached request
+        cls = type(self)
+        if '_form_class' not in cls.__dict__:
+            cls._form_class = super().get_form_class()
+        return cls._form_class
+
+
+class UserSearchFilter(SearchFilter):
+    """
+    Search of users by handle or uuid. A term that is a well formed UUID matches
+    the uuid exactly, any term matches the handles that contain it, a lookup
+    served by the trigram index on `UPPER(handle)`. Every term has to match.
+
+    Views with `search_rank_ordering` get the matches ranked first, unless the
+    client asked for an order or a keyset page: by trigram similarity of the
+    handle to the search, or without pg_trgm exact matches then prefixes.
+    """
+
+    def get_rank(self, search: str):
+        if trigram_available():
+            return TrigramSimilarity('handle', search)
+        return Case(
+            When(handle__iexact=search, then=Value(1.0)),
+            When(handle__istartswith=search, then=Value(0.5)),
+            default=Value(0.0),
+            output_field=FloatField(),
+        )
+
+    def rank_results(self, request, view) -> bool:
+        return (
+            getattr(view, 'search_rank_ordering', False)
+            and 'order_by' not in request.query_params
+            and 'cursor' not in request.query_params
+        )
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms:
+            return queryset
+        for term in terms:
+            q = Q(handle__icontains=term)
+            try:
+                q |= Q(uuid=UUID(term))
+            except ValueError:
+                pass
+            queryset = queryset.filter(q)
+        if self.rank_results(request, view):
+            queryset = queryset.alias(
+                search_rank=self.get_rank(' '.join(terms))
+            ).order_by('-search_rank', *queryset.query.order_by)
+        return queryset
+
 
 class MetropolitanAreaFilter(filters.FilterSet):
     id__in = filters.BaseInFilter(field_name='id')
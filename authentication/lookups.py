@@ -0,0 +1,81 @@
+from typing import Optional
+from uuid import UUID
+
+from authentication.models import User
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import QuerySet
+
+from webservices.cache import LocalLRUCache, hash_key
+
+# NOTE: the user fields routes look users up by, both unique
+LOOKUP_FIELDS = ['uuid', 'handle']
+_local_user_ids = LocalLRUCache(settings.USER_LOOKUP_LOCAL_CACHE_SIZE)
+
+
+def _key(field: str, value: str) -> str:
+    return f'user_id:{field}:{hash_key(value)}'
+
+
+def _normalize(field: str, value) -> Optional[str]:
+    if field == 'uuid':
+        try:
+            return str(UUID(str(value)))
+        except ValueError:
+            return None
+    return value
+
+
+def cached_user_id(field: str, value: str) -> Optional[int]:
+    key = _key(field, value)
+    user_id = _local_user_ids.get(key)
+    if user_id is None:
+        user_id = cache.get(key)
+        if user_id is not None:
+            _local_user_ids.set(key, user_id)
+    return user_id
+
+
+def remember_user_id(field: str, value: str, user_id: int):
+    key = _key(field, value)
+    _local_user_ids.set(key, user_id)
+    cache.set(key, user_id, timeout=settings.USER_LOOKUP_CACHE_TIMEOUT)
+
+
+def forget_user_id(field: str, value: str):
+    """
+    Drops a resolution here and from redis, other processes find out theirs is
+    stale when the user it points to no longer has `value`
+    """
+    key = _key(field, value)
+    _local_user_ids.delete(key)
+    cache.delete(key)
+
+
+def get_user_by(queryset: QuerySet, field: str, value) -> Optional[User]:
+    """
+    The user of `queryset` whose `field` (one of `LOOKUP_FIELDS`) is `value`.
+    Once resolved, the id is cached in this process and in redis, so the next
+    lookups fetch the user by primary key. The field is still matched, which
+    catches resolutions gone stale since a handle changed.
+    """
+    assert field in LOOKUP_FIELDS, field
+    value = _normalize(field, value)
+    if value is None:
+        return None
+    user_id = cached_user_id(field, value)
+    if user_id is not None:
+        user = queryset.filter(pk=user_id, **{field: value}).first()
+        if user is not None:
+            return user
+        forget_user_id(field, value)
+    user = queryset.filter(**{field: value}).first()
+    if user is not None:
+        remember_user_id(field, value, user.id)
+    return user
+
+
+def get_user_id_by(field: str, value) -> Optional[int]:
+    """The id of the user whose `field` is `value`, see `get_user_by`"""
+    user = get_user_by(User.objects.only('id', field), field, value)
+    return user.id if user is not None else None
@@ -0,0 +1,50 @@
+import logging
+import time
+
+from authentication.models import User
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+
+from webservices.auth import CachedTokenAuthentication
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    Compare the per request latency of authenticating a token with the default
+    backend and with `CachedTokenAuthentication`, warm
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', dest='requests', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        count = options['requests']
+        user = User.objects.exclude(id=0).filter(is_active=True).order_by('id').first()
+        if user is None:
+            raise CommandError('No active users, see `simulate_dataset`')
+        token, _ = Token.objects.get_or_create(user=user)
+        request = Request(
+            RequestFactory().get('/', HTTP_AUTHORIZATION=f'Token {token.key}')
+        )
+
+        for backend in [TokenAuthentication(), CachedTokenAuthentication()]:
+            # NOTE: the first request fills the cache
+            backend.authenticate(request)
+            with CaptureQueriesContext(connection) as context:
+                t1 = time.perf_counter()
+                for _ in range(count):
+                    backend.authenticate(request)
+                t2 = time.perf_counter()
+            self.stdout.write(
+                f'{backend.__class__.__name__}: '
+                f'{(t2 - t1) / count * 1e6:.0f} us/request, '
+                f'{len(context.captured_queries) / count:.1f} queries/request '
+                f'(requests={count})'
+            )
@@ -0,0 +1,56 @@
+import logging
+import time
+
+from authentication.models import User
+from authentication.serializers import UserListSerializer, UserSerializer
+from django.core.management import BaseCommand
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    Compare rows per second of the user listing serializers, run it against a
+    simulated dataset (see `simulate_dataset`)
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page-size', dest='page_size', type=int, default=100)
+        parser.add_argument('--pages', dest='pages', type=int, default=50)
+
+    def handle(self, *args, **options):
+        page_size = options['page_size']
+        pages = options['pages']
+        queryset = User.objects.order_by('net_worth', 'id')
+        total = queryset.count()
+        if total < page_size * pages:
+            self.stdout.write(
+                self.style.WARNING(f'Only {total} users, pages will be repeated')
+            )
+
+        candidates = [
+            (UserSerializer, queryset.with_related_objects_selected()),
+            (
+                UserListSerializer,
+                UserListSerializer.project(queryset.with_financial_annotations()),
+            ),
+        ]
+        for serializer_class, rows in candidates:
+            query_time = 0.0
+            serialize_time = 0.0
+            for page in range(pages):
+                offset = (page * page_size) % max(total - page_size, 1)
+                t1 = time.time()
+                page_rows = list(rows[offset : offset + page_size])
+                t2 = time.time()
+                serializer_class(page_rows, many=True).data
+                t3 = time.time()
+                query_time += t2 - t1
+                serialize_time += t3 - t2
+            row_count = pages * page_size
+            self.stdout.write(
+                f'{serializer_class.__name__}: '
+                f'{round(row_count / (query_time + serialize_time))} rows/s overall, '
+                f'{round(row_count / serialize_time)} rows/s serializing only '
+                f'(page_size={page_size}, pages={pages})'
+            )
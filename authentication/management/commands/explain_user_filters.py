@@ -0,0 +1,76 @@
+import json
+import logging
+
+from authentication.plans import (
+    BASELINE_PATH,
+    DEFAULT_ROW_FRACTION,
+    check_plans,
+    load_baseline,
+    regressions,
+)
+from django.core.management import BaseCommand, CommandError
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    EXPLAIN the user list query of every case of `authentication.plans` and
+    report the sequential scans and large sorts, run it against a simulated
+    dataset (see `simulate_dataset`). Fails when a case has an issue that is
+    not in the baseline, `--update-baseline` accepts the current ones.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--analyze',
+            dest='analyze',
+            action='store_true',
+            help='Run the queries too, to catch index scans that read many rows',
+        )
+        parser.add_argument(
+            '--row-fraction',
+            dest='row_fraction',
+            type=float,
+            default=DEFAULT_ROW_FRACTION,
+            help='Share of the users a scan or sort may read before it is flagged',
+        )
+        parser.add_argument(
+            '--update-baseline',
+            dest='update_baseline',
+            action='store_true',
+            help=f'Write the current issues to {BASELINE_PATH.name}',
+        )
+        parser.add_argument(
+            '--plans',
+            dest='plans',
+            action='store_true',
+            help='Print the plans of the cases with issues',
+        )
+
+    def handle(self, *args, **options):
+        results = check_plans(options['row_fraction'], analyze=options['analyze'])
+        baseline = load_baseline()
+        for name, result in results.items():
+            issues = ', '.join(result['issues']) or 'ok'
+            self.stdout.write(f'{name}: {issues}')
+            if options['plans'] and result['issues']:
+                self.stdout.write(json.dumps(result['plan'], indent=2))
+
+        if options['update_baseline']:
+            baseline = {
+                name: result['issues']
+                for name, result in results.items()
+                if result['issues']
+            }
+            BASELINE_PATH.write_text(json.dumps(baseline, indent=2) + '\n')
+            self.stdout.write(self.style.SUCCESS(f'Updated {BASELINE_PATH}'))
+            return
+
+        found = regressions(results, baseline)
+        if found:
+            raise CommandError(
+                'Plan regressions: '
+                + '; '.join(f'{name}: {", ".join(new)}' for name, new in found.items())
+            )
+        self.stdout.write(self.style.SUCCESS('No plan regressions'))
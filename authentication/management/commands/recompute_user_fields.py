@@ -0,0 +1,87 @@
+import logging
+import multiprocessing
+import time
+
+from authentication.models import User, user_bitmaps
+from authentication.recompute import (
+    COMPUTED_COLUMNS,
+    merge_stats,
+    recompute_range,
+    split_id_range,
+)
+from authentication.rollups import invalidate_cohort_rollups
+from django.core.management import BaseCommand
+from django.db import connections
+
+from webservices.cache import bump_model_version
+
+logger = logging.getLogger(__name__)
+
+
+def _recompute_range(args):
+    first_id, last_id, chunk_size, dry_run = args
+    try:
+        return recompute_range(first_id, last_id, chunk_size, dry_run)
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    """
+    Recompute the computed fields of every user in bulk (see
+    `authentication.recompute`), use it after changing one of the
+    `User.recompute_*` formulas or adding a computed field
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', dest='chunk_size', type=int, default=5000)
+        parser.add_argument('--workers', dest='workers', type=int, default=1)
+        parser.add_argument(
+            '--dry-run',
+            dest='dry_run',
+            action='store_true',
+            help='Report what would change without writing it',
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        workers = max(options['workers'], 1)
+        dry_run = options['dry_run']
+
+        t1 = time.time()
+        tasks = [
+            (first_id, last_id, chunk_size, dry_run)
+            for first_id, last_id in split_id_range(workers)
+        ]
+        if workers == 1:
+            results = [recompute_range(*task) for task in tasks]
+        else:
+            # NOTE: forked workers must not share the parent's connection
+            connections.close_all()
+            context = multiprocessing.get_context('fork')
+            with context.Pool(workers) as pool:
+                results = pool.map(_recompute_range, tasks)
+        stats = merge_stats(results)
+        elapsed = time.time() - t1
+
+        if stats['changed_rows'] and not dry_run:
+            # NOTE: the writes bypass User.save
+            bump_model_version(User)
+            invalidate_cohort_rollups()
+            user_bitmaps.invalidate()
+
+        for name in COMPUTED_COLUMNS:
+            if stats['changed'][name]:
+                self.stdout.write(
+                    f'{name}: {stats["changed"][name]} rows, '
+                    f'max difference {stats["max_diff"][name]}'
+                )
+        verb = 'would change' if dry_run else 'changed'
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'{stats["changed_rows"]} of {stats["rows"]} users {verb} '
+                f'in {round(elapsed, 2)} seconds '
+                f'({round(stats["rows"] / max(elapsed, 1e-9))} rows/s, '
+                f'workers={workers})'
+            )
+        )
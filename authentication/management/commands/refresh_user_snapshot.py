@@ -0,0 +1,49 @@
+import logging
+import time
+
+from authentication.snapshot import refresh_user_snapshot
+from django.core.management import BaseCommand
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    Refresh the columnar user snapshot (see `authentication.snapshot`) with the
+    users updated since the last refresh. The files are local to the host, so
+    run it next to the web workers, e.g. with `--interval 60`
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            dest='full',
+            action='store_true',
+            help='Fetch every user instead of the ones updated since',
+        )
+        parser.add_argument(
+            '--interval',
+            dest='interval',
+            type=int,
+            default=None,
+            help='Keep refreshing every this many seconds',
+        )
+
+    def handle(self, *args, **options):
+        full = options['full']
+        interval = options['interval']
+        while True:
+            t1 = time.time()
+            result = refresh_user_snapshot(full=full)
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f'{"Rebuilt" if result["full"] else "Refreshed"} the user '
+                    f'snapshot, {result["changed"]} of {result["rows"]} users '
+                    f'fetched and {result["deleted"]} removed in '
+                    f'{round(time.time() - t1, 2)} seconds'
+                )
+            )
+            if interval is None:
+                return
+            full = False
+            time.sleep(interval)
@@ -1,6 +1,13 @@
 import logging
+import time
 
-from authentication.simulation import build_simulated_dataset
+from authentication.bitmaps import rebuild_user_bitmaps
+from authentication.rollups import rebuild_cohort_rollups
+from authentication.simulation import (
+    SCALE_PROFILES,
+    build_simulated_dataset,
+    copy_simulated_dataset,
+)
 from django.conf import settings
 from django.core.management import BaseCommand
 
@@ -12,6 +19,64 @@ class Command(BaseCommand):
     Build a simulated dataset for testing
     """
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--profile',
+            dest='profile',
+            choices=list(SCALE_PROFILES),
+            default='dev',
+            help='Scale of the dataset, see SCALE_PROFILES',
+        )
+        parser.add_argument(
+            '--users-per-metro',
+            dest='users_per_metro',
+            type=int,
+            default=None,
+            help='Overrides the users per metro of the profile',
+        )
+        parser.add_argument(
+            '--loader',
+            dest='loader',
+            choices=['copy', 'orm'],
+            default='copy',
+            help='COPY FROM STDIN, or UserFactory plus bulk_create',
+        )
+        parser.add_argument(
+            '--workers',
+            dest='workers',
+            type=int,
+            default=1,
+            help='Processes of the copy loader, the work is split by metro',
+        )
+        parser.add_argument('--seed', dest='seed', type=int, default=0)
+
     def handle(self, *args, **options):
         assert settings.IS_LOCAL
-        build_simulated_dataset()
+        users_per_metro = options['users_per_metro']
+        if users_per_metro is None:
+            users_per_metro = SCALE_PROFILES[options['profile']]['users_per_metro']
+        t1 = time.time()
+        if options['loader'] == 'copy':
+            users = copy_simulated_dataset(
+                users_per_metro, workers=options['workers'], seed=options['seed']
+            )
+        else:
+            users = build_simulated_dataset(users_per_metro, seed=options['seed'])
+        elapsed = time.time() - t1
+        self.stdout.write(
+            f'Simulation building time: {round(elapsed, 2)} seconds, '
+            f'{users} users ({round(users / elapsed)} rows/s)'
+        )
+
+        t1 = time.time()
+        result = rebuild_cohort_rollups()
+        self.stdout.write(
+            f'Cohort rollups building time: {round(time.time() - t1, 2)} seconds, '
+            f'{result["cells"]} cells'
+        )
+
+        t1 = time.time()
+        rebuild_user_bitmaps()
+        self.stdout.write(
+            f'User bitmaps building time: {round(time.time() - t1, 2)} seconds'
+        )
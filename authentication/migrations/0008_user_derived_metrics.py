@@ -0,0 +1,115 @@
+# Generated by Django 4.1.5 on 2026-10-18 02:51
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+# NOTE: mirrors User.recompute_fields, the tax rates are applied as floats
+#  like in the python properties
+BACKFILL_SQL = '''
+UPDATE users
+SET inc_total_monthly_net = round(net.total, 2),
+    inc_annual_tax_net = 100 - (
+        net.total * 12 / NULLIF(users.inc_total_annual, 0)
+    )::double precision * 100,
+    exp_total = users.exp_housing + users.exp_other_fixed + users.exp_other_variable,
+    sav_total = users.sav_market + users.sav_retirement,
+    sav_rate = (
+        (users.sav_market + users.sav_retirement) / NULLIF(round(net.total, 2), 0)
+    )::double precision * 100
+FROM (
+    SELECT
+        id,
+        inc_primary_annual * (
+            (1 - (inc_primary_tax_fed + inc_primary_tax_state) / 100) / 12
+        )::numeric
+        + inc_variable_monthly * (
+            1 - (inc_variable_tax_fed + inc_variable_tax_state) / 100
+        )::numeric
+        + inc_secondary_monthly * (
+            1 - (inc_secondary_tax_fed + inc_secondary_tax_state) / 100
+        )::numeric AS total
+    FROM users
+    WHERE id >= %s AND id < %s
+) AS net
+WHERE net.id = users.id
+'''
+BACKFILL_BATCH_SIZE = 10000
+
+
+def backfill(apps, schema_editor):
+    # NOTE: the migration is not atomic, every batch commits on its own and
+    #  only locks its rows
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('SELECT min(id), max(id) FROM users')
+        first, last = cursor.fetchone()
+        if first is None:
+            return
+        for start in range(first, last + 1, BACKFILL_BATCH_SIZE):
+            cursor.execute(BACKFILL_SQL, [start, start + BACKFILL_BATCH_SIZE])
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('authentication', '0007_resetpasswordlink_signuplink_waitlistentry_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='exp_total',
+            field=models.DecimalField(
+                decimal_places=2, default=None, max_digits=12, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='inc_annual_tax_net',
+            field=models.FloatField(default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='inc_total_monthly_net',
+            field=models.DecimalField(
+                decimal_places=2, default=None, max_digits=12, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='sav_rate',
+            field=models.FloatField(default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='sav_total',
+            field=models.DecimalField(
+                decimal_places=2, default=None, max_digits=12, null=True
+            ),
+        ),
+        migrations.RunPython(backfill, reverse_code=migrations.RunPython.noop),
+        AddIndexConcurrently(
+            model_name='user',
+            index=models.Index(fields=['exp_total'], name='users_exp_total'),
+        ),
+        AddIndexConcurrently(
+            model_name='user',
+            index=models.Index(
+                fields=['inc_annual_tax_net'], name='users_inc_annual_tax_net'
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name='user',
+            index=models.Index(
+                fields=['inc_total_monthly_net'], name='users_inc_total_monthly_net'
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name='user',
+            index=models.Index(fields=['sav_rate'], name='users_sav_rate'),
+        ),
+        AddIndexConcurrently(
+            model_name='user',
+            index=models.Index(fields=['sav_total'], name='users_sav_total'),
+        ),
+    ]
@@ -0,0 +1,98 @@
+# Generated by Django 4.1.5 on 2026-10-18 03:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("authentication", "0008_user_derived_metrics"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CohortRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created", models.DateTimeField(auto_now_add=True)),
+                ("updated", models.DateTimeField(auto_now=True)),
+                ("cell", models.CharField(max_length=64, unique=True)),
+                (
+                    "level",
+                    models.IntegerField(
+                        choices=[
+                            (1, "Individual Contributor, Associate"),
+                            (2, "Individual Contributor"),
+                            (3, "Individual Contributor, Senior"),
+                            (4, "Individual Contributor, Staff"),
+                            (5, "Individual Contributor, Principal"),
+                            (6, "Manager"),
+                            (7, "Director"),
+                            (8, "Director, Senior"),
+                            (9, "VP"),
+                            (10, "VP, Senior"),
+                            (11, "C-Suite"),
+                            (12, "Founder"),
+                        ],
+                        db_index=True,
+                        null=True,
+                    ),
+                ),
+                (
+                    "gender",
+                    models.CharField(
+                        choices=[
+                            ("male", "Male"),
+                            ("female", "Female"),
+                            ("transgender", "Transgender"),
+                            ("prefer_not_to_say", "Prefer not to say"),
+                        ],
+                        max_length=20,
+                        null=True,
+                    ),
+                ),
+                ("age_band", models.IntegerField(db_index=True, null=True)),
+                ("user_count", models.IntegerField(default=0)),
+                ("stats", models.JSONField(default=dict)),
+                (
+                    "industry",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="cohort_rollups",
+                        to="authentication.industry",
+                    ),
+                ),
+                (
+                    "job_title",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="cohort_rollups",
+                        to="authentication.jobtitle",
+                    ),
+                ),
+                (
+                    "metro",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="cohort_rollups",
+                        to="authentication.metropolitanarea",
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "cohort_rollups",
+            },
+        ),
+    ]
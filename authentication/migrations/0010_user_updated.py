@@ -0,0 +1,24 @@
+# Generated by Django 4.1.5 on 2026-10-18 03:30
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ("authentication", "0009_cohortrollup"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="updated",
+            field=models.DateTimeField(auto_now=True),
+        ),
+        AddIndexConcurrently(
+            model_name="user",
+            index=models.Index(fields=["updated"], name="users_updated"),
+        ),
+    ]
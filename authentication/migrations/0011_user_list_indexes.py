@@ -0,0 +1,34 @@
+# Generated by Django 4.1.5 on 2026-10-18 03:47
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ("authentication", "0010_user_updated"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="user",
+            index=models.Index(
+                fields=["-net_worth", "id"], name="users_net_worth_desc_id"
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="user",
+            index=models.Index(
+                fields=["metro", "net_worth", "id"], name="users_metro_net_worth_id"
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="user",
+            index=models.Index(
+                fields=["metro", "-net_worth", "id"],
+                name="users_metro_net_worth_desc_id",
+            ),
+        ),
+    ]
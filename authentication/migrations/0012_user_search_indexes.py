@@ -0,0 +1,57 @@
+# Generated by Django 4.1.5 on 2026-10-18 05:12
+
+import uuid
+
+from django.db import migrations, models
+
+HANDLE_TRIGRAM_INDEX = 'users_handle_upper_trgm'
+
+
+def create_handle_trigram_index(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        if cursor.fetchone() is None:
+            # NOTE: handle searches fall back to scans, and ranking to prefixes,
+            #  until pg_trgm is installed and this migration is run again
+            return
+        cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        # NOTE: matches the `UPPER(handle::text) LIKE UPPER(...)` of icontains
+        cursor.execute(
+            f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {HANDLE_TRIGRAM_INDEX} '
+            'ON users USING gin ((UPPER(handle::text)) gin_trgm_ops)'
+        )
+
+
+def drop_handle_trigram_index(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {HANDLE_TRIGRAM_INDEX}')
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ("authentication", "0011_user_list_indexes"),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name="user",
+                    name="uuid",
+                    field=models.UUIDField(
+                        db_index=True, default=uuid.uuid4, editable=False
+                    ),
+                ),
+            ],
+            database_operations=[
+                migrations.RunSQL(
+                    'CREATE INDEX CONCURRENTLY IF NOT EXISTS "users_uuid_7a3bf894" '
+                    'ON "users" ("uuid")',
+                    reverse_sql='DROP INDEX CONCURRENTLY IF EXISTS "users_uuid_7a3bf894"',
+                ),
+            ],
+        ),
+        migrations.RunPython(create_handle_trigram_index, drop_handle_trigram_index),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.1.5 on 2026-10-18 06:40
+
+import uuid
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ("authentication", "0012_user_search_indexes"),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name="user",
+                    name="uuid",
+                    field=models.UUIDField(
+                        default=uuid.uuid4, editable=False, unique=True
+                    ),
+                ),
+            ],
+            database_operations=[
+                migrations.RunSQL(
+                    'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS '
+                    '"users_uuid_7a3bf894_uniq" ON "users" ("uuid")',
+                    reverse_sql='ALTER TABLE "users" '
+                    'DROP CONSTRAINT IF EXISTS "users_uuid_7a3bf894_uniq"',
+                ),
+                migrations.RunSQL(
+                    'ALTER TABLE "users" ADD CONSTRAINT "users_uuid_7a3bf894_uniq" '
+                    'UNIQUE USING INDEX "users_uuid_7a3bf894_uniq"',
+                    reverse_sql=migrations.RunSQL.noop,
+                ),
+                migrations.RunSQL(
+                    'DROP INDEX CONCURRENTLY IF EXISTS "users_uuid_7a3bf894"',
+                    reverse_sql='CREATE INDEX CONCURRENTLY IF NOT EXISTS '
+                    '"users_uuid_7a3bf894" ON "users" ("uuid")',
+                ),
+            ],
+        ),
+    ]
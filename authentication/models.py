@@ -1,38 +1,105 @@
 from decimal import Decimal
-from typing import List, Optional
+from typing import Dict, Iterable, List, Optional
 from uuid import uuid4
 
 from django.conf import settings
 from django.contrib.auth.models import AbstractUser
 from django.contrib.auth.models import UserManager as BaseUserManager
+from django.core.cache import cache
 from django.db import models
-
-from webservices.models import SoftDeleteModelMixin, TimeStampedModel
+from django.db.models import DecimalField, ExpressionWrapper, F, Value
+
+from webservices.auth import forget_principal, forget_principals
+from webservices.bitmaps import BitmapIndex
+from webservices.cache import add_dirty_keys, bump_model_version
+from webservices.expressions import ToNumeric
+from webservices.models import (
+    DirtyFieldsModelMixin,
+    LazyDeferredFieldsMixin,
+    SoftDeleteModelMixin,
+    TimeStampedModel,
+    VersionedModelMixin,
+    annotatable_property,
+)
+
+
+class MetropolitanArea(VersionedModelMixin, TimeStampedModel):
+    name: str = models.CharField(max_length=128, blank=False, null=False, unique=True)
 
 
-class MetropolitanArea(TimeStampedModel):
+class Industry(VersionedModelMixin, TimeStampedModel):
     name: str = models.CharField(max_length=128, blank=False, null=False, unique=True)
 
 
-class Industry(TimeStampedModel):
+class JobTitle(VersionedModelMixin, TimeStampedModel):
     name: str = models.CharField(max_length=128, blank=False, null=False, unique=True)
 
 
-class JobTitle(TimeStampedModel):
-    name: str = models.CharField(max_length=128, blank=False, null=False, unique=True)
+# NOTE: width in years of the age bands of the cohort rollups
+COHORT_AGE_BAND = 10
+# NOTE: stands in for a dimension that was not loaded, see get_dirty_cohort_cells
+COHORT_UNKNOWN = '*'
+
+
+def cohort_cell(metro_id, industry_id, job_title_id, level, gender, age) -> str:
+    """Key of the `CohortRollup` cell of a user with these dimensions"""
+    if age is None or age == COHORT_UNKNOWN:
+        age_band = age
+    else:
+        age_band = age // COHORT_AGE_BAND * COHORT_AGE_BAND
+    return ':'.join(
+        '' if value is None else str(value)
+        for value in [metro_id, industry_id, job_title_id, level, gender, age_band]
+    )
+
+
+def _monthly_net(amount: str, tax_fed: str, tax_state: str, months: int = 1):
+    # NOTE: like the python properties, the net rate is computed as a float and
+    #  then converted to a decimal before it is applied
+    rate = Value(1.0) - (F(tax_fed) + F(tax_state)) / Value(100.0)
+    if months != 1:
+        rate = rate / Value(float(months))
+    return ExpressionWrapper(F(amount) * ToNumeric(rate), output_field=DecimalField())
 
 
 class UserQuerySet(models.QuerySet):
     def with_related_objects_selected(self):
         return self.select_related('metro', 'industry', 'job_title', 'chat_user')
 
+    def with_financial_annotations(self):
+        """
+        Computes the net income properties of User in the database, any missing
+        input makes the value NULL just like the properties return None
+        """
+        return self.annotate(
+            inc_primary_monthly_net=_monthly_net(
+                'inc_primary_annual',
+                'inc_primary_tax_fed',
+                'inc_primary_tax_state',
+                months=12,
+            ),
+            inc_variable_monthly_net=_monthly_net(
+                'inc_variable_monthly', 'inc_variable_tax_fed', 'inc_variable_tax_state'
+            ),
+            inc_secondary_monthly_net=_monthly_net(
+                'inc_secondary_monthly',
+                'inc_secondary_tax_fed',
+                'inc_secondary_tax_state',
+            ),
+        )
+
 
 class UserManager(BaseUserManager):
     def get_queryset(self):
         return UserQuerySet(self.model, using=self._db)
 
 
-class User(AbstractUser, SoftDeleteModelMixin):
+class User(
+    LazyDeferredFieldsMixin,
+    DirtyFieldsModelMixin,
+    AbstractUser,
+    SoftDeleteModelMixin,
+):
     class GenderChoices(models.TextChoices):
         MALE = 'male', 'Male'
         FEMALE = 'female', 'Female'
@@ -63,8 +130,10 @@ class User(AbstractUser, SoftDeleteModelMixin):
         NONE = 'none', 'None'
 
     # for profile urls
-    uuid = models.UUIDField(default=uuid4, editable=False, null=False)
+    uuid = models.UUIDField(default=uuid4, editable=False, null=False, unique=True)
     email_verified = models.BooleanField(default=False)
+    # NOTE: bulk writes set it too, the user snapshot refreshes from it
+    updated = models.DateTimeField(auto_now=True)
 
     # profile setup
     handle: Optional[str] = models.CharField(
@@ -133,7 +202,19 @@ class User(AbstractUser, SoftDeleteModelMixin):
     net_monthly_profit_loss: Optional[Decimal] = models.DecimalField(
         default=None, max_digits=12, decimal_places=2, null=True, db_index=True
     )
-    # TODO: add total expenses, total savings
+    inc_total_monthly_net: Optional[Decimal] = models.DecimalField(
+        default=None, max_digits=12, decimal_places=2, null=True
+    )
+    # percentage of the total annual income that goes to taxes
+    inc_annual_tax_net: Optional[float] = models.FloatField(default=None, null=True)
+    exp_total: Optional[Decimal] = models.DecimalField(
+        default=None, max_digits=12, decimal_places=2, null=True
+    )
+    sav_total: Optional[Decimal] = models.DecimalField(
+        default=None, max_digits=12, decimal_places=2, null=True
+    )
+    # percentage of the total monthly net income that goes to savings
+    sav_rate: Optional[float] = models.FloatField(default=None, null=True)
 
     # net worth
     # assets
@@ -169,8 +250,120 @@ class User(AbstractUser, SoftDeleteModelMixin):
 
     objects = UserManager()
 
+    # NOTE: see UserQuerySet.with_financial_annotations
+    FINANCIAL_ANNOTATIONS = [
+        'inc_primary_monthly_net',
+        'inc_variable_monthly_net',
+        'inc_secondary_monthly_net',
+    ]
+    # NOTE: see recompute_fields, saves that change none of these skip it
+    RECOMPUTE_FIELDS = frozenset(
+        [
+            'inc_primary_annual',
+            'inc_primary_tax_fed',
+            'inc_primary_tax_state',
+            'inc_variable_monthly',
+            'inc_variable_tax_fed',
+            'inc_variable_tax_state',
+            'inc_secondary_monthly',
+            'inc_secondary_tax_fed',
+            'inc_secondary_tax_state',
+            'exp_housing',
+            'exp_other_fixed',
+            'exp_other_variable',
+            'sav_retirement',
+            'sav_market',
+            'assets_savings',
+            'assets_property',
+            'assets_misc',
+            'lia_loans',
+            'lia_credit_card',
+            'lia_misc',
+            # computed fields, so they are put back if set directly
+            'inc_total_annual',
+            'net_monthly_profit_loss',
+            'inc_total_monthly_net',
+            'inc_annual_tax_net',
+            'exp_total',
+            'sav_total',
+            'sav_rate',
+            'assets_total',
+            'lia_total',
+            'net_worth',
+        ]
+    )
+    # NOTE: no cached users payload depends on these, see save
+    CACHE_EXEMPT_FIELDS = frozenset(['password', 'last_login', 'updated'])
+    # NOTE: see CohortRollup, in the order of `cohort_cell`
+    COHORT_DIMENSIONS = ['metro', 'industry', 'job_title', 'level', 'gender', 'age']
+    COHORT_STATS_FIELDS = [
+        'age',
+        'inc_primary_annual',
+        'inc_total_annual',
+        'inc_total_monthly_net',
+        'inc_annual_tax_net',
+        'net_monthly_profit_loss',
+        'exp_housing',
+        'exp_total',
+        'sav_total',
+        'sav_rate',
+        'assets_total',
+        'lia_total',
+        'net_worth',
+    ]
+    # NOTE: what authentication loads of a user, enough for the permission
+    #  checks and the percentiles of the user, the rest loads at the first
+    #  read, see webservices.auth
+    PRINCIPAL_FIELDS = [
+        'id',
+        'uuid',
+        'username',
+        'handle',
+        'email',
+        'email_verified',
+        'is_active',
+        'is_staff',
+        'is_superuser',
+        'updated',
+        *COHORT_STATS_FIELDS,
+    ]
+    # NOTE: see user_bitmaps
+    BITMAP_DIMENSIONS = [
+        'metro',
+        'industry',
+        'job_title',
+        'level',
+        'gender',
+        'current_pfm',
+    ]
+
     class Meta:
         db_table = 'users'
+        # NOTE: net worth is the default order of the user list and metro its
+        #  most common filter, see authentication.plans for the cases checked
+        indexes = [
+            models.Index(fields=['-net_worth', 'id'], name='users_net_worth_desc_id'),
+            models.Index(
+                fields=['metro', 'net_worth', 'id'], name='users_metro_net_worth_id'
+            ),
+            models.Index(
+                fields=['metro', '-net_worth', 'id'],
+                name='users_metro_net_worth_desc_id',
+            ),
+            # NOTE: the delta refreshes of authentication.snapshot
+            models.Index(fields=['updated'], name='users_updated'),
+            # NOTE: the stored derived metrics, built concurrently by
+            #  0008_user_derived_metrics
+            models.Index(fields=['exp_total'], name='users_exp_total'),
+            models.Index(
+                fields=['inc_annual_tax_net'], name='users_inc_annual_tax_net'
+            ),
+            models.Index(
+                fields=['inc_total_monthly_net'], name='users_inc_total_monthly_net'
+            ),
+            models.Index(fields=['sav_rate'], name='users_sav_rate'),
+            models.Index(fields=['sav_total'], name='users_sav_total'),
+        ]
 
     def recompute_inc_total_annual(self) -> bool:
         if (
@@ -235,6 +428,81 @@ class User(AbstractUser, SoftDeleteModelMixin):
             self.net_monthly_profit_loss = None
         return changed
 
+    def recompute_inc_total_monthly_net(self) -> bool:
+        net_primary = self.inc_primary_monthly_net
+        net_variable = self.inc_variable_monthly_net
+        net_secondary = self.inc_secondary_monthly_net
+        if (
+            net_primary is not None
+            and net_variable is not None
+            and net_secondary is not None
+        ):
+            new_value = (net_primary + net_variable + net_secondary).quantize(
+                Decimal('0.01')
+            )
+            changed = new_value != self.inc_total_monthly_net
+            self.inc_total_monthly_net = new_value
+        else:
+            changed = self.inc_total_monthly_net is not None
+            self.inc_total_monthly_net = None
+        return changed
+
+    def recompute_inc_annual_tax_net(self) -> bool:
+        net_primary = self.inc_primary_monthly_net
+        net_variable = self.inc_variable_monthly_net
+        net_secondary = self.inc_secondary_monthly_net
+        # NOTE: no income means no tax rate, rather than a division by zero
+        if (
+            self.inc_total_annual
+            and net_primary is not None
+            and net_variable is not None
+            and net_secondary is not None
+        ):
+            total_net = (net_primary + net_variable + net_secondary) * Decimal('12')
+            new_value = 100 - float(total_net / self.inc_total_annual) * 100
+            changed = new_value != self.inc_annual_tax_net
+            self.inc_annual_tax_net = new_value
+        else:
+            changed = self.inc_annual_tax_net is not None
+            self.inc_annual_tax_net = None
+        return changed
+
+    def recompute_exp_total(self) -> bool:
+        if (
+            self.exp_housing is not None
+            and self.exp_other_fixed is not None
+            and self.exp_other_variable is not None
+        ):
+            new_value = (
+                self.exp_housing + self.exp_other_fixed + self.exp_other_variable
+            )
+            changed = new_value != self.exp_total
+            self.exp_total = new_value
+        else:
+            changed = self.exp_total is not None
+            self.exp_total = None
+        return changed
+
+    def recompute_sav_total(self) -> bool:
+        if self.sav_market is not None and self.sav_retirement is not None:
+            new_value = self.sav_market + self.sav_retirement
+            changed = new_value != self.sav_total
+            self.sav_total = new_value
+        else:
+            changed = self.sav_total is not None
+            self.sav_total = None
+        return changed
+
+    def recompute_sav_rate(self) -> bool:
+        if self.inc_total_monthly_net and self.sav_total is not None:
+            new_value = float(self.sav_total / self.inc_total_monthly_net) * 100
+            changed = new_value != self.sav_rate
+            self.sav_rate = new_value
+        else:
+            changed = self.sav_rate is not None
+            self.sav_rate = None
+        return changed
+
     def recompute_assets_total(self) -> bool:
         if (
             self.assets_savings is not None
@@ -279,6 +547,17 @@ class User(AbstractUser, SoftDeleteModelMixin):
             update_fields.append('inc_total_annual')
         if self.recompute_net_monthly_profit_loss():
             update_fields.append('net_monthly_profit_loss')
+        if self.recompute_inc_total_monthly_net():
+            update_fields.append('inc_total_monthly_net')
+        if self.recompute_inc_annual_tax_net():
+            update_fields.append('inc_annual_tax_net')
+        if self.recompute_exp_total():
+            update_fields.append('exp_total')
+        if self.recompute_sav_total():
+            update_fields.append('sav_total')
+        # NOTE: depends on inc_total_monthly_net and sav_total
+        if self.recompute_sav_rate():
+            update_fields.append('sav_rate')
         if self.recompute_assets_total():
             update_fields.append('assets_total')
         if self.recompute_lia_total():
@@ -287,7 +566,7 @@ class User(AbstractUser, SoftDeleteModelMixin):
             update_fields.append('net_worth')
         return update_fields
 
-    @property
+    @annotatable_property
     def inc_primary_monthly_net(self) -> Optional[Decimal]:
         if (
             self.inc_primary_annual is not None
@@ -299,7 +578,7 @@ class User(AbstractUser, SoftDeleteModelMixin):
             )
         return None
 
-    @property
+    @annotatable_property
     def inc_variable_monthly_net(self) -> Optional[Decimal]:
         if (
             self.inc_variable_monthly is not None
@@ -311,7 +590,7 @@ class User(AbstractUser, SoftDeleteModelMixin):
             )
         return None
 
-    @property
+    @annotatable_property
     def inc_secondary_monthly_net(self) -> Optional[Decimal]:
         if (
             self.inc_secondary_monthly is not None
@@ -324,47 +603,184 @@ class User(AbstractUser, SoftDeleteModelMixin):
         return None
 
     @property
-    def inc_total_monthly_net(self) -> Optional[Decimal]:
-        net_primary = self.inc_primary_monthly_net
-        net_variable = self.inc_variable_monthly_net
-        net_secondary = self.inc_secondary_monthly_net
-        if (
-            net_primary is not None
-            and net_variable is not None
-            and net_secondary is not None
+    def cohort_cell(self) -> str:
+        return cohort_cell(
+            self.metro_id,
+            self.industry_id,
+            self.job_title_id,
+            self.level,
+            self.gender,
+            self.age,
+        )
+
+    def get_bitmap_values(self) -> Dict[str, str]:
+        """Encoded values of the loaded `BITMAP_DIMENSIONS`"""
+        deferred = self.get_deferred_fields()
+        values = {}
+        for name in self.BITMAP_DIMENSIONS:
+            attname = self._meta.get_field(name).attname
+            if attname not in deferred:
+                values[name] = BitmapIndex.encode(getattr(self, attname))
+        return values
+
+    def get_dirty_cohort_cells(self) -> List[str]:
+        """
+        Cohort rollup cells the pending save changes, see save. With deferred
+        dimensions that is `<id>@<previous cell>`, the unknown dimensions are
+        filled in from the user when the rollups are refreshed.
+        """
+        if self._state.adding:
+            return [self.cohort_cell]
+        dirty = self.get_dirty_fields()
+        if not set(dirty).intersection(
+            self.COHORT_DIMENSIONS + self.COHORT_STATS_FIELDS
         ):
-            return net_primary + net_variable + net_secondary
-        return None
-
-    @property
-    def inc_annual_tax_net(self) -> Optional[float]:
-        monthly_total_net = self.inc_total_monthly_net
-        if self.inc_total_annual is not None and monthly_total_net is not None:
-            total_net = monthly_total_net * Decimal('12')
-            return 100 - float(total_net / self.inc_total_annual) * 100
-        return None
+            return []
+        # NOTE: a user that moved leaves their previous cell too
+        deferred = self.get_deferred_fields()
+        current, previous = [], []
+        for name in self.COHORT_DIMENSIONS:
+            attname = self._meta.get_field(name).attname
+            if attname in deferred:
+                # reading it would query, and it cannot have changed
+                current.append(COHORT_UNKNOWN)
+                previous.append(COHORT_UNKNOWN)
+            else:
+                current.append(getattr(self, attname))
+                previous.append(dirty.get(name, current[-1]))
+        if COHORT_UNKNOWN in current:
+            return [f'{self.pk}@{cohort_cell(*previous)}']
+        return list({cohort_cell(*current), cohort_cell(*previous)})
 
-    @property
-    def exp_total(self) -> Optional[Decimal]:
+    def save(self, update_fields=None, *args, **kwargs) -> 'User':
+        # annotated values may be stale now, fall back to the python properties
+        for name in self.FINANCIAL_ANNOTATIONS:
+            delattr(self, name)
+        if self._state.adding or self.RECOMPUTE_FIELDS.intersection(
+            self.get_dirty_fields()
+        ):
+            recompute_update_fields = self.recompute_fields()
+            if update_fields is not None:
+                update_fields.extend(recompute_update_fields)
+        adding = self._state.adding
+        dirty_cohort_cells = self.get_dirty_cohort_cells()
+        dirty = self.get_dirty_fields()
+        previous_bitmap_values = {
+            name: BitmapIndex.encode(dirty[name])
+            for name in self.BITMAP_DIMENSIONS
+            if name in dirty
+            and not adding
+            and (
+                update_fields is None
+                or {name, self._meta.get_field(name).attname}.intersection(
+                    update_fields
+                )
+            )
+        }
+        if update_fields is None:
+            update_fields = self.get_save_update_fields()
+        elif 'updated' not in update_fields and set(update_fields).difference(
+            self.CACHE_EXEMPT_FIELDS
+        ):
+            update_fields = [*update_fields, 'updated']
+        result = super().save(update_fields=update_fields, *args, **kwargs)
+        if update_fields == []:
+            # NOTE: nothing was written, so nothing cached is stale either
+            return result
+        # refreshed by the refresh_cohort_rollups task
+        add_dirty_keys(CohortRollup.DIRTY_KEYS, dirty_cohort_cells)
+        if adding or previous_bitmap_values:
+            bitmap_values = self.get_bitmap_values()
+            user_bitmaps.update(
+                self.pk,
+                previous_bitmap_values,
+                bitmap_values
+                if adding
+                else {name: bitmap_values[name] for name in previous_bitmap_values},
+            )
+        # invalidates cached counts and pages for the users table
         if (
-            self.exp_housing is not None
-            and self.exp_other_fixed is not None
-            and self.exp_other_variable is not None
+            adding
+            or update_fields is None
+            or set(update_fields).difference(self.CACHE_EXEMPT_FIELDS)
         ):
-            return self.exp_housing + self.exp_other_fixed + self.exp_other_variable
-        return None
-
-    @property
-    def sav_total(self) -> Optional[Decimal]:
-        if self.sav_market is not None and self.sav_retirement is not None:
-            return self.sav_market + self.sav_retirement
-        return None
+            bump_model_version(User)
+        # NOTE: includes password and is_active changes, see CachedTokenAuthentication
+        forget_principal(self.pk)
+        cache.delete(profile_cache_key(self.pk))
+        return result
+
+    def delete(self, *args, **kwargs):
+        cell = self.cohort_cell
+        user_id = self.pk
+        bitmap_values = self.get_bitmap_values()
+        result = super().delete(*args, **kwargs)
+        add_dirty_keys(CohortRollup.DIRTY_KEYS, [cell])
+        user_bitmaps.remove(user_id, bitmap_values)
+        forget_principal(user_id)
+        cache.delete(profile_cache_key(user_id))
+        return result
+
+
+# NOTE: kept up to date by User.save, see authentication.bitmaps
+user_bitmaps = BitmapIndex('users', User.BITMAP_DIMENSIONS)
+
+
+def profile_cache_key(user_id: int) -> str:
+    """The cached `ProfileView` payload of a user, dropped when it changes"""
+    return f'profile:{user_id}'
+
+
+def forget_cached_users(user_ids: Iterable[int]):
+    """
+    Drops the cached principal and profile of users written without
+    `User.save`, like `User.save` does for one user
+    """
+    user_ids = list(user_ids)
+    if user_ids:
+        forget_principals(user_ids)
+        cache.delete_many([profile_cache_key(user_id) for user_id in user_ids])
+
+
+class CohortRollup(TimeStampedModel):
+    """
+    Counts, sums, extremes and quantile sketches of `User.COHORT_STATS_FIELDS`
+    over the users of one cell of metro, industry, job title, level, gender and
+    age band, see authentication.rollups
+    """
+
+    # NOTE: cells changed since the last refresh, see webservices.cache
+    DIRTY_KEYS = 'cohort_rollups'
+
+    # see cohort_cell, NULL dimensions are part of the key
+    cell: str = models.CharField(max_length=64, unique=True)
+    metro: Optional[MetropolitanArea] = models.ForeignKey(
+        to=MetropolitanArea,
+        related_name='cohort_rollups',
+        on_delete=models.CASCADE,
+        null=True,
+    )
+    industry: Optional[Industry] = models.ForeignKey(
+        to=Industry, related_name='cohort_rollups', on_delete=models.CASCADE, null=True
+    )
+    job_title: Optional[JobTitle] = models.ForeignKey(
+        to=JobTitle, related_name='cohort_rollups', on_delete=models.CASCADE, null=True
+    )
+    level: Optional[int] = models.IntegerField(
+        choices=User.LevelChoices.choices, null=True, db_index=True
+    )
+    gender: Optional[str] = models.CharField(
+        choices=User.GenderChoices.choices, null=True, max_length=20
+    )
+    # lower bound of the COHORT_AGE_BAND years wide band
+    age_band: Optional[int] = models.IntegerField(null=True, db_index=True)
+    user_count: int = models.IntegerField(default=0)
+    # field name -> count, sum, min, max and a QuantileSketch of the non null
+    #  values of the field
+    stats: dict = models.JSONField(default=dict)
 
-    def save(self, update_fields=None, *args, **kwargs) -> 'User':
-        recompute_update_fields = self.recompute_fields()
-        if update_fields is not None:
-            update_fields.extend(recompute_update_fields)
-        return super().save(update_fields=update_fields, *args, **kwargs)
+    class Meta:
+        db_table = 'cohort_rollups'
 
 
 class ChatUser(TimeStampedModel, SoftDeleteModelMixin):
@@ -380,6 +796,19 @@ class ChatUser(TimeStampedModel, SoftDeleteModelMixin):
     secret = models.CharField(max_length=128, editable=False, null=False)
     agreed_to_terms = models.BooleanField(default=False)
 
+    # NOTE: chat users are nested in user payloads, so they share the users
+    #  cache version, and the profile of their user
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        bump_model_version(User)
+        cache.delete(profile_cache_key(self.user_id))
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        bump_model_version(User)
+        cache.delete(profile_cache_key(self.user_id))
+        return result
+
 
 class ReportedMisconduct(TimeStampedModel):
     plaintiff = models.ForeignKey(
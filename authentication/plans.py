@@ -0,0 +1,160 @@
+import json
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from authentication.filters import UserFilter
+from authentication.models import User
+from authentication.serializers import UserListSerializer
+from django.db import connection, transaction
+from django.db.models import Count, QuerySet
+
+# NOTE: representative `UserFilter` params and orderings of the user list, as
+#  (name, params, order_by). Add the new combinations the clients send here.
+PLAN_CASES: List[Tuple[str, Dict[str, str], str]] = [
+    ('default', {}, 'net_worth'),
+    ('default_desc', {}, '-net_worth'),
+    ('order_by_income', {}, '-inc_total_annual'),
+    ('order_by_age', {}, 'age'),
+    ('metro', dict(metro__in='{metro}'), 'net_worth'),
+    ('metro_desc', dict(metro__in='{metro}'), '-net_worth'),
+    ('metro_by_income', dict(metro__in='{metro}'), '-inc_total_annual'),
+    (
+        'metro_industry',
+        dict(metro__in='{metro}', industry__in='{industry}'),
+        'net_worth',
+    ),
+    ('metro_level', dict(metro__in='{metro}', level__in='3'), 'net_worth'),
+    (
+        'metro_age_range',
+        dict(metro__in='{metro}', age__gte='30', age__lt='40'),
+        'net_worth',
+    ),
+    ('industry', dict(industry__in='{industry}'), '-net_worth'),
+    ('job_title', dict(job_title__in='{job_title}'), 'net_worth'),
+    ('net_worth_range', dict(net_worth__gte='1000000'), 'net_worth'),
+    ('income_range', dict(inc_total_annual__gte='250000'), '-inc_total_annual'),
+    ('age_range', dict(age__gte='60'), 'net_worth'),
+    ('savings_rate', dict(sav_rate__gte='0.5'), 'net_worth'),
+    ('gender', dict(gender__in='female'), 'net_worth'),
+]
+PAGE_SIZE = 20
+# NOTE: scans and sorts of fewer users than this share of the table are fine,
+#  relative so that one baseline holds for any size of simulated dataset
+DEFAULT_ROW_FRACTION = 0.05
+BASELINE_PATH = Path(__file__).resolve().parent / 'plan_baseline.json'
+
+
+def common_ids() -> Dict[str, int]:
+    """The metro, industry and job title ids with the most users"""
+    ids = {}
+    for name in ['metro', 'industry', 'job_title']:
+        row = (
+            User.objects.exclude(**{f'{name}_id': None})
+            .values_list(f'{name}_id')
+            .annotate(count=Count('id'))
+            .order_by('-count', f'{name}_id')
+            .first()
+        )
+        ids[name] = row[0] if row else 0
+    return ids
+
+
+def user_list_queryset(params: Dict[str, str], order_by: str) -> QuerySet:
+    """The first page of the user list, as `UserListView` queries it"""
+    filterset = UserFilter(
+        params, queryset=User.objects.all().with_financial_annotations()
+    )
+    if not filterset.is_valid():
+        raise ValueError(filterset.errors)
+    queryset = filterset.qs.exclude(id=0).order_by(order_by, 'id')
+    return UserListSerializer.project(queryset)[:PAGE_SIZE]
+
+
+def explain(
+    queryset: QuerySet, analyze: bool = False, settings: Optional[Dict] = None
+) -> dict:
+    """
+    The `EXPLAIN (FORMAT JSON)` plan of `queryset`, run when `analyze`, with the
+    planner `settings` (e.g. `enable_seqscan=off`) applied to this query only
+    """
+    sql, params = queryset.query.sql_with_params()
+    options = 'ANALYZE, FORMAT JSON' if analyze else 'FORMAT JSON'
+    with transaction.atomic(), connection.cursor() as cursor:
+        for name, value in (settings or {}).items():
+            cursor.execute('SELECT set_config(%s, %s, true)', [name, value])
+        cursor.execute(f'EXPLAIN ({options}) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']
+
+
+def table_rows() -> int:
+    """Row estimate of `users` as of its last ANALYZE"""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT reltuples FROM pg_class WHERE relname = 'users'")
+        return max(int(cursor.fetchone()[0]), 0)
+
+
+def _nodes(node: dict) -> Iterator[dict]:
+    yield node
+    for child in node.get('Plans', []):
+        yield from _nodes(child)
+
+
+def plan_issues(plan: dict, row_threshold: float) -> List[str]:
+    """
+    Sequential scans of `users`, and sorts of at least `row_threshold` rows as
+    estimated. With an analyzed plan, also scans of `users` that read at least
+    `row_threshold` rows, e.g. an index walked past most of its entries to find
+    the few that match a filter.
+    """
+    issues = []
+    for node in _nodes(plan):
+        if node.get('Relation Name') == 'users':
+            if node['Node Type'] == 'Seq Scan':
+                issues.append('seq scan')
+            elif 'Actual Rows' in node:
+                read = node['Actual Rows'] + node.get('Rows Removed by Filter', 0)
+                if read * node['Actual Loops'] >= row_threshold:
+                    issues.append(f'{node["Node Type"].lower()} reading many rows')
+        elif node['Node Type'] == 'Sort':
+            # NOTE: a top-N sort outputs the limit, its input is what it sorts
+            if max(child['Plan Rows'] for child in node['Plans']) >= row_threshold:
+                issues.append(f'sort of {node["Sort Key"][0]}')
+    return sorted(set(issues))
+
+
+def check_plans(
+    row_fraction: float = DEFAULT_ROW_FRACTION,
+    analyze: bool = False,
+    settings: Optional[Dict] = None,
+) -> Dict[str, dict]:
+    """The plan and `plan_issues` of every one of `PLAN_CASES`"""
+    row_threshold = max(row_fraction * table_rows(), 1)
+    ids = common_ids()
+    results = {}
+    for name, params, order_by in PLAN_CASES:
+        params = {key: value.format(**ids) for key, value in params.items()}
+        plan = explain(user_list_queryset(params, order_by), analyze, settings)
+        results[name] = dict(plan=plan, issues=plan_issues(plan, row_threshold))
+    return results
+
+
+def load_baseline(path: Path = BASELINE_PATH) -> Dict[str, List[str]]:
+    try:
+        return json.loads(path.read_text())
+    except FileNotFoundError:
+        return {}
+
+
+def regressions(
+    results: Dict[str, dict], baseline: Dict[str, List[str]]
+) -> Dict[str, List[str]]:
+    """The issues of every case that its baseline does not have"""
+    found = {}
+    for name, result in results.items():
+        new = sorted(set(result['issues']).difference(baseline.get(name, [])))
+        if new:
+            found[name] = new
+    return found
@@ -0,0 +1,302 @@
+from collections import Counter
+from decimal import Decimal
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from authentication.models import forget_cached_users
+from django.db import connection, transaction
+from psycopg2.extras import execute_values
+
+# NOTE: mirrors User.recompute_fields over whole columns at a time, NaN stands
+#  in for NULL so missing inputs propagate like the `is not None` checks
+INPUT_COLUMNS = [
+    'inc_primary_annual',
+    'inc_primary_tax_fed',
+    'inc_primary_tax_state',
+    'inc_variable_monthly',
+    'inc_variable_tax_fed',
+    'inc_variable_tax_state',
+    'inc_secondary_monthly',
+    'inc_secondary_tax_fed',
+    'inc_secondary_tax_state',
+    'exp_housing',
+    'exp_other_fixed',
+    'exp_other_variable',
+    'sav_retirement',
+    'sav_market',
+    'assets_savings',
+    'assets_property',
+    'assets_misc',
+    'lia_loans',
+    'lia_credit_card',
+    'lia_misc',
+]
+DECIMAL_COLUMNS = [
+    'inc_total_annual',
+    'net_monthly_profit_loss',
+    'inc_total_monthly_net',
+    'exp_total',
+    'sav_total',
+    'assets_total',
+    'lia_total',
+    'net_worth',
+]
+FLOAT_COLUMNS = ['inc_annual_tax_net', 'sav_rate']
+COMPUTED_COLUMNS = DECIMAL_COLUMNS + FLOAT_COLUMNS
+
+# NOTE: stored decimals have 2 places, anything under half a cent is noise
+DECIMAL_TOLERANCE = 0.005
+FLOAT_TOLERANCE = 1e-9
+
+
+def _all_present(*arrays: np.ndarray) -> np.ndarray:
+    mask = np.ones(arrays[0].shape, dtype=bool)
+    for array in arrays:
+        mask &= ~np.isnan(array)
+    return mask
+
+
+def _cents(values: np.ndarray) -> np.ndarray:
+    return np.round(values, 2)
+
+
+def _net_cents(
+    values: np.ndarray, terms: Sequence[Tuple[np.ndarray, np.ndarray]]
+) -> np.ndarray:
+    """
+    Cents of a sum of `amount * rate` terms, as the python properties compute
+    it with `amount * Decimal(rate)`
+    """
+    rounded = _cents(values)
+    # NOTE: the float product only rounds differently next to a half cent, the
+    #  rates are plain floats either way so those rows are redone in Decimal
+    with np.errstate(invalid='ignore'):
+        scaled = values * 100
+        near_tie = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-4
+    for i in np.flatnonzero(near_tie):
+        total = sum(
+            Decimal(f'{amount[i]:.2f}') * Decimal(float(rate[i]))
+            for amount, rate in terms
+        )
+        rounded[i] = float(total.quantize(Decimal('0.01')))
+    return rounded
+
+
+def recompute_columns(c: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """
+    Computed columns for a chunk of users, `c` maps every input column to a
+    float64 array
+    """
+    nan = np.nan
+    # silences the warnings of NaN and zero inputs, they are masked below
+    with np.errstate(invalid='ignore', divide='ignore'):
+        inc_total_annual = (
+            c['inc_primary_annual']
+            + c['inc_variable_monthly'] * 12
+            + c['inc_secondary_monthly'] * 12
+        )
+
+        # NOTE: keeps the quirks of recompute_net_monthly_profit_loss, the
+        #  state taxes are added back and the secondary income uses the state
+        #  tax of the variable income
+        old_rates = [
+            (1 - c['inc_primary_tax_fed'] / 100 + c['inc_primary_tax_state'] / 100)
+            / 12,
+            1 - c['inc_variable_tax_fed'] / 100 + c['inc_variable_tax_state'] / 100,
+            1 - c['inc_secondary_tax_fed'] / 100 + c['inc_variable_tax_state'] / 100,
+        ]
+        rates = [
+            (1 - (c['inc_primary_tax_fed'] + c['inc_primary_tax_state']) / 100) / 12,
+            1 - (c['inc_variable_tax_fed'] + c['inc_variable_tax_state']) / 100,
+            1 - (c['inc_secondary_tax_fed'] + c['inc_secondary_tax_state']) / 100,
+        ]
+        amounts = [
+            c['inc_primary_annual'],
+            c['inc_variable_monthly'],
+            c['inc_secondary_monthly'],
+        ]
+        outgoings = [
+            c[name]
+            for name in [
+                'exp_housing',
+                'exp_other_fixed',
+                'exp_other_variable',
+                'sav_retirement',
+                'sav_market',
+            ]
+        ]
+        exp_total = c['exp_housing'] + c['exp_other_fixed'] + c['exp_other_variable']
+        sav_total = c['sav_retirement'] + c['sav_market']
+        net_monthly_profit_loss = _net_cents(
+            np.where(
+                _all_present(*(c[name] for name in INPUT_COLUMNS[:14])),
+                sum(amount * rate for amount, rate in zip(amounts, old_rates))
+                - exp_total
+                - sav_total,
+                nan,
+            ),
+            list(zip(amounts, old_rates))
+            + [(outgoing, np.full(outgoing.shape, -1.0)) for outgoing in outgoings],
+        )
+
+        total_net = sum(amount * rate for amount, rate in zip(amounts, rates))
+        inc_total_monthly_net = _net_cents(total_net, list(zip(amounts, rates)))
+        # NOTE: no income means no tax rate, rather than a division by zero
+        inc_annual_tax_net = np.where(
+            inc_total_annual != 0,
+            100 - (total_net * 12 / inc_total_annual) * 100,
+            nan,
+        )
+        sav_total = _cents(sav_total)
+        sav_rate = np.where(
+            inc_total_monthly_net != 0,
+            sav_total / inc_total_monthly_net * 100,
+            nan,
+        )
+
+        assets_total = c['assets_savings'] + c['assets_property'] + c['assets_misc']
+        lia_total = c['lia_loans'] + c['lia_credit_card'] + c['lia_misc']
+
+    return dict(
+        inc_total_annual=_cents(inc_total_annual),
+        net_monthly_profit_loss=net_monthly_profit_loss,
+        inc_total_monthly_net=inc_total_monthly_net,
+        inc_annual_tax_net=inc_annual_tax_net,
+        exp_total=_cents(exp_total),
+        sav_total=sav_total,
+        sav_rate=sav_rate,
+        assets_total=_cents(assets_total),
+        lia_total=_cents(lia_total),
+        net_worth=_cents(assets_total - lia_total),
+    )
+
+
+def changed_rows(
+    old: Dict[str, np.ndarray], new: Dict[str, np.ndarray]
+) -> Dict[str, np.ndarray]:
+    """Masks of the rows whose stored value differs, per computed column"""
+    changed = {}
+    for name in COMPUTED_COLUMNS:
+        old_values, new_values = old[name], new[name]
+        old_nan, new_nan = np.isnan(old_values), np.isnan(new_values)
+        with np.errstate(invalid='ignore'):
+            if name in FLOAT_COLUMNS:
+                differs = ~np.isclose(
+                    old_values, new_values, rtol=FLOAT_TOLERANCE, atol=FLOAT_TOLERANCE
+                )
+            else:
+                differs = np.abs(old_values - new_values) >= DECIMAL_TOLERANCE
+        changed[name] = (old_nan != new_nan) | (~old_nan & ~new_nan & differs)
+    return changed
+
+
+def iter_chunks(
+    cursor, first_id: int, last_id: int, chunk_size: int
+) -> Iterator[Tuple[np.ndarray, Dict[str, np.ndarray]]]:
+    """
+    Keyset walk over the users in [first_id, last_id], yields the ids and the
+    float64 columns of each chunk
+    """
+    names = INPUT_COLUMNS + COMPUTED_COLUMNS
+    sql = (
+        'SELECT id, {columns} FROM users '
+        'WHERE id > %s AND id <= %s ORDER BY id LIMIT %s'
+    ).format(columns=', '.join(f'{name}::float8' for name in names))
+    position = first_id - 1
+    while position < last_id:
+        cursor.execute(sql, [position, last_id, chunk_size])
+        rows = cursor.fetchall()
+        if not rows:
+            return
+        # NOTE: None becomes NaN for float64 arrays
+        data = np.array(rows, dtype=np.float64)
+        ids = data[:, 0].astype(np.int64)
+        yield ids, {name: data[:, i + 1] for i, name in enumerate(names)}
+        position = int(ids[-1])
+
+
+def write_chunk(cursor, ids: np.ndarray, new: Dict[str, np.ndarray], mask):
+    def value(array, i, decimal):
+        if np.isnan(array[i]):
+            return None
+        return f'{array[i]:.2f}' if decimal else float(array[i])
+
+    rows = [
+        [int(ids[i])]
+        + [value(new[name], i, name in DECIMAL_COLUMNS) for name in COMPUTED_COLUMNS]
+        for i in np.flatnonzero(mask)
+    ]
+    if not rows:
+        return
+    casts = ', '.join(
+        '%s::numeric' if name in DECIMAL_COLUMNS else '%s::float8'
+        for name in COMPUTED_COLUMNS
+    )
+    execute_values(
+        cursor,
+        'UPDATE users SET {assignments}, updated = now() '
+        'FROM (VALUES %s) AS v (id, {columns}) WHERE users.id = v.id'.format(
+            assignments=', '.join(f'{name} = v.{name}' for name in COMPUTED_COLUMNS),
+            columns=', '.join(COMPUTED_COLUMNS),
+        ),
+        rows,
+        template=f'(%s, {casts})',
+        page_size=len(rows),
+    )
+
+
+def recompute_range(
+    first_id: int, last_id: int, chunk_size: int = 5000, dry_run: bool = False
+) -> dict:
+    """
+    Recomputes and writes back the computed columns of the users in
+    [first_id, last_id], only rows with a changed value are written
+    """
+    stats = dict(rows=0, changed_rows=0, changed=Counter(), max_diff=Counter())
+    with connection.cursor() as cursor:
+        for ids, columns in iter_chunks(cursor, first_id, last_id, chunk_size):
+            new = recompute_columns(columns)
+            changed = changed_rows(columns, new)
+            any_changed = np.zeros(ids.shape, dtype=bool)
+            for name, mask in changed.items():
+                any_changed |= mask
+                stats['changed'][name] += int(mask.sum())
+                both = mask & ~np.isnan(columns[name]) & ~np.isnan(new[name])
+                if both.any():
+                    diff = float(np.abs(columns[name][both] - new[name][both]).max())
+                    stats['max_diff'][name] = max(stats['max_diff'][name], diff)
+            stats['rows'] += len(ids)
+            stats['changed_rows'] += int(any_changed.sum())
+            if not dry_run:
+                with transaction.atomic():
+                    write_chunk(cursor.cursor, ids, new, any_changed)
+                # NOTE: the writes bypass User.save
+                forget_cached_users(ids[any_changed].tolist())
+    return stats
+
+
+def split_id_range(workers: int) -> List[Tuple[int, int]]:
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT min(id), max(id) FROM users')
+        first_id, last_id = cursor.fetchone()
+    if first_id is None:
+        return []
+    step = (last_id - first_id) // workers + 1
+    return [
+        (start, min(start + step - 1, last_id))
+        for start in range(first_id, last_id + 1, step)
+    ]
+
+
+def merge_stats(results: List[dict]) -> dict:
+    merged: Optional[dict] = None
+    for stats in results:
+        if merged is None:
+            merged = stats
+            continue
+        merged['rows'] += stats['rows']
+        merged['changed_rows'] += stats['changed_rows']
+        merged['changed'].update(stats['changed'])
+        for name, diff in stats['max_diff'].items():
+            merged['max_diff'][name] = max(merged['max_diff'][name], diff)
+    return merged or dict(rows=0, changed_rows=0, changed=Counter(), max_diff=Counter())
@@ -0,0 +1,378 @@
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from authentication.models import (
+    COHORT_AGE_BAND,
+    COHORT_UNKNOWN,
+    CohortRollup,
+    MetropolitanArea,
+    User,
+    cohort_cell,
+)
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import FloatField, Q
+from django.db.models.functions import Cast
+from django.utils import timezone
+
+from webservices.cache import (
+    add_dirty_keys,
+    bump_model_version,
+    clear_dirty_keys,
+    get_model_version,
+    pop_dirty_keys,
+)
+from webservices.sketch import QuantileSketch
+
+# NOTE: set by a full rebuild, until then (or until one covers a new stats
+#  field) the stats endpoint scans users
+BUILT_KEY = 'cohort_rollups:built'
+REFRESH_BATCH_SIZE = 500
+# NOTE: room for any (cell, bucket key) pair, see QuantileSketch.KEY_OFFSET
+_KEY_SPAN = 4 * QuantileSketch.KEY_OFFSET
+# NOTE: merged cohort sketches of this process, see `cohort_sketches`
+_sketches: 'OrderedDict[str, dict]' = OrderedDict()
+_sketches_lock = threading.Lock()
+
+
+def _cell_filter(cell: str) -> Q:
+    metro, industry, job_title, level, gender, age_band = [
+        value or None for value in cell.split(':')
+    ]
+    q = Q(
+        metro_id=metro,
+        industry_id=industry,
+        job_title_id=job_title,
+        level=level,
+        gender=gender,
+    )
+    if age_band is None:
+        return q & Q(age__isnull=True)
+    age_band = int(age_band)
+    return q & Q(age__gte=age_band, age__lt=age_band + COHORT_AGE_BAND)
+
+
+def _fetch_users(q: Q) -> list:
+    floats = {
+        f'{name}_float': Cast(name, FloatField()) for name in User.COHORT_STATS_FIELDS
+    }
+    return list(
+        User.objects.filter(q)
+        .annotate(**floats)
+        .values_list(
+            'metro_id',
+            'industry_id',
+            'job_title_id',
+            'level',
+            'gender',
+            'age',
+            *floats,
+        )
+    )
+
+
+def build_rollups(rows: list) -> List[CohortRollup]:
+    """
+    Rollups of the cells of `rows`, the dimensions followed by the stats fields
+    of every user as fetched by `_fetch_users`
+    """
+    if not rows:
+        return []
+    cells, first_rows, inverse = np.unique(
+        np.array([cohort_cell(*row[:6]) for row in rows]),
+        return_index=True,
+        return_inverse=True,
+    )
+    inverse = inverse.reshape(-1)
+    size = len(cells)
+    data = np.array([row[6:] for row in rows], dtype=np.float64)
+    user_counts = np.bincount(inverse, minlength=size)
+
+    stats: List[Dict[str, dict]] = [{} for _ in range(size)]
+    for column, name in enumerate(User.COHORT_STATS_FIELDS):
+        values = data[:, column]
+        present = ~np.isnan(values)
+        values, cell_indexes = values[present], inverse[present]
+        counts = np.bincount(cell_indexes, minlength=size)
+        sums = np.bincount(cell_indexes, weights=values, minlength=size)
+        minimums = np.full(size, np.inf)
+        np.minimum.at(minimums, cell_indexes, values)
+        maximums = np.full(size, -np.inf)
+        np.maximum.at(maximums, cell_indexes, values)
+        # NOTE: one sort buckets the values of every cell at once
+        combined, bucket_counts = np.unique(
+            cell_indexes * _KEY_SPAN
+            + QuantileSketch.bucket_keys(values)
+            + _KEY_SPAN // 2,
+            return_counts=True,
+        )
+        bucket_cells = combined // _KEY_SPAN
+        bucket_keys = combined % _KEY_SPAN - _KEY_SPAN // 2
+        bounds = np.searchsorted(bucket_cells, np.arange(size + 1))
+        for i in np.flatnonzero(counts):
+            start, end = bounds[i], bounds[i + 1]
+            stats[i][name] = dict(
+                count=int(counts[i]),
+                sum=float(sums[i]),
+                min=float(minimums[i]),
+                max=float(maximums[i]),
+                sketch=QuantileSketch(
+                    bucket_keys[start:end], bucket_counts[start:end]
+                ).to_dict(),
+            )
+
+    rollups = []
+    for i, cell in enumerate(cells):
+        row = rows[first_rows[i]]
+        age = row[5]
+        rollups.append(
+            CohortRollup(
+                cell=str(cell),
+                metro_id=row[0],
+                industry_id=row[1],
+                job_title_id=row[2],
+                level=row[3],
+                gender=row[4],
+                age_band=None
+                if age is None
+                else age // COHORT_AGE_BAND * COHORT_AGE_BAND,
+                user_count=int(user_counts[i]),
+                stats=stats[i],
+            )
+        )
+    return rollups
+
+
+def _save_rollups(rollups: List[CohortRollup]):
+    CohortRollup.objects.bulk_create(
+        rollups,
+        batch_size=1000,
+        update_conflicts=True,
+        unique_fields=['cell'],
+        update_fields=['user_count', 'stats', 'updated'],
+    )
+
+
+def resolve_cells(keys: Sequence[str]) -> List[str]:
+    """
+    Cells of the keys marked by User.save, `<id>@<previous cell>` keys are the
+    user's current cell and the previous one with its unknown dimensions
+    """
+    cells = {key for key in keys if '@' not in key}
+    pending = [key.split('@', 1) for key in keys if '@' in key]
+    if not pending:
+        return list(cells)
+    dimensions = {
+        row[0]: row[1:]
+        for row in User.objects.filter(
+            id__in=[user_id for user_id, _ in pending]
+        ).values_list(
+            'id', 'metro_id', 'industry_id', 'job_title_id', 'level', 'gender', 'age'
+        )
+    }
+    for user_id, previous in pending:
+        if int(user_id) not in dimensions:
+            # NOTE: deleted since, User.delete marked its cell
+            continue
+        current = cohort_cell(*dimensions[int(user_id)])
+        cells.add(current)
+        cells.add(
+            ':'.join(
+                current_value if value == COHORT_UNKNOWN else value
+                for value, current_value in zip(previous.split(':'), current.split(':'))
+            )
+        )
+    return list(cells)
+
+
+def refresh_cells(cells: Sequence[str]) -> int:
+    """Recomputes the rollups of `cells` from their users, returns the user count"""
+    q = Q()
+    for cell in cells:
+        q |= _cell_filter(cell)
+    rollups = build_rollups(_fetch_users(q))
+    with transaction.atomic():
+        CohortRollup.objects.filter(cell__in=cells).exclude(
+            cell__in=[rollup.cell for rollup in rollups]
+        ).delete()
+        _save_rollups(rollups)
+    bump_model_version(CohortRollup)
+    return sum(rollup.user_count for rollup in rollups)
+
+
+def rebuild_cohort_rollups() -> dict:
+    """Recomputes every rollup, one metro at a time"""
+    started = timezone.now()
+    # NOTE: changes from here on are marked again and picked up next time
+    clear_dirty_keys(CohortRollup.DIRTY_KEYS)
+    partitions = [
+        Q(metro_id=metro_id)
+        for metro_id in MetropolitanArea.objects.values_list('id', flat=True)
+    ]
+    partitions.append(Q(metro__isnull=True))
+    cells = users = 0
+    for q in partitions:
+        rollups = build_rollups(_fetch_users(q))
+        _save_rollups(rollups)
+        cells += len(rollups)
+        users += sum(rollup.user_count for rollup in rollups)
+    CohortRollup.objects.filter(updated__lt=started).delete()
+    bump_model_version(CohortRollup)
+    cache.set(
+        BUILT_KEY,
+        dict(started=started.isoformat(), fields=User.COHORT_STATS_FIELDS),
+        timeout=None,
+    )
+    return dict(full=True, cells=cells, users=users)
+
+
+def refresh_cohort_rollups(full: bool = False) -> dict:
+    """
+    Refreshes the cells marked by User.save since the last run, or rebuilds
+    every cell when `full` or when the rollups were never built
+    """
+    if full or not is_built():
+        return rebuild_cohort_rollups()
+    cells = users = 0
+    while True:
+        batch = pop_dirty_keys(CohortRollup.DIRTY_KEYS, REFRESH_BATCH_SIZE)
+        if not batch:
+            break
+        try:
+            batch_cells = resolve_cells(batch)
+            users += refresh_cells(batch_cells)
+        except Exception:
+            add_dirty_keys(CohortRollup.DIRTY_KEYS, batch)
+            raise
+        cells += len(batch_cells)
+    return dict(full=False, cells=cells, users=users)
+
+
+def _built_marker() -> Optional[dict]:
+    built = cache.get(BUILT_KEY)
+    if built is None or built['fields'] != User.COHORT_STATS_FIELDS:
+        return None
+    return built
+
+
+def is_built() -> bool:
+    """Whether the rollups are complete and cover every stats field"""
+    return _built_marker() is not None
+
+
+def invalidate_cohort_rollups():
+    """For writes that bypass User.save, until the next full rebuild"""
+    cache.delete(BUILT_KEY)
+
+
+def rollup_filter(cleaned_data: dict) -> Optional[Q]:
+    """
+    `CohortRollup` filter equivalent to the cleaned `UserFilter` data, None
+    when a param is not on a cell dimension or cuts through an age band
+    """
+    q = Q()
+    for name, value in cleaned_data.items():
+        if value is None or value == '' or value == []:
+            continue
+        field, _, lookup = name.partition('__')
+        if field in ('metro', 'industry', 'job_title') and lookup == 'in':
+            q &= Q(**{f'{field}_id__in': value})
+        elif field in ('level', 'gender'):
+            q &= Q(**{name: value})
+        elif field == 'age' and lookup in ('lt', 'lte', 'gt', 'gte'):
+            if value != int(value):
+                return None
+            # NOTE: ages are whole years, so `age <= 39` is `age < 40`
+            bound = int(value) + (1 if lookup in ('lte', 'gt') else 0)
+            if bound % COHORT_AGE_BAND:
+                return None
+            band_lookup = 'lt' if lookup in ('lt', 'lte') else 'gte'
+            q &= Q(**{f'age_band__{band_lookup}': bound})
+        else:
+            return None
+    return q
+
+
+def cohort_stats(q: Q, fractions: Sequence[float]) -> Optional[dict]:
+    """
+    Count, sum, min, max and the quantiles at `fractions` of every stats field
+    over the cells matched by `q`, None when the rollups are not built or too
+    many cells match for a lookup to beat a scan
+    """
+    if not is_built():
+        return None
+    limit = settings.COHORT_ROLLUP_MAX_CELLS
+    rows = list(
+        CohortRollup.objects.filter(q).values_list('user_count', 'stats')[: limit + 1]
+    )
+    if len(rows) > limit:
+        return None
+
+    fields = {}
+    for name in User.COHORT_STATS_FIELDS:
+        cells = [stats[name] for _, stats in rows if name in stats]
+        if not cells:
+            fields[name] = dict(
+                count=0, sum=None, min=None, max=None, quantiles=[None] * len(fractions)
+            )
+            continue
+        minimum = min(cell['min'] for cell in cells)
+        maximum = max(cell['max'] for cell in cells)
+        sketch = QuantileSketch.merged(
+            QuantileSketch.from_dict(cell['sketch']) for cell in cells
+        )
+        fields[name] = dict(
+            count=sum(cell['count'] for cell in cells),
+            sum=sum(cell['sum'] for cell in cells),
+            min=minimum,
+            max=maximum,
+            # NOTE: a bucket value can be just past the actual extremes
+            quantiles=[
+                min(max(sketch.quantile(fraction), minimum), maximum)
+                for fraction in fractions
+            ],
+        )
+    return dict(count=sum(user_count for user_count, _ in rows), fields=fields)
+
+
+def cohort_sketches(q: Q, key: str) -> Optional[dict]:
+    """
+    User count and merged sketch of every stats field over the cells matched by
+    `q`, None like `cohort_stats`. `key` identifies `q`, merges are kept in a
+    process local LRU until the rollups next change.
+    """
+    built = _built_marker()
+    if built is None:
+        return None
+    # NOTE: the rebuild time keeps entries apart should the version start over
+    key = f'{built["started"]}:{get_model_version(CohortRollup)}:{key}'
+    with _sketches_lock:
+        if key in _sketches:
+            _sketches.move_to_end(key)
+            return _sketches[key]
+
+    limit = settings.COHORT_ROLLUP_MAX_CELLS
+    rows = list(
+        CohortRollup.objects.filter(q).values_list('user_count', 'stats')[: limit + 1]
+    )
+    if len(rows) > limit:
+        return None
+    sketches = dict(
+        count=sum(user_count for user_count, _ in rows),
+        fields={
+            name: QuantileSketch.merged(
+                QuantileSketch.from_dict(stats[name]['sketch'])
+                for _, stats in rows
+                if name in stats
+            )
+            for name in User.COHORT_STATS_FIELDS
+        },
+    )
+    with _sketches_lock:
+        _sketches[key] = sketches
+        while len(_sketches) > settings.COHORT_SKETCH_CACHE_SIZE:
+            _sketches.popitem(last=False)
+    return sketches
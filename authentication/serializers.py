@@ -1,5 +1,8 @@
+from decimal import Context, Decimal
+
 from authentication.models import ChatUser, Industry, JobTitle, MetropolitanArea, User
 from django.core.exceptions import ObjectDoesNotExist
+from django.utils import timezone
 from rest_framework import serializers
 
 
@@ -36,10 +39,6 @@ class UserSerializer(serializers.ModelSerializer):
     inc_secondary_monthly_net = serializers.DecimalField(
         max_digits=12, decimal_places=2
     )
-    inc_total_monthly_net = serializers.DecimalField(max_digits=12, decimal_places=2)
-    inc_annual_tax_net = serializers.FloatField()
-    exp_total = serializers.DecimalField(max_digits=12, decimal_places=2)
-    sav_total = serializers.DecimalField(max_digits=12, decimal_places=2)
     chat_user = serializers.SerializerMethodField()
 
     def get_chat_user(self, instance):
@@ -62,6 +61,7 @@ class UserSerializer(serializers.ModelSerializer):
             'last_login',
             'first_name',
             'last_name',
+            'updated',
         ]
         read_only_fields = [
             'id',
@@ -69,11 +69,213 @@ class UserSerializer(serializers.ModelSerializer):
             'handle',
             'inc_total_annual',
             'net_monthly_profit_loss',
+            'inc_total_monthly_net',
+            'inc_annual_tax_net',
+            'exp_total',
+            'sav_total',
+            'sav_rate',
             'lia_total',
             'net_worth',
         ]
 
 
+_CENTS = Decimal('0.01')
+# NOTE: mirrors the quantization of DecimalField(max_digits=..., decimal_places=2)
+_PREC_12 = Context(prec=12)
+_PREC_14 = Context(prec=14)
+
+
+def _decimal(value, context=_PREC_12):
+    if value is None:
+        return None
+    return '{:f}'.format(value.quantize(_CENTS, context=context))
+
+
+def _float(value):
+    return None if value is None else float(value)
+
+
+def _datetime(value):
+    if value is None:
+        return None
+    value = timezone.localtime(value).isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+def _entity(entity_id, name):
+    return None if entity_id is None else {'id': entity_id, 'name': name}
+
+
+class UserListSerializer(serializers.BaseSerializer):
+    """
+    Read only equivalent of `UserSerializer` for listings. It works on the named
+    rows of `project(queryset)` and writes the payload directly, so no model
+    instances or nested serializers are built per row.
+    """
+
+    columns = [
+        'id',
+        'metro_id',
+        'metro__name',
+        'industry_id',
+        'industry__name',
+        'job_title_id',
+        'job_title__name',
+        'chat_user__id',
+        'chat_user__chat_engine_id',
+        'chat_user__username',
+        'chat_user__password',
+        'chat_user__agreed_to_terms',
+        'inc_primary_monthly_net',
+        'inc_variable_monthly_net',
+        'inc_secondary_monthly_net',
+        'is_superuser',
+        'date_joined',
+        'uuid',
+        'email_verified',
+        'handle',
+        'age',
+        'gender',
+        'level',
+        'current_pfm',
+        'inc_primary_annual',
+        'inc_primary_tax_fed',
+        'inc_primary_tax_state',
+        'inc_variable_monthly',
+        'inc_variable_tax_fed',
+        'inc_variable_tax_state',
+        'inc_secondary_monthly',
+        'inc_secondary_tax_fed',
+        'inc_secondary_tax_state',
+        'exp_housing',
+        'exp_other_fixed',
+        'exp_other_variable',
+        'sav_retirement',
+        'sav_market',
+        'inc_total_annual',
+        'net_monthly_profit_loss',
+        'inc_total_monthly_net',
+        'inc_annual_tax_net',
+        'exp_total',
+        'sav_total',
+        'sav_rate',
+        'assets_savings',
+        'assets_property',
+        'assets_misc',
+        'lia_loans',
+        'lia_credit_card',
+        'lia_misc',
+        'assets_total',
+        'lia_total',
+        'net_worth',
+    ]
+
+    @classmethod
+    def project(cls, queryset):
+        """Expects a queryset with `with_financial_annotations()` applied"""
+        return queryset.values_list(*cls.columns, named=True)
+
+    def to_representation(self, row):
+        if row.chat_user__id is None:
+            chat_user = None
+        else:
+            chat_user = {
+                'chat_engine_id': row.chat_user__chat_engine_id,
+                'username': row.chat_user__username,
+                'password': str(row.chat_user__password),
+                'agreed_to_terms': row.chat_user__agreed_to_terms,
+            }
+        return {
+            'id': row.id,
+            'metro': _entity(row.metro_id, row.metro__name),
+            'industry': _entity(row.industry_id, row.industry__name),
+            'job_title': _entity(row.job_title_id, row.job_title__name),
+            'inc_primary_monthly_net': _decimal(row.inc_primary_monthly_net),
+            'inc_variable_monthly_net': _decimal(row.inc_variable_monthly_net),
+            'inc_secondary_monthly_net': _decimal(row.inc_secondary_monthly_net),
+            'chat_user': chat_user,
+            'is_superuser': row.is_superuser,
+            'date_joined': _datetime(row.date_joined),
+            'uuid': str(row.uuid),
+            'email_verified': row.email_verified,
+            'handle': row.handle,
+            'age': row.age,
+            'gender': row.gender,
+            'level': row.level,
+            'current_pfm': row.current_pfm,
+            'inc_primary_annual': _decimal(row.inc_primary_annual),
+            'inc_primary_tax_fed': _float(row.inc_primary_tax_fed),
+            'inc_primary_tax_state': _float(row.inc_primary_tax_state),
+            'inc_variable_monthly': _decimal(row.inc_variable_monthly),
+            'inc_variable_tax_fed': _float(row.inc_variable_tax_fed),
+            'inc_variable_tax_state': _float(row.inc_variable_tax_state),
+            'inc_secondary_monthly': _decimal(row.inc_secondary_monthly),
+            'inc_secondary_tax_fed': _float(row.inc_secondary_tax_fed),
+            'inc_secondary_tax_state': _float(row.inc_secondary_tax_state),
+            'exp_housing': _decimal(row.exp_housing),
+            'exp_other_fixed': _decimal(row.exp_other_fixed),
+            'exp_other_variable': _decimal(row.exp_other_variable),
+            'sav_retirement': _decimal(row.sav_retirement),
+            'sav_market': _decimal(row.sav_market),
+            'inc_total_annual': _decimal(row.inc_total_annual),
+            'net_monthly_profit_loss': _decimal(row.net_monthly_profit_loss),
+            'inc_total_monthly_net': _decimal(row.inc_total_monthly_net),
+            'inc_annual_tax_net': _float(row.inc_annual_tax_net),
+            'exp_total': _decimal(row.exp_total),
+            'sav_total': _decimal(row.sav_total),
+            'sav_rate': _float(row.sav_rate),
+            'assets_savings': _decimal(row.assets_savings, _PREC_14),
+            'assets_property': _decimal(row.assets_property, _PREC_14),
+            'assets_misc': _decimal(row.assets_misc),
+            'lia_loans': _decimal(row.lia_loans),
+            'lia_credit_card': _decimal(row.lia_credit_card),
+            'lia_misc': _decimal(row.lia_misc),
+            'assets_total': _decimal(row.assets_total, _PREC_14),
+            'lia_total': _decimal(row.lia_total, _PREC_14),
+            'net_worth': _decimal(row.net_worth, _PREC_14),
+        }
+
+
+class UserCardSerializer(serializers.BaseSerializer):
+    """A few public fields of a user, written from the rows of `project`"""
+
+    columns = [
+        'id',
+        'uuid',
+        'handle',
+        'metro_id',
+        'metro__name',
+        'industry_id',
+        'industry__name',
+        'job_title_id',
+        'job_title__name',
+        'age',
+        'level',
+        'inc_total_annual',
+        'net_worth',
+    ]
+
+    @classmethod
+    def project(cls, queryset):
+        return queryset.values_list(*cls.columns, named=True)
+
+    def to_representation(self, row):
+        return {
+            'id': row.id,
+            'uuid': str(row.uuid),
+            'handle': row.handle,
+            'metro': _entity(row.metro_id, row.metro__name),
+            'industry': _entity(row.industry_id, row.industry__name),
+            'job_title': _entity(row.job_title_id, row.job_title__name),
+            'age': row.age,
+            'level': row.level,
+            'inc_total_annual': _decimal(row.inc_total_annual),
+            'net_worth': _decimal(row.net_worth, _PREC_14),
+        }
+
+
 class ProfileSerializer(serializers.ModelSerializer):
     chat_user = serializers.SerializerMethodField()
     metro = MetropolitanAreaSerializer()
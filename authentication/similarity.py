@@ -0,0 +1,149 @@
+from typing import Dict, Sequence, Tuple
+
+import numpy as np
+from authentication.models import User
+from django.db.models import Avg, FloatField, Func, QuerySet, StdDev, Value
+from django.db.models.functions import Abs, Cast, Coalesce, Ln, Sign
+
+# NOTE: the profile a user is compared on, see `feature_matrix`
+SIMILARITY_FEATURES = [
+    'age',
+    'level',
+    'inc_total_annual',
+    'net_worth',
+    'exp_housing',
+    'net_monthly_profit_loss',
+    'sav_rate',
+]
+# NOTE: amounts span orders of magnitude, so they are compared on a signed log
+#  scale, i.e. 50k is as far from 100k as 500k is from 1M
+LOG_FEATURES = [
+    'inc_total_annual',
+    'net_worth',
+    'exp_housing',
+    'net_monthly_profit_loss',
+]
+SEARCH_BLOCK_SIZE = 65536
+
+Scaling = Dict[str, Tuple[float, float]]
+
+
+def _transform(name: str, values: np.ndarray) -> np.ndarray:
+    values = np.asarray(values, dtype=np.float64)
+    if name in LOG_FEATURES:
+        return np.sign(values) * np.log1p(np.abs(values))
+    return values
+
+
+def _snapshot_column(columns: Dict[str, np.ndarray], name: str) -> np.ndarray:
+    column = np.asarray(columns[name], dtype=np.float64)
+    # NOTE: integer columns of the snapshot use -1 for NULL
+    return np.where(column < 0, np.nan, column) if name == 'level' else column
+
+
+def feature_scaling(columns: Dict[str, np.ndarray]) -> Scaling:
+    """Center and scale of every transformed feature over the snapshot columns"""
+    scaling = {}
+    with np.errstate(invalid='ignore'):
+        for name in SIMILARITY_FEATURES:
+            values = _transform(name, _snapshot_column(columns, name))
+            values = values[~np.isnan(values)]
+            center = float(values.mean()) if len(values) else 0.0
+            scale = float(values.std()) if len(values) else 0.0
+            scaling[name] = (center, scale if scale > 0 else 1.0)
+    return scaling
+
+
+def feature_matrix(columns: Dict[str, np.ndarray], scaling: Scaling) -> np.ndarray:
+    """
+    Standardized features of every row of the snapshot columns, one row per
+    user. Missing values sit at the center, so they neither attract nor repel.
+    """
+    matrix = np.zeros((len(columns['id']), len(SIMILARITY_FEATURES)), np.float32)
+    for i, name in enumerate(SIMILARITY_FEATURES):
+        center, scale = scaling[name]
+        values = (_transform(name, _snapshot_column(columns, name)) - center) / scale
+        matrix[:, i] = np.nan_to_num(values, nan=0.0)
+    return matrix
+
+
+def feature_vector(user: User, scaling: Scaling) -> np.ndarray:
+    values = [getattr(user, name) for name in SIMILARITY_FEATURES]
+    columns = {
+        name: np.array([np.nan if value is None else float(value)])
+        for name, value in zip(SIMILARITY_FEATURES, values)
+    }
+    columns['id'] = np.zeros(1)
+    return feature_matrix(columns, scaling)[0]
+
+
+def nearest(
+    features: np.ndarray, rows: np.ndarray, vector: np.ndarray, k: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    The `k` of `rows` whose features are closest to `vector`, nearest first,
+    and their euclidean distances. Distances are computed a block of rows at a
+    time to bound the memory, keeping the best `k` so far.
+    """
+    best_rows = np.empty(0, dtype=np.int64)
+    best_distances = np.empty(0, dtype=np.float32)
+    for start in range(0, len(rows), SEARCH_BLOCK_SIZE):
+        block = rows[start : start + SEARCH_BLOCK_SIZE]
+        distances = np.square(features[block] - vector).sum(axis=1)
+        if len(block) > k:
+            keep = np.argpartition(distances, k)[:k]
+            block, distances = block[keep], distances[keep]
+        best_rows = np.concatenate([best_rows, block])
+        best_distances = np.concatenate([best_distances, distances])
+        if len(best_rows) > k:
+            keep = np.argpartition(best_distances, k)[:k]
+            best_rows, best_distances = best_rows[keep], best_distances[keep]
+    order = np.lexsort((best_rows, best_distances))
+    return best_rows[order], np.sqrt(best_distances[order])
+
+
+def _transform_expression(name: str):
+    value = Cast(name, FloatField())
+    if name in LOG_FEATURES:
+        return Sign(value) * Ln(Abs(value) + Value(1.0))
+    return value
+
+
+def database_scaling(queryset: QuerySet) -> Scaling:
+    """`feature_scaling` computed by the database, in one aggregate query"""
+    aggregates = {}
+    for name in SIMILARITY_FEATURES:
+        aggregates[f'{name}__center'] = Avg(
+            _transform_expression(name), output_field=FloatField()
+        )
+        aggregates[f'{name}__scale'] = StdDev(
+            _transform_expression(name), output_field=FloatField()
+        )
+    row = queryset.order_by().aggregate(**aggregates)
+    return {
+        name: (
+            row[f'{name}__center'] or 0.0,
+            row[f'{name}__scale'] or 1.0,
+        )
+        for name in SIMILARITY_FEATURES
+    }
+
+
+def distance_expression(vector: Sequence[float], scaling: Scaling):
+    """The squared distance of a user to `vector`, see `feature_matrix`"""
+    expression = None
+    for name, target in zip(SIMILARITY_FEATURES, vector):
+        center, scale = scaling[name]
+        standardized = Coalesce(
+            (_transform_expression(name) - Value(center)) / Value(scale),
+            Value(0.0),
+            output_field=FloatField(),
+        )
+        term = Func(
+            standardized - Value(float(target)),
+            Value(2),
+            function='POWER',
+            output_field=FloatField(),
+        )
+        expression = term if expression is None else expression + term
+    return expression
@@ -1,36 +1,149 @@
-import random
-import time
+import io
+import multiprocessing
+import re
+from decimal import Decimal
+from typing import Dict, Iterator, List, Tuple
 
-from authentication.factories import UserFactory
-from authentication.models import Industry, JobTitle, MetropolitanArea, User
+import numpy as np
+from authentication.models import (
+    Industry,
+    JobTitle,
+    MetropolitanArea,
+    User,
+    forget_cached_users,
+    user_bitmaps,
+)
+from authentication.recompute import (
+    COMPUTED_COLUMNS,
+    FLOAT_COLUMNS,
+    INPUT_COLUMNS,
+    recompute_columns,
+)
+from authentication.rollups import invalidate_cohort_rollups
 from django.conf import settings
-from django.db import transaction
-
-METRO_AREAS = [
-    "New York-Newark-Jersey City, NY-NJ-PA",
-    "Chicago-Naperville-Elgin, IL-IN-WI",
-    "Dallas-Fort Worth-Arlington, TX",
-    "Miami-Fort Lauderdale-West Palm Beach, FL",
-    "Boston-Cambridge-Newton, MA-NH",
-]
+from django.db import connection, connections, transaction
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from webservices.auth import forget_token
+from webservices.cache import bump_model_version
+
+# NOTE: pay and housing are relative to the national median, state income tax
+#  is a flat effective rate
+METRO_AREAS = {
+    "New York-Newark-Jersey City, NY-NJ-PA": dict(pay=1.25, housing=1.6, tax=6.0),
+    "Chicago-Naperville-Elgin, IL-IN-WI": dict(pay=1.05, housing=1.05, tax=4.95),
+    "Dallas-Fort Worth-Arlington, TX": dict(pay=1.0, housing=0.95, tax=0.0),
+    "Miami-Fort Lauderdale-West Palm Beach, FL": dict(pay=0.95, housing=1.2, tax=0.0),
+    "Boston-Cambridge-Newton, MA-NH": dict(pay=1.2, housing=1.45, tax=5.0),
+}
+
+# NOTE: bonus is the usual variable income as a share of the salary
+INDUSTRIES = {
+    'SaaS Software': dict(pay=1.15, bonus=0.08),
+    'Consulting': dict(pay=1.05, bonus=0.12),
+    'Finance': dict(pay=1.15, bonus=0.2),
+    'Manufacturing': dict(pay=0.9, bonus=0.05),
+    'Real Estate': dict(pay=0.95, bonus=0.15),
+}
+
+JOB_TITLES = {
+    'Engineer': dict(pay=1.1, bonus=0.0),
+    'Product Manager': dict(pay=1.1, bonus=0.0),
+    'Account Executive': dict(pay=0.9, bonus=0.25),
+    'Analyst': dict(pay=0.9, bonus=0.02),
+    'Project Manager': dict(pay=0.95, bonus=0.0),
+}
+
+# NOTE: level: (share of users, median salary, median age, salary spread)
+LEVELS = {
+    User.LevelChoices.IC_ASSOCIATE: (0.14, 62000, 25, 0.2),
+    User.LevelChoices.IC: (0.23, 85000, 29, 0.2),
+    User.LevelChoices.IC_SENIOR: (0.18, 120000, 34, 0.2),
+    User.LevelChoices.IC_STAFF: (0.08, 160000, 38, 0.2),
+    User.LevelChoices.IC_PRINCIPAL: (0.03, 205000, 43, 0.22),
+    User.LevelChoices.MANAGER: (0.13, 135000, 37, 0.2),
+    User.LevelChoices.DIRECTOR: (0.07, 185000, 42, 0.22),
+    User.LevelChoices.DIRECTOR_SR: (0.04, 225000, 46, 0.25),
+    User.LevelChoices.VP: (0.03, 270000, 48, 0.3),
+    User.LevelChoices.VP_SENIOR: (0.015, 330000, 51, 0.3),
+    User.LevelChoices.C_SUITE: (0.01, 380000, 52, 0.4),
+    User.LevelChoices.FOUNDER: (0.045, 110000, 36, 0.9),
+}
 
-INDUSTRIES = ['SaaS Software', 'Consulting', 'Finance', 'Manufacturing', 'Real Estate']
+GENDERS = {
+    User.GenderChoices.MALE: 0.52,
+    User.GenderChoices.FEMALE: 0.44,
+    User.GenderChoices.TRANSGENDER: 0.01,
+    User.GenderChoices.PREFER_NOT_TO_SAY: 0.03,
+}
 
-JOB_TITLES = [
-    'Engineer',
-    'Product Manager',
-    'Account Executive',
-    'Analyst',
-    'Project Manager',
+CURRENT_PFMS = {
+    User.CurrentPFMChoices.NONE: 0.38,
+    User.CurrentPFMChoices.MINT: 0.2,
+    User.CurrentPFMChoices.ROCKET_MONEY: 0.1,
+    User.CurrentPFMChoices.QUICKEN: 0.08,
+    User.CurrentPFMChoices.CHIME: 0.08,
+    User.CurrentPFMChoices.SPLITWISE: 0.06,
+    User.CurrentPFMChoices.PEN_PAPER: 0.1,
+}
+
+# NOTE: share of users that have not filled in a section of their profile
+MISSING_INCOME_STATEMENT = 0.06
+MISSING_NET_WORTH = 0.12
+
+INCOME_STATEMENT_COLUMNS = [
+    name for name in INPUT_COLUMNS if name.startswith(('inc_', 'exp_', 'sav_'))
+]
+NET_WORTH_COLUMNS = [
+    name for name in INPUT_COLUMNS if name.startswith(('assets_', 'lia_'))
 ]
+# NOTE: what generate_users draws, everything else is per user bookkeeping
+USER_INPUT_COLUMNS = [
+    'age',
+    'gender',
+    'industry_id',
+    'job_title_id',
+    'level',
+    'current_pfm',
+] + INPUT_COLUMNS
+
+SCALE_PROFILES = {
+    'dev': dict(users_per_metro=1000),
+    'staging': dict(users_per_metro=20000),
+    'load': dict(users_per_metro=200000),
+    'production': dict(users_per_metro=2000000),
+}
 
 
 def wipe_database():
     assert settings.IS_LOCAL
+    # NOTE: the delete collector would load every user, so whatever references
+    #  them is cleared first and the users go in one statement. Users go before
+    #  the entities so those do not SET_NULL them either
+    tokens = list(Token.objects.values_list('key', 'user_id'))
+    with transaction.atomic(), connection.cursor() as cursor:
+        if not User.objects.filter(is_superuser=True).exists():
+            # everything that references users goes with them
+            cursor.execute('TRUNCATE users CASCADE')
+        else:
+            for relation in User._meta.related_objects:
+                relation.related_model._base_manager.filter(
+                    **{f'{relation.field.name}__is_superuser': False}
+                ).delete()
+            for field in User._meta.many_to_many:
+                field.remote_field.through._base_manager.filter(
+                    user__is_superuser=False
+                ).delete()
+            cursor.execute('DELETE FROM users WHERE NOT is_superuser')
     MetropolitanArea.objects.all().delete()
     JobTitle.objects.all().delete()
     Industry.objects.all().delete()
-    User.objects.filter(is_superuser=False).delete()
+    # NOTE: none of it went through User.save or the token post_delete, and the
+    #  superusers kept lost their entities
+    for key, user_id in tokens:
+        forget_token(key, user_id)
+    forget_cached_users(User.objects.values_list('id', flat=True))
 
 
 def build_entities():
@@ -49,26 +162,418 @@ def build_entities():
         job_titles.append(JobTitle(name=title))
     JobTitle.objects.bulk_create(job_titles)
 
+    # NOTE: the bulk writes, and the deletes before them, bypass save
+    for model in [MetropolitanArea, Industry, JobTitle]:
+        bump_model_version(model)
     return metros, industries, job_titles
 
 
-# TODO: come back and make this actually realistic
-#  make hard side more sparse and have salaries and investments reflect position and level
 @transaction.atomic
-def build_simulated_dataset(users_per_metro=1000):
-    t1 = time.time()
+def build_simulated_dataset(users_per_metro=1000, seed=0) -> int:
+    """
+    Builds the users of `generate_users` as models and saves them with
+    bulk_create, it is the slow reference for `copy_simulated_dataset`
+    """
     wipe_database()
-    metros, indutries, job_titles = build_entities()
+    metros, industries, job_titles = build_entities()
+    industries = [(industry.id, industry.name) for industry in industries]
+    job_titles = [(job_title.id, job_title.name) for job_title in job_titles]
 
     users = []
-    for metro in metros:
+    for index, metro in enumerate(metros):
+        rng = np.random.default_rng([seed, index])
+        columns = generate_users(
+            rng, users_per_metro, metro.name, industries, job_titles
+        )
+        uuids = _uuids(rng, users_per_metro)
         for i in range(users_per_metro):
-            u = UserFactory.build(
+            u = User(
+                username=f'sim{metro.id}_{i}@example.com',
+                email=f'sim{metro.id}_{i}@example.com',
+                handle=f'sim{metro.id}_{i}',
+                first_name='Simulated',
+                last_name='User',
+                uuid=uuids[i],
+                email_verified=True,
                 metro=metro,
-                job_title=random.choice(job_titles),
-                industry=random.choice(indutries),
             )
+            u.set_unusable_password()
+            for name in USER_INPUT_COLUMNS:
+                value = columns[name][i].item()
+                if isinstance(value, float) and np.isnan(value):
+                    value = None
+                elif name in COPY_DECIMAL_COLUMNS:
+                    value = Decimal(f'{value:.2f}')
+                setattr(u, name, value)
             u.recompute_fields()
             users.append(u)
     User.objects.bulk_create(users, batch_size=1000)
-    print(f'Simulation building time: {round(time.time() - t1, 2)} seconds')
+    invalidate_cohort_rollups()
+    user_bitmaps.invalidate()
+    return len(users)
+
+
+# NOTE: `users` columns written by the COPY loader, id comes from its sequence
+COPY_COLUMNS = [
+    'password',
+    'last_login',
+    'is_superuser',
+    'username',
+    'first_name',
+    'last_name',
+    'email',
+    'is_staff',
+    'is_active',
+    'date_joined',
+    'deleted_at',
+    'uuid',
+    'email_verified',
+    'updated',
+    'handle',
+    'age',
+    'gender',
+    'metro_id',
+    'industry_id',
+    'job_title_id',
+    'level',
+    'current_pfm',
+    'inc_primary_annual',
+    'inc_primary_tax_fed',
+    'inc_primary_tax_state',
+    'inc_variable_monthly',
+    'inc_variable_tax_fed',
+    'inc_variable_tax_state',
+    'inc_secondary_monthly',
+    'inc_secondary_tax_fed',
+    'inc_secondary_tax_state',
+    'exp_housing',
+    'exp_other_fixed',
+    'exp_other_variable',
+    'sav_retirement',
+    'sav_market',
+    'assets_savings',
+    'assets_property',
+    'assets_misc',
+    'lia_loans',
+    'lia_credit_card',
+    'lia_misc',
+] + COMPUTED_COLUMNS
+# NOTE: the remaining numeric columns are money, written with 2 places
+COPY_FLOAT_COLUMNS = [
+    'inc_primary_tax_fed',
+    'inc_primary_tax_state',
+    'inc_variable_tax_fed',
+    'inc_variable_tax_state',
+    'inc_secondary_tax_fed',
+    'inc_secondary_tax_state',
+] + FLOAT_COLUMNS
+COPY_DECIMAL_COLUMNS = [
+    name
+    for name in COPY_COLUMNS[COPY_COLUMNS.index('inc_primary_annual') :]
+    if name not in COPY_FLOAT_COLUMNS
+]
+COPY_BATCH_SIZE = 50000
+_NULL = '\\N'
+_NAN = re.compile(r'(?<=\t)nan(?=\t|\n)')
+
+
+def _choice(rng: np.random.Generator, weights: dict, size: int) -> np.ndarray:
+    values = list(weights)
+    p = np.array(list(weights.values()), dtype=np.float64)
+    return np.array(values)[rng.choice(len(values), size, p=p / p.sum())]
+
+
+def _lognormal(rng: np.random.Generator, median, sigma, size: int) -> np.ndarray:
+    return np.exp(np.log(median) + rng.normal(0.0, 1.0, size) * sigma)
+
+
+def _sparse(rng: np.random.Generator, share: float, values: np.ndarray) -> np.ndarray:
+    return np.where(rng.random(values.shape) < share, values, 0.0)
+
+
+def _cents(values: np.ndarray) -> np.ndarray:
+    return np.round(values, 2)
+
+
+def generate_users(
+    rng: np.random.Generator,
+    size: int,
+    metro_name: str,
+    industries: List[Tuple[int, str]],
+    job_titles: List[Tuple[int, str]],
+) -> Dict[str, np.ndarray]:
+    """
+    Profile columns for `size` users of a metro, drawn a whole batch at a time.
+    Salaries follow level, industry, job title and metro, the rest of the
+    income statement and the net worth follow salary and age. Money is rounded
+    to cents like it is once stored, NaN is an unanswered field.
+    """
+    metro = METRO_AREAS.get(metro_name, dict(pay=1.0, housing=1.0, tax=4.0))
+    industry_index = rng.integers(0, len(industries), size)
+    job_title_index = rng.integers(0, len(job_titles), size)
+    industry_pay = np.array(
+        [INDUSTRIES.get(name, {}).get('pay', 1.0) for _, name in industries]
+    )
+    industry_bonus = np.array(
+        [INDUSTRIES.get(name, {}).get('bonus', 0.05) for _, name in industries]
+    )
+    job_title_pay = np.array(
+        [JOB_TITLES.get(name, {}).get('pay', 1.0) for _, name in job_titles]
+    )
+    job_title_bonus = np.array(
+        [JOB_TITLES.get(name, {}).get('bonus', 0.0) for _, name in job_titles]
+    )
+
+    level_values = np.array(list(LEVELS), dtype=np.int64)
+    level_table = np.array(list(LEVELS.values()), dtype=np.float64)
+    level_index = rng.choice(
+        len(LEVELS), size, p=level_table[:, 0] / level_table[:, 0].sum()
+    )
+    _, median_salary, median_age, spread = level_table[level_index].T
+
+    age = np.clip(np.round(median_age + rng.normal(0.0, 5.0, size)), 21, 70)
+    salary = np.round(
+        _lognormal(rng, median_salary, spread, size)
+        * industry_pay[industry_index]
+        * job_title_pay[job_title_index]
+        * metro['pay'],
+        -2,
+    )
+    monthly_gross = salary / 12
+
+    # bonuses and commissions, most people have none
+    bonus_share = industry_bonus[industry_index] + job_title_bonus[job_title_index]
+    has_bonus = rng.random(size) < 0.25 + bonus_share * 2
+    variable = np.where(
+        has_bonus,
+        np.round(monthly_gross * bonus_share * _lognormal(rng, 1.0, 0.5, size), -1),
+        0.0,
+    )
+    # side gigs and rentals, sparse and unrelated to the day job
+    secondary = np.round(_sparse(rng, 0.12, _lognormal(rng, 900, 0.8, size)), -1)
+
+    # NOTE: rough effective rates, federal grows with the log of the income
+    tax_fed = np.round(
+        np.clip(8 + 6.5 * np.log2(salary / 50000), 4, 35) + rng.normal(0, 1.0, size), 1
+    )
+    tax_state = np.full(size, metro['tax'])
+
+    housing_share = np.clip(
+        rng.normal(0.27, 0.06, size) * metro['housing'] ** 0.5, 0.08, 0.6
+    )
+    exp_housing = monthly_gross * housing_share
+    exp_other_fixed = monthly_gross * np.clip(rng.normal(0.1, 0.03, size), 0.02, 0.3)
+    exp_other_variable = monthly_gross * _lognormal(rng, 0.14, 0.35, size)
+    retirement_rate = np.clip(
+        rng.normal(0.04 + 0.002 * (age - 21), 0.04, size), 0.0, 0.19
+    )
+    sav_retirement = _sparse(rng, 0.85, monthly_gross * retirement_rate)
+    sav_market = _sparse(rng, 0.45, monthly_gross * _lognormal(rng, 0.05, 0.6, size))
+
+    working_years = age - 20
+    assets_savings = np.round(
+        salary * _lognormal(rng, 0.2 + 0.04 * working_years, 0.9, size), -2
+    )
+    owns_home = rng.random(size) < np.clip(0.05 + 0.025 * (age - 25), 0.05, 0.8)
+    home_value = np.round(
+        salary * _lognormal(rng, 3.5 * metro['housing'], 0.35, size), -3
+    )
+    assets_property = np.where(owns_home, home_value, 0.0)
+    assets_misc = np.round(_lognormal(rng, 8000, 1.0, size), -2)
+    mortgage = assets_property * np.clip(0.8 - 0.02 * (age - 30), 0.0, 0.8)
+    student_and_car = _sparse(
+        rng,
+        np.clip(0.7 - 0.01 * working_years, 0.1, 0.7),
+        _lognormal(rng, 25000, 0.8, size),
+    )
+    lia_loans = np.round(mortgage + student_and_car, -2)
+    lia_credit_card = np.round(_sparse(rng, 0.45, _lognormal(rng, 3500, 0.9, size)), 0)
+    lia_misc = np.round(_sparse(rng, 0.15, _lognormal(rng, 2000, 0.8, size)), 0)
+
+    columns = dict(
+        age=age.astype(np.int64),
+        gender=_choice(rng, GENDERS, size),
+        industry_id=np.array([id for id, _ in industries])[industry_index],
+        job_title_id=np.array([id for id, _ in job_titles])[job_title_index],
+        level=level_values[level_index],
+        current_pfm=_choice(rng, CURRENT_PFMS, size),
+        inc_primary_annual=salary,
+        inc_primary_tax_fed=tax_fed,
+        inc_primary_tax_state=tax_state,
+        inc_variable_monthly=_cents(variable),
+        # NOTE: bonuses are withheld at the supplemental rate
+        inc_variable_tax_fed=np.maximum(tax_fed, 22.0),
+        inc_variable_tax_state=tax_state,
+        inc_secondary_monthly=_cents(secondary),
+        # NOTE: plus the self employment tax
+        inc_secondary_tax_fed=np.round(tax_fed + 7.65, 1),
+        inc_secondary_tax_state=tax_state,
+        exp_housing=_cents(exp_housing),
+        exp_other_fixed=_cents(exp_other_fixed),
+        exp_other_variable=_cents(exp_other_variable),
+        sav_retirement=_cents(sav_retirement),
+        sav_market=_cents(sav_market),
+        assets_savings=assets_savings,
+        assets_property=assets_property,
+        assets_misc=assets_misc,
+        lia_loans=lia_loans,
+        lia_credit_card=lia_credit_card,
+        lia_misc=lia_misc,
+    )
+    for share, names in [
+        (MISSING_INCOME_STATEMENT, INCOME_STATEMENT_COLUMNS),
+        (MISSING_NET_WORTH, NET_WORTH_COLUMNS),
+    ]:
+        missing = rng.random(size) < share
+        for name in names:
+            columns[name] = np.where(missing, np.nan, columns[name])
+    columns.update(recompute_columns(columns))
+    return columns
+
+
+def _uuids(rng: np.random.Generator, size: int) -> List[str]:
+    data = np.frombuffer(rng.bytes(16 * size), dtype=np.uint8).reshape(size, 16).copy()
+    # NOTE: version 4 and RFC 4122 variant bits, like uuid4()
+    data[:, 6] = (data[:, 6] & 0x0F) | 0x40
+    data[:, 8] = (data[:, 8] & 0x3F) | 0x80
+    return [row.tobytes().hex() for row in data]
+
+
+def _copy_template(metro_id: int) -> str:
+    """COPY text line of a user, constants are inlined and the rest formatted"""
+    now = timezone.now().isoformat()
+    constants = dict(
+        # NOTE: unusable password, see make_password(None)
+        password='!',
+        last_login=_NULL,
+        is_superuser='f',
+        first_name='Simulated',
+        last_name='User',
+        is_staff='f',
+        is_active='t',
+        date_joined=now,
+        deleted_at=_NULL,
+        email_verified='t',
+        updated=now,
+        metro_id=str(metro_id),
+    )
+    specs = []
+    for name in COPY_COLUMNS:
+        if name in constants:
+            specs.append(constants[name].replace('%', '%%'))
+        elif name in COPY_FLOAT_COLUMNS:
+            specs.append('%.17g')
+        elif name in COPY_DECIMAL_COLUMNS:
+            specs.append('%.2f')
+        else:
+            specs.append('%s')
+    return '\t'.join(specs)
+
+
+def _copy_batches(
+    rng: np.random.Generator,
+    metro_id: int,
+    metro_name: str,
+    users: int,
+    industries: List[Tuple[int, str]],
+    job_titles: List[Tuple[int, str]],
+) -> Iterator[str]:
+    """COPY text of the users of a metro, `COPY_BATCH_SIZE` rows at a time"""
+    template = _copy_template(metro_id)
+    for offset in range(0, users, COPY_BATCH_SIZE):
+        size = min(COPY_BATCH_SIZE, users - offset)
+        columns = generate_users(rng, size, metro_name, industries, job_titles)
+        # NOTE: unique across metros, `sim<metro>_<n>` fits the 24 chars of handle
+        handles = [f'sim{metro_id}_{n}' for n in range(offset, offset + size)]
+        emails = [f'{handle}@example.com' for handle in handles]
+        values = dict(username=emails, email=emails, handle=handles)
+        values['uuid'] = _uuids(rng, size)
+        rows = zip(
+            *(
+                values[name] if name in values else columns[name].tolist()
+                for name in COPY_COLUMNS
+                if name in values or name in columns
+            )
+        )
+        text = '\n'.join([template % row for row in rows]) + '\n'
+        # NOTE: NaN is how the generator spells NULL
+        yield _NAN.sub(r'\\N', text)
+
+
+def copy_metro_users(task) -> int:
+    """COPYs the users of one metro, the unit of work of the COPY loader"""
+    metro_id, metro_name, metro_seed, users, industries, job_titles = task
+    rng = np.random.default_rng(metro_seed)
+    sql = 'COPY users ({columns}) FROM STDIN'.format(columns=', '.join(COPY_COLUMNS))
+    with transaction.atomic(), connection.cursor() as cursor:
+        for text in _copy_batches(
+            rng, metro_id, metro_name, users, industries, job_titles
+        ):
+            cursor.cursor.copy_expert(sql, io.StringIO(text))
+    return users
+
+
+def _copy_metro_users_in_worker(task) -> int:
+    try:
+        return copy_metro_users(task)
+    finally:
+        connections.close_all()
+
+
+def _drop_indexes(cursor) -> List[str]:
+    """
+    Drops the indexes of `users` that back no constraint, building them once
+    after the load is a lot cheaper than maintaining them row by row
+    """
+    cursor.execute(
+        """
+        SELECT indexname, indexdef FROM pg_indexes
+        WHERE schemaname = current_schema() AND tablename = 'users'
+        AND indexname NOT IN (SELECT conname FROM pg_constraint)
+        """
+    )
+    indexes = cursor.fetchall()
+    for name, _ in indexes:
+        cursor.execute(f'DROP INDEX {connection.ops.quote_name(name)}')
+    return [definition for _, definition in indexes]
+
+
+def copy_simulated_dataset(users_per_metro=1000, workers=1, seed=0) -> int:
+    """
+    Like `build_simulated_dataset` but streams the users into the table with
+    COPY FROM STDIN, one metro per task so the output only depends on the seed
+    """
+    with transaction.atomic():
+        wipe_database()
+        metros, industries, job_titles = build_entities()
+    industries = [(industry.id, industry.name) for industry in industries]
+    job_titles = [(job_title.id, job_title.name) for job_title in job_titles]
+    tasks = [
+        (metro.id, metro.name, [seed, index], users_per_metro, industries, job_titles)
+        for index, metro in enumerate(metros)
+    ]
+    with connection.cursor() as cursor:
+        index_definitions = _drop_indexes(cursor)
+    try:
+        if workers > 1:
+            # NOTE: forked workers must not share the parent's connection
+            connections.close_all()
+            context = multiprocessing.get_context('fork')
+            with context.Pool(min(workers, len(tasks))) as pool:
+                total = sum(pool.map(_copy_metro_users_in_worker, tasks))
+        else:
+            total = sum(copy_metro_users(task) for task in tasks)
+    finally:
+        with connection.cursor() as cursor:
+            # NOTE: within an outer transaction the deferred foreign key checks
+            #  are still pending, and postgres will not build indexes then
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+            for definition in index_definitions:
+                cursor.execute(definition)
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE users')
+    # NOTE: the rows bypass User.save
+    bump_model_version(User)
+    invalidate_cohort_rollups()
+    user_bitmaps.invalidate()
+    return total
@@ -0,0 +1,453 @@
+import fcntl
+import json
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from authentication.models import User
+from authentication.similarity import (
+    feature_matrix,
+    feature_scaling,
+    feature_vector,
+    nearest,
+)
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+# NOTE: dictionary encoded, a code indexes the values listed in the metadata of
+#  the snapshot and -1 is NULL. Codes are only ever appended, so they stay the
+#  same from one generation to the next.
+FOREIGN_KEY_COLUMNS = ['metro', 'industry', 'job_title']
+CODE_COLUMNS = [*FOREIGN_KEY_COLUMNS, 'gender', 'current_pfm']
+# NOTE: -1 is NULL
+INT_COLUMNS = ['level']
+# NOTE: NaN is NULL
+NUMERIC_COLUMNS = [
+    'age',
+    'inc_primary_annual',
+    'inc_variable_monthly',
+    'inc_secondary_monthly',
+    'exp_housing',
+    'inc_total_annual',
+    'net_monthly_profit_loss',
+    'inc_total_monthly_net',
+    'inc_annual_tax_net',
+    'exp_total',
+    'sav_total',
+    'sav_rate',
+    'assets_total',
+    'lia_total',
+    'net_worth',
+]
+COLUMNS = ['id', *CODE_COLUMNS, *INT_COLUMNS, *NUMERIC_COLUMNS]
+FEATURES = 'features'
+FETCH_CHUNK_SIZE = 50000
+# NOTE: symlink to the directory of the latest generation
+CURRENT = 'current'
+LOCK = '.lock'
+
+_snapshot: Optional['UserSnapshot'] = None
+_snapshot_lock = threading.Lock()
+
+
+class UserSnapshot:
+    """
+    Read only columnar copy of the filterable and stats columns of `users`, one
+    NumPy array per column sorted by id. The arrays are memory mapped from the
+    files of a generation, so every process of the host shares the same pages.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        meta: dict,
+        columns: Dict[str, np.ndarray],
+        features: np.ndarray,
+    ):
+        self.path = path
+        self.meta = meta
+        self.columns = columns
+        # NOTE: standardized similarity features, see authentication.similarity
+        self.features = features
+        self.codes = {
+            name: {value: code for code, value in enumerate(values)}
+            for name, values in meta['dictionaries'].items()
+        }
+
+    @classmethod
+    def open(cls, path: Path) -> 'UserSnapshot':
+        meta = json.loads((path / 'meta.json').read_text())
+        columns = {
+            name: np.load(path / f'{name}.npy', mmap_mode='r') for name in COLUMNS
+        }
+        features = np.load(path / f'{FEATURES}.npy', mmap_mode='r')
+        return cls(path, meta, columns, features)
+
+    @property
+    def size(self) -> int:
+        return len(self.columns['id'])
+
+    def _column_mask(self, field: str, lookup: str, value) -> Optional[np.ndarray]:
+        column = self.columns.get(field)
+        if column is None:
+            return None
+        values = value if lookup == 'in' else [value]
+        if field in CODE_COLUMNS:
+            if lookup not in ('exact', 'in'):
+                return None
+            try:
+                keys = [
+                    # NOTE: exact filters on foreign keys clean to model instances
+                    int(getattr(v, 'pk', v)) if field in FOREIGN_KEY_COLUMNS else v
+                    for v in values
+                ]
+            except ValueError:
+                return None
+            codes = self.codes[field]
+            return np.isin(column, [codes[key] for key in keys if key in codes])
+        try:
+            values = [float(v) for v in values]
+        except (TypeError, ValueError):
+            return None
+        if lookup == 'in':
+            mask = np.isin(column, values)
+        elif lookup == 'exact':
+            mask = column == values[0]
+        elif lookup == 'lt':
+            mask = column < values[0]
+        elif lookup == 'lte':
+            mask = column <= values[0]
+        elif lookup == 'gt':
+            mask = column > values[0]
+        elif lookup == 'gte':
+            mask = column >= values[0]
+        else:
+            return None
+        # NOTE: NaN compares false already
+        return mask & (column >= 0) if field in INT_COLUMNS else mask
+
+    def mask(self, cleaned_data: dict) -> Optional[np.ndarray]:
+        """
+        Rows matched by the cleaned `UserFilter` data, None when a param is on a
+        column or lookup the snapshot does not have
+        """
+        mask = np.ones(self.size, dtype=bool)
+        for name, value in cleaned_data.items():
+            if value is None or value == '' or value == []:
+                continue
+            field, _, lookup = name.partition('__')
+            column_mask = self._column_mask(field, lookup or 'exact', value)
+            if column_mask is None:
+                return None
+            mask &= column_mask
+        return mask
+
+    def stats(self, mask: np.ndarray, names: Sequence[str], fractions) -> dict:
+        """
+        Count, mean, min, max and the `percentile_cont` quantiles at `fractions`
+        of the non null values of every column in `names` within `mask`
+        """
+        rows = np.flatnonzero(mask)
+        fields = {}
+        for name in names:
+            values = self.columns[name][rows]
+            values = values[~np.isnan(values)]
+            if not len(values):
+                fields[name] = dict(
+                    count=0,
+                    mean=None,
+                    min=None,
+                    max=None,
+                    quantiles=[None] * len(fractions),
+                )
+                continue
+            # NOTE: a sort is several times faster than np.quantile for a few
+            #  fractions
+            values = np.sort(values)
+            positions = np.asarray(fractions, dtype=np.float64) * (len(values) - 1)
+            lower = np.floor(positions).astype(np.int64)
+            upper = np.minimum(lower + 1, len(values) - 1)
+            quantiles = values[lower] + (values[upper] - values[lower]) * (
+                positions - lower
+            )
+            fields[name] = dict(
+                count=len(values),
+                mean=float(values.mean()),
+                min=float(values[0]),
+                max=float(values[-1]),
+                quantiles=quantiles.tolist(),
+            )
+        return dict(count=len(rows), fields=fields)
+
+    def nearest(
+        self, mask: np.ndarray, user: User, k: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Ids of the `k` users within `mask` most similar to `user`, and distances"""
+        vector = feature_vector(user, self.meta['scaling'])
+        rows, distances = nearest(self.features, np.flatnonzero(mask), vector, k)
+        return self.columns['id'][rows], distances
+
+    def rank(self, mask: np.ndarray, name: str, value: float) -> Tuple[int, int, int]:
+        """Counts of the non null values within `mask`, below `value` and equal"""
+        values = self.columns[name][mask]
+        values = values[~np.isnan(values)]
+        return (
+            len(values),
+            int(np.count_nonzero(values < value)),
+            int(np.count_nonzero(values == value)),
+        )
+
+
+def snapshot_directory() -> Optional[Path]:
+    directory = settings.USER_SNAPSHOT_DIR
+    return Path(directory) if directory else None
+
+
+def _open_current(directory: Path) -> Optional[UserSnapshot]:
+    try:
+        return UserSnapshot.open(directory / os.readlink(directory / CURRENT))
+    except FileNotFoundError:
+        return None
+
+
+def get_user_snapshot() -> Optional[UserSnapshot]:
+    """The latest generation of the snapshot, None when there is none"""
+    global _snapshot
+    directory = snapshot_directory()
+    if directory is None:
+        return None
+    try:
+        path = directory / os.readlink(directory / CURRENT)
+    except FileNotFoundError:
+        return None
+    with _snapshot_lock:
+        if _snapshot is None or _snapshot.path != path:
+            try:
+                _snapshot = UserSnapshot.open(path)
+            except FileNotFoundError:
+                # NOTE: replaced while opening, the next call gets the new one
+                return None
+        return _snapshot
+
+
+def _fetch(dictionaries: Dict[str, list], updated_since=None) -> Dict[str, np.ndarray]:
+    """
+    Columns of every user, or of the users updated since `updated_since`, sorted
+    by id. New values of the dictionary encoded columns are appended to
+    `dictionaries`.
+    """
+    sql = 'SELECT id, {columns}, {numeric} FROM users {where} ORDER BY id'.format(
+        columns=', '.join(
+            f'{name}_id' if name in FOREIGN_KEY_COLUMNS else name
+            for name in CODE_COLUMNS + INT_COLUMNS
+        ),
+        numeric=', '.join(f'{name}::float8' for name in NUMERIC_COLUMNS),
+        # NOTE: a full fetch is walked in keyset chunks to bound the rows in
+        #  memory, a delta is small and uses the index on updated
+        where='WHERE id > %s' if updated_since is None else 'WHERE updated >= %s',
+    )
+    if updated_since is None:
+        sql += ' LIMIT %s'
+    codes = {
+        name: {value: code for code, value in enumerate(dictionaries[name])}
+        for name in CODE_COLUMNS
+    }
+
+    def encode(name, value) -> int:
+        if value is None:
+            return -1
+        if value not in codes[name]:
+            codes[name][value] = len(dictionaries[name])
+            dictionaries[name].append(value)
+        return codes[name][value]
+
+    chunks: Dict[str, List[np.ndarray]] = {name: [] for name in COLUMNS}
+    position = 0
+    with connection.cursor() as cursor:
+        while True:
+            if updated_since is None:
+                cursor.execute(sql, [position, FETCH_CHUNK_SIZE])
+            else:
+                cursor.execute(sql, [updated_since])
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            values = dict(zip(COLUMNS, zip(*rows)))
+            chunks['id'].append(np.array(values['id'], dtype=np.int64))
+            for name in CODE_COLUMNS:
+                chunks[name].append(
+                    np.array([encode(name, v) for v in values[name]], dtype=np.int32)
+                )
+            for name in INT_COLUMNS:
+                chunks[name].append(
+                    np.array([-1 if v is None else v for v in values[name]], np.int16)
+                )
+            for name in NUMERIC_COLUMNS:
+                # NOTE: None becomes NaN for float64 arrays
+                chunks[name].append(np.array(values[name], dtype=np.float64))
+            if updated_since is not None:
+                break
+            position = int(chunks['id'][-1][-1])
+    return {
+        name: np.concatenate(arrays) if arrays else np.zeros(0, _dtype(name))
+        for name, arrays in chunks.items()
+    }
+
+
+def _dtype(name: str):
+    if name == 'id':
+        return np.int64
+    if name in CODE_COLUMNS:
+        return np.int32
+    if name in INT_COLUMNS:
+        return np.int16
+    return np.float64
+
+
+def _fetch_ids() -> np.ndarray:
+    """Ids of every user, sorted, an index only scan of the primary key"""
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT id FROM users ORDER BY id')
+        return np.fromiter((row[0] for row in cursor), dtype=np.int64)
+
+
+def _merge(
+    snapshot: UserSnapshot, delta: Dict[str, np.ndarray]
+) -> Dict[str, np.ndarray]:
+    """The columns of `snapshot` with the rows of `delta` replaced or added"""
+    ids = snapshot.columns['id']
+    positions = np.searchsorted(ids, delta['id'])
+    found = positions < len(ids)
+    found[found] = ids[positions[found]] == delta['id'][found]
+    added = ~found
+    columns = {}
+    for name in COLUMNS:
+        column = np.array(snapshot.columns[name])
+        column[positions[found]] = delta[name][found]
+        columns[name] = np.concatenate([column, delta[name][added]])
+    if added.any():
+        order = np.argsort(columns['id'], kind='stable')
+        columns = {name: column[order] for name, column in columns.items()}
+    return columns
+
+
+def _write(directory: Path, columns: Dict[str, np.ndarray], meta: dict) -> str:
+    generation = str(time.time_ns())
+    path = directory / generation
+    path.mkdir()
+    for name, column in columns.items():
+        np.save(path / f'{name}.npy', column)
+    (path / 'meta.json').write_text(json.dumps(dict(meta, generation=generation)))
+    # NOTE: a rename swaps the link atomically, readers see one or the other
+    link = directory / f'{CURRENT}.{generation}'
+    os.symlink(generation, link)
+    os.replace(link, directory / CURRENT)
+    return generation
+
+
+def _remove_old_generations(directory: Path, keep: Sequence[str]):
+    # NOTE: processes still mapping a removed generation keep reading it until
+    #  they pick up the new one, the files go once the last mapping does
+    for path in directory.iterdir():
+        if path.is_dir() and not path.is_symlink() and path.name not in keep:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+@contextmanager
+def _locked(directory: Path):
+    with open(directory / LOCK, 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _remove_deleted(
+    columns: Dict[str, np.ndarray], ids: np.ndarray
+) -> Dict[str, np.ndarray]:
+    """The rows of `columns` whose id is still in `ids`"""
+    kept = np.isin(columns['id'], ids, assume_unique=True)
+    if kept.all():
+        return columns
+    return {name: column[kept] for name, column in columns.items()}
+
+
+def refresh_user_snapshot(full: bool = False) -> dict:
+    """
+    Writes a new generation of the snapshot with the users updated since the
+    last one less the ones deleted, or with every user when `full`, when there
+    is no snapshot yet or when the last full one is older than
+    `USER_SNAPSHOT_REBUILD_INTERVAL`
+    """
+    directory = snapshot_directory()
+    if directory is None:
+        raise ImproperlyConfigured('Set USER_SNAPSHOT_DIR to refresh the snapshot')
+    directory.mkdir(parents=True, exist_ok=True)
+    with _locked(directory):
+        current = _open_current(directory)
+        started = timezone.now()
+        columns = None
+        deleted = 0
+        if current is not None and not full:
+            # NOTE: also rescales the features, see below
+            rebuilt = parse_datetime(current.meta.get('rebuilt') or '')
+            interval = timedelta(seconds=settings.USER_SNAPSHOT_REBUILD_INTERVAL)
+            full = rebuilt is None or started - rebuilt >= interval
+        if current is not None and not full:
+            dictionaries = {
+                name: list(values)
+                for name, values in current.meta['dictionaries'].items()
+            }
+            # NOTE: `updated` is the time of the save, which can commit after
+            #  later ones did
+            since = parse_datetime(current.meta['watermark']) - timedelta(
+                seconds=settings.USER_SNAPSHOT_DELTA_OVERLAP
+            )
+            # NOTE: read before the delta, a user added in between is left for
+            #  the next refresh rather than dropped right after being fetched
+            ids = _fetch_ids()
+            delta = _fetch(dictionaries, updated_since=since)
+            columns = _merge(current, delta)
+            rows = len(columns['id'])
+            columns = _remove_deleted(columns, ids)
+            deleted = rows - len(columns['id'])
+        full = columns is None
+        if full:
+            rebuilt = started
+            dictionaries = {name: [] for name in CODE_COLUMNS}
+            columns = _fetch(dictionaries)
+            scaling = feature_scaling(columns)
+        else:
+            # NOTE: unchanged users keep their features until the next full
+            #  refresh rescales them
+            scaling = current.meta['scaling']
+        generation = _write(
+            directory,
+            dict(columns, **{FEATURES: feature_matrix(columns, scaling)}),
+            dict(
+                watermark=started.isoformat(),
+                rebuilt=rebuilt.isoformat(),
+                rows=len(columns['id']),
+                dictionaries=dictionaries,
+                scaling=scaling,
+            ),
+        )
+        keep = [generation] + ([current.path.name] if current is not None else [])
+        _remove_old_generations(directory, keep)
+    return dict(
+        full=full,
+        rows=len(columns['id']),
+        changed=len(columns['id']) if full else len(delta['id']),
+        deleted=deleted,
+        generation=generation,
+    )
@@ -0,0 +1,23 @@
+import logging
+
+from authentication.bitmaps import ensure_user_bitmaps
+from authentication.rollups import refresh_cohort_rollups
+
+from webservices.celery import app
+
+logger = logging.getLogger(__name__)
+
+
+@app.task
+def refresh_cohort_rollups_task(full=False):
+    result = refresh_cohort_rollups(full=full)
+    logger.info('Refreshed cohort rollups: %s', result)
+    return result
+
+
+@app.task
+def ensure_user_bitmaps_task():
+    result = ensure_user_bitmaps()
+    if result is not None:
+        logger.info('Rebuilt user bitmaps: %s', result)
+    return result
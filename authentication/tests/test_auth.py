@@ -1,11 +1,20 @@
-from authentication.models import User
+from authentication.factories import MetropolitanAreaFactory
+from authentication.models import ChatUser, User, VerifyEmailLink
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
 from rest_framework.reverse import reverse
 from rest_framework.test import APITestCase
 
+from webservices.auth import CachedTokenAuthentication, _token_key
+
 
 class TestTokenAuth(APITestCase):
     def setUp(self):
+        cache.clear()
         self.email = "test_user"
         self.eng_password = "test_password"
         self.user = User.objects.create_user(
@@ -89,3 +98,152 @@ class TestTokenAuth(APITestCase):
         data = dict(current_password=self.eng_password, new_password="password")
         response = self.client.post(url, data=data)
         self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+
+
+class TestCachedTokenAuth(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.password = 'test_password'
+        self.user = User.objects.create_user(
+            username='test_user', email='test_user', password=self.password
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.url = reverse('auth_profile')
+
+    def assertTokenQueries(self, count, status_code=status.HTTP_200_OK):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(self.url)
+        self.assertEqual(status_code, response.status_code)
+        queries = [q['sql'] for q in context.captured_queries]
+        self.assertEqual(count, len([q for q in queries if 'authtoken_token' in q]))
+        return response
+
+    def test_cached(self):
+        self.assertTokenQueries(1)
+        response = self.assertTokenQueries(0)
+        self.assertEqual(str(self.user.uuid), response.data['uuid'])
+
+    def test_invalidated_by_saves(self):
+        self.assertTokenQueries(1)
+        self.user.email_verified = True
+        self.user.save()
+        self.assertTrue(self.assertTokenQueries(1).data['email_verified'])
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertTokenQueries(1, status.HTTP_401_UNAUTHORIZED)
+
+    def test_invalidated_by_password_change(self):
+        self.assertTokenQueries(1)
+        response = self.client.post(
+            reverse('change_password'),
+            data=dict(current_password=self.password, new_password='NewPassword!123'),
+        )
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertTokenQueries(1)
+
+    def test_revoked_token(self):
+        self.assertTokenQueries(1)
+        self.assertEqual(
+            status.HTTP_204_NO_CONTENT,
+            self.client.delete(reverse('logout')).status_code,
+        )
+        self.assertTokenQueries(1, status.HTTP_401_UNAUTHORIZED)
+
+        # a new token does not bring the previous one back
+        previous = self.token.key
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.assertTokenQueries(1)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {previous}')
+        self.assertTokenQueries(1, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deleted_token(self):
+        self.assertTokenQueries(1)
+        Token.objects.filter(user=self.user).delete()
+        self.assertTokenQueries(1, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deleted_user(self):
+        self.assertTokenQueries(1)
+        User.objects.filter(id=self.user.id).delete()
+        self.assertTokenQueries(1, status.HTTP_401_UNAUTHORIZED)
+
+    def test_revoked_while_authenticating(self):
+        backend = CachedTokenAuthentication()
+        key = self.token.key
+        user, _ = backend.fetch_credentials(key)
+        self.token.delete()
+        backend.remember(_token_key(key), user)
+        with self.assertRaises(AuthenticationFailed):
+            backend.authenticate_credentials(key)
+
+    def test_lean_principal(self):
+        backend = CachedTokenAuthentication()
+        # NOTE: from the database, then from the cache
+        for _ in range(2):
+            user, token = backend.authenticate_credentials(self.token.key)
+            self.assertEqual(self.token.key, token.key)
+            self.assertEqual(self.user.uuid, user.uuid)
+            self.assertEqual(
+                set(User.PRINCIPAL_FIELDS),
+                {f.attname for f in User._meta.concrete_fields}.difference(
+                    user.get_deferred_fields()
+                ),
+            )
+            with self.assertNumQueries(1):
+                self.assertEqual(self.user.net_worth, user.net_worth)
+                self.assertEqual(self.user.metro_id, user.metro_id)
+                self.assertTrue(user.check_password(self.password))
+            self.assertEqual(set(), user.get_deferred_fields())
+
+
+class TestProfileCache(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='test_user', email='test_user', password='test_password'
+        )
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.url = reverse('auth_profile')
+
+    def get_profile(self, etag=None, status_code=status.HTTP_200_OK):
+        headers = dict(HTTP_IF_NONE_MATCH=etag) if etag else {}
+        response = self.client.get(self.url, **headers)
+        self.assertEqual(status_code, response.status_code)
+        return response
+
+    def test_not_modified(self):
+        profile = self.get_profile()
+        etag = profile['ETag']
+        self.assertEqual(str(self.user.uuid), profile.data['uuid'])
+        with self.assertNumQueries(0):
+            response = self.get_profile(etag, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(etag, response['ETag'])
+        self.assertEqual(b'', response.content)
+        with self.assertNumQueries(0):
+            self.assertEqual(profile.data, self.get_profile().data)
+
+    def test_invalidation(self):
+        etag = self.get_profile()['ETag']
+        metro = MetropolitanAreaFactory(name='Boston-Cambridge-Newton, MA-NH')
+        self.user.metro = metro
+        self.user.save()
+        response = self.get_profile(etag)
+        self.assertEqual(metro.name, response.data['metro']['name'])
+
+        etag = response['ETag']
+        ChatUser.objects.create(
+            user=self.user, chat_engine_id=1, username='test_user', secret='secret'
+        )
+        response = self.get_profile(etag)
+        self.assertEqual('test_user', response.data['chat_user']['username'])
+
+        etag = response['ETag']
+        link = VerifyEmailLink.objects.create(user=self.user)
+        response = self.client.post(
+            reverse('verify_email'), data=dict(verify_link_uuid=str(link.uuid))
+        )
+        self.assertTrue(response.data['email_verified'])
+        self.assertTrue(self.get_profile(etag).data['email_verified'])
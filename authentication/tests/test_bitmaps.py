@@ -0,0 +1,105 @@
+from authentication.bitmaps import rebuild_user_bitmaps
+from authentication.factories import (
+    EmptyUserFactory,
+    MetropolitanAreaFactory,
+    UserFactory,
+)
+from authentication.models import User, user_bitmaps
+from django.core.cache import cache
+from rest_framework.reverse import reverse
+from rest_framework.test import APITestCase
+
+
+class TestUserBitmaps(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.boston = MetropolitanAreaFactory(name='Boston-Cambridge-Newton, MA-NH')
+        self.denver = MetropolitanAreaFactory(name='Denver-Aurora-Lakewood, CO')
+        for gender, level in [('female', 3), ('female', 4), ('male', 3)]:
+            UserFactory(metro=self.boston, gender=gender, level=level, age=30)
+        UserFactory(metro=self.denver, gender='female', level=3, age=50)
+        UserFactory.create_batch(3, metro=MetropolitanAreaFactory(name='Anywhere'))
+        EmptyUserFactory()
+        self.user = User.objects.filter(metro=self.denver).get()
+        self.client.force_authenticate(self.user)
+
+    def get_facets(self, **params):
+        response = self.client.get(reverse('user_facets'), data=params)
+        self.assertEqual(200, response.status_code, response.data)
+        return response.data
+
+    def test_facets_match_the_database(self):
+        for params in [
+            {},
+            dict(gender__in='female'),
+            dict(metro__in=f'{self.boston.id},{self.denver.id}', level__in='3'),
+            dict(metro=str(self.boston.id), gender__in='female,male'),
+            dict(current_pfm__in='mint', level__in='3,4,5'),
+        ]:
+            rebuild_user_bitmaps()
+            facets = self.get_facets(**params)
+            cache.clear()
+            self.assertFalse(user_bitmaps.is_built())
+            self.assertEqual(facets, self.get_facets(**params), params)
+
+    def test_facets(self):
+        rebuild_user_bitmaps()
+        with self.assertNumQueries(0):
+            facets = self.get_facets(metro__in=str(self.boston.id), level__in='3')
+        self.assertEqual(2, facets['count'])
+        # NOTE: every dimension ignores its own filter
+        self.assertIn(dict(value=self.boston.id, count=2), facets['facets']['metro'])
+        self.assertIn(dict(value=self.denver.id, count=1), facets['facets']['metro'])
+        self.assertEqual(
+            [dict(value=3, count=2), dict(value=4, count=1)], facets['facets']['level']
+        )
+        self.assertEqual(
+            [dict(value='female', count=1), dict(value='male', count=1)],
+            facets['facets']['gender'],
+        )
+        # values no user has match nobody
+        self.assertEqual(0, self.get_facets(metro__in='0', level__in='3.5')['count'])
+
+    def test_updates(self):
+        rebuild_user_bitmaps()
+        params = dict(metro__in=str(self.boston.id))
+        self.assertEqual(3, self.get_facets(**params)['count'])
+
+        self.user.metro = self.boston
+        self.user.save()
+        facets = self.get_facets(**params)
+        self.assertEqual(4, facets['count'])
+        self.assertIn(dict(value=self.boston.id, count=4), facets['facets']['metro'])
+        self.assertNotIn(
+            self.denver.id, [f['value'] for f in facets['facets']['metro']]
+        )
+
+        user = UserFactory(metro=self.boston, gender='male')
+        self.assertEqual(5, self.get_facets(**params)['count'])
+        self.assertEqual(2, self.get_facets(gender__in='male', **params)['count'])
+
+        # deferred dimensions are cleared from every value
+        User.objects.only('id').get(id=user.id).delete(hard_delete=True)
+        self.assertEqual(4, self.get_facets(**params)['count'])
+        self.assertEqual(1, self.get_facets(gender__in='male', **params)['count'])
+
+        self.assertEqual(User.objects.count(), self.get_facets()['count'])
+
+    def test_fallback(self):
+        # before a rebuild, and with other filters, the database counts them
+        params = dict(metro__in=str(self.boston.id), age__lt='40')
+        response = self.client.get(reverse('user_facets'), data=params)
+        self.assertEqual('MISS', response['X-Cache'])
+        self.assertEqual(3, response.data['count'])
+        self.assertIn(
+            dict(value=self.boston.id, count=3), response.data['facets']['metro']
+        )
+        self.assertEqual(
+            [dict(value='female', count=2), dict(value='male', count=1)],
+            response.data['facets']['gender'],
+        )
+        response = self.client.get(reverse('user_facets'), data=params)
+        self.assertEqual('HIT', response['X-Cache'])
+
+        rebuild_user_bitmaps()
+        self.assertEqual(1, self.get_facets(search=self.user.handle)['count'])
@@ -25,12 +25,36 @@ class TestListMetropolitanAreas(APITestCase):
         self.assertEqual(status.HTTP_200_OK, response.status_code)
         data = response.data
         self.assertEqual(20, len(data['results']))
+        self.assertEqual(['count', 'next', 'previous', 'results'], list(data))
 
         response = self.client.get(self.url, data=dict(page_size=50))
         self.assertEqual(status.HTTP_200_OK, response.status_code)
         data = response.data
         self.assertEqual(26, len(data['results']))
 
+    def test_not_modified(self):
+        response = self.client.get(self.url, data=dict(search='Tech'))
+        etag = response['ETag']
+        self.assertIn('max-age=300', response['Cache-Control'])
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                self.url, data=dict(search='Tech'), HTTP_IF_NONE_MATCH=etag
+            )
+        self.assertEqual(status.HTTP_304_NOT_MODIFIED, response.status_code)
+        self.assertEqual(etag, response['ETag'])
+
+        # other params, or a change of the table, are served in full
+        response = self.client.get(
+            self.url, data=dict(search='Tech1'), HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        MetropolitanAreaFactory(name='Tech25')
+        response = self.client.get(
+            self.url, data=dict(search='Tech'), HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(26, response.data['count'])
+
     def test_search(self):
         response = self.client.get(self.url, data=dict(search='24'))
         self.assertEqual(status.HTTP_200_OK, response.status_code)
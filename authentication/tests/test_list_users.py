@@ -1,10 +1,17 @@
+import json
+from decimal import Decimal
+
 from authentication.factories import (
+    EmptyUserFactory,
     IndustryFactory,
     JobTitleFactory,
     MetropolitanAreaFactory,
     UserFactory,
 )
-from authentication.models import User
+from authentication.models import ChatUser, User
+from authentication.serializers import UserListSerializer, UserSerializer
+from django.core.cache import cache
+from django.test import override_settings
 from rest_framework import status
 from rest_framework.reverse import reverse
 from rest_framework.test import APITestCase
@@ -229,6 +236,32 @@ class TestListUsers(APITestCase):
         self.assertEqual(status.HTTP_200_OK, response.status_code)
         self.assertEqual(3, len(response.data['results']))
 
+    def test_search_by_uuid(self):
+        other = UserFactory()
+        UserFactory()
+        response = self.client.get(self.url, data=dict(search=str(other.uuid)))
+        self.assertEqual([other.id], [r['id'] for r in response.data['results']])
+
+    def test_search_ranking(self):
+        users = [
+            UserFactory(handle=handle, age=age)
+            for handle, age in [('big_sam', 30), ('samwise', 40), ('sam', 35)]
+        ]
+        UserFactory(handle='not_included')
+        response = self.client.get(self.url, data=dict(search='SAM'))
+        ids = [r['id'] for r in response.data['results']]
+        # exact matches first
+        self.assertEqual(users[2].id, ids[0])
+        self.assertCountEqual([u.id for u in users], ids)
+
+        # an explicit order, or a keyset page, is kept as is
+        ordered = sorted(users, key=lambda u: (-u.age, u.id))
+        for params in [dict(order_by='-age'), dict(order_by='-age', cursor='')]:
+            response = self.client.get(self.url, data=dict(search='sam', **params))
+            self.assertEqual(
+                [u.id for u in ordered], [r['id'] for r in response.data['results']]
+            )
+
     def test_filter_by_handle(self):
         u1 = UserFactory(handle='other_name1')
         UserFactory(handle='other_name12')
@@ -238,3 +271,632 @@ class TestListUsers(APITestCase):
         self.assertEqual(status.HTTP_200_OK, response.status_code)
         self.assertEqual(1, len(response.data['results']))
         self.assertEqual(response.data['results'][0]['id'], u1.id)
+
+    def test_invalid_order_by(self):
+        response = self.client.get(self.url, data=dict(order_by='password'))
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+
+
+class TestListUsersKeysetPagination(APITestCase):
+    def setUp(self):
+        self.user = UserFactory()
+        self.client.force_authenticate(self.user)
+        self.url = reverse('user_list')
+
+    def walk_pages(self, **params):
+        ids = []
+        response = self.client.get(self.url, data=dict(cursor='', **params))
+        while True:
+            self.assertEqual(status.HTTP_200_OK, response.status_code)
+            self.assertNotIn('count', response.data)
+            ids.extend(row['id'] for row in response.data['results'])
+            if response.data['next'] is None:
+                return ids
+            response = self.client.get(response.data['next'])
+
+    def assertKeysetMatchesOrdering(self, order_by):
+        field = order_by.lstrip('-')
+        descending = order_by.startswith('-')
+        rows = list(User.objects.exclude(id=self.user.id).values_list('id', field))
+        # postgres puts NULLs last when ascending and first when descending,
+        #  ties are ascending by id either way
+        rows.sort(key=lambda r: r[0])
+        rows.sort(key=lambda r: (r[1] is None, r[1] or 0), reverse=descending)
+        ids = self.walk_pages(order_by=order_by, page_size=3)
+        self.assertEqual([r[0] for r in rows], ids)
+        # the same order as page numbers
+        response = self.client.get(
+            self.url, data=dict(order_by=order_by, page_size=100)
+        )
+        self.assertEqual(ids, [row['id'] for row in response.data['results']])
+
+    def test_walks_every_row_once_with_ties_and_nulls(self):
+        UserFactory.create_batch(4, age=30)
+        UserFactory.create_batch(3, age=40)
+        for u in UserFactory.create_batch(3):
+            # a missing input makes net worth NULL
+            u.assets_misc = None
+            u.save()
+        # force ties on net worth
+        User.objects.filter(net_worth__isnull=False, age=30).update(net_worth=0)
+        for order_by in ['age', '-age', 'net_worth', '-net_worth']:
+            self.assertKeysetMatchesOrdering(order_by)
+
+    def test_related_ordering(self):
+        ind1 = IndustryFactory(name='Tech')
+        ind2 = IndustryFactory(name='Manufacturing')
+        UserFactory.create_batch(3, industry=ind1)
+        UserFactory.create_batch(3, industry=ind2)
+        UserFactory.create_batch(2, industry=None)
+        for order_by in ['industry__name', '-industry__name']:
+            self.assertKeysetMatchesOrdering(order_by)
+
+    def test_page_size_and_filters(self):
+        UserFactory.create_batch(5, age=25)
+        UserFactory.create_batch(2, age=50)
+        response = self.client.get(
+            self.url, data=dict(cursor='', age__lt=30, page_size=2)
+        )
+        self.assertEqual(2, len(response.data['results']))
+        self.assertEqual(5, len(self.walk_pages(age__lt=30, page_size=2)))
+
+    def test_invalid_cursor(self):
+        response = self.client.get(self.url, data=dict(cursor='not-a-cursor'))
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+
+    def test_cursor_from_other_ordering_is_rejected(self):
+        UserFactory.create_batch(3)
+        response = self.client.get(
+            self.url, data=dict(cursor='', order_by='age', page_size=1)
+        )
+        response = self.client.get(
+            response.data['next'].replace('order_by=age', 'order_by=net_worth')
+        )
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+
+
+class TestListUsersCount(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = UserFactory()
+        self.client.force_authenticate(self.user)
+        self.url = reverse('user_list')
+
+    def test_count_is_cached_until_a_user_is_saved(self):
+        UserFactory.create_batch(3, age=25)
+        other = UserFactory(age=40)
+        response = self.client.get(self.url, data=dict(age=25))
+        self.assertEqual(3, response.data['count'])
+        self.assertTrue(response.data['count_exact'])
+
+        # bypasses User.save, so the cached count is served for every page
+        User.objects.filter(id=other.id).update(age=25)
+        response = self.client.get(self.url, data=dict(age=25, page=1))
+        self.assertEqual(3, response.data['count'])
+
+        UserFactory(age=25)
+        response = self.client.get(self.url, data=dict(age=25))
+        self.assertEqual(5, response.data['count'])
+
+    def test_count_is_cached_per_filter(self):
+        UserFactory.create_batch(2, age=25)
+        UserFactory.create_batch(3, age=30)
+        response = self.client.get(self.url, data=dict(age=25))
+        self.assertEqual(2, response.data['count'])
+        response = self.client.get(self.url, data=dict(age=30))
+        self.assertEqual(3, response.data['count'])
+        response = self.client.get(self.url, data=dict(age=30, search='hockey'))
+        self.assertEqual(3, response.data['count'])
+        response = self.client.get(self.url, data=dict(age=30, search='nobody'))
+        self.assertEqual(0, response.data['count'])
+
+    @override_settings(PAGINATION_APPROXIMATE_COUNT_THRESHOLD=0)
+    def test_approximate_count(self):
+        UserFactory.create_batch(3, age=25)
+        response = self.client.get(self.url, data=dict(age=25))
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertFalse(response.data['count_exact'])
+        self.assertEqual(3, len(response.data['results']))
+
+    @override_settings(PAGINATION_APPROXIMATE_COUNT_THRESHOLD=10**9)
+    def test_exact_count_below_threshold(self):
+        UserFactory.create_batch(3, age=25)
+        response = self.client.get(self.url, data=dict(age=25))
+        self.assertEqual(3, response.data['count'])
+        self.assertTrue(response.data['count_exact'])
+
+
+class TestListUsersCache(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = UserFactory()
+        self.client.force_authenticate(self.user)
+        self.url = reverse('user_list')
+
+    def test_hit_and_miss(self):
+        UserFactory.create_batch(3, age=25)
+        response = self.client.get(self.url, data=dict(age=25))
+        self.assertEqual('MISS', response['X-Cache'])
+        response = self.client.get(self.url, data=dict(age=25))
+        self.assertEqual('HIT', response['X-Cache'])
+        self.assertEqual(3, response.data['count'])
+        self.assertEqual(3, len(response.data['results']))
+
+        response = self.client.get(self.url, data=dict(age=25, page_size=2))
+        self.assertEqual('MISS', response['X-Cache'])
+        response = self.client.get(self.url, data=dict(age=25, order_by='-age'))
+        self.assertEqual('MISS', response['X-Cache'])
+
+    def test_key_is_normalized(self):
+        m1 = MetropolitanAreaFactory(name='Boston')
+        m2 = MetropolitanAreaFactory(name='New York')
+        UserFactory(metro=m1, age=30)
+        UserFactory(metro=m2, age=30)
+        response = self.client.get(
+            self.url, data={'metro__in': f'{m1.id},{m2.id}', 'age__gte': '30.0'}
+        )
+        self.assertEqual('MISS', response['X-Cache'])
+        response = self.client.get(
+            self.url, data={'age__gte': '30', 'metro__in': f'{m2.id},{m1.id}'}
+        )
+        self.assertEqual('HIT', response['X-Cache'])
+        self.assertEqual(2, len(response.data['results']))
+
+    def test_cache_is_per_requesting_user(self):
+        other = UserFactory()
+        self.client.get(self.url)
+        self.client.force_authenticate(other)
+        response = self.client.get(self.url)
+        self.assertEqual('MISS', response['X-Cache'])
+        self.assertNotIn(other.id, [row['id'] for row in response.data['results']])
+
+    def test_profile_update_invalidates(self):
+        other = UserFactory(age=25)
+        self.client.get(self.url, data=dict(age=25))
+        self.client.force_authenticate(other)
+        response = self.client.patch(
+            reverse('user_detail', kwargs=dict(uuid=str(other.uuid))),
+            data=dict(age=26),
+        )
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.client.force_authenticate(self.user)
+        response = self.client.get(self.url, data=dict(age=25))
+        self.assertEqual('MISS', response['X-Cache'])
+        self.assertEqual(0, len(response.data['results']))
+
+    def test_invalid_filters_are_not_cached(self):
+        response = self.client.get(self.url, data=dict(age='abc'))
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+
+
+class TestUserListSerializer(APITestCase):
+    def assertParity(self, queryset):
+        queryset = queryset.with_financial_annotations()
+        expected = UserSerializer(
+            queryset.with_related_objects_selected(), many=True
+        ).data
+        actual = UserListSerializer(
+            UserListSerializer.project(queryset), many=True
+        ).data
+        self.assertEqual(json.loads(json.dumps(expected)), actual)
+        self.assertEqual(
+            [list(row.keys()) for row in expected], [list(row.keys()) for row in actual]
+        )
+
+    def test_parity_with_user_serializer(self):
+        UserFactory.create_batch(5)
+        UserFactory(
+            inc_primary_annual=Decimal('123456.78'),
+            inc_primary_tax_fed=22.5,
+            inc_primary_tax_state=6.33,
+            inc_variable_monthly=Decimal('333.33'),
+            inc_secondary_monthly=Decimal('0'),
+            assets_savings=Decimal('1234567.89'),
+        )
+        chatty = UserFactory()
+        ChatUser.objects.create(
+            user=chatty,
+            chat_engine_id=1234,
+            username=chatty.handle,
+            secret='secret',
+            agreed_to_terms=True,
+        )
+        EmptyUserFactory()
+        incomplete = UserFactory(metro=None, industry=None, job_title=None)
+        incomplete.sav_market = None
+        incomplete.lia_misc = None
+        incomplete.save()
+        self.assertParity(User.objects.order_by('id'))
+
+    def test_list_view_uses_projection(self):
+        user = UserFactory()
+        UserFactory.create_batch(3)
+        self.client.force_authenticate(user)
+        with self.assertNumQueries(1):
+            # a single joined query, no per row lookups
+            response = self.client.get(reverse('user_list'), data=dict(cursor=''))
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(
+            json.loads(
+                json.dumps(
+                    UserSerializer(
+                        User.objects.exclude(id=user.id)
+                        .order_by('net_worth', 'id')
+                        .with_related_objects_selected()
+                        .with_financial_annotations(),
+                        many=True,
+                    ).data
+                )
+            ),
+            response.data['results'],
+        )
+
+
+class TestFinancialAnnotations(APITestCase):
+    def assertMatchesProperties(self, user):
+        annotated = User.objects.all().with_financial_annotations().get(id=user.id)
+        fresh = User.objects.get(id=user.id)
+        for name in User.FINANCIAL_ANNOTATIONS:
+            self.assertIn(name, annotated.__dict__)
+            expected = getattr(fresh, name)
+            actual = getattr(annotated, name)
+            if expected is None:
+                self.assertIsNone(actual, name)
+            else:
+                self.assertAlmostEqual(float(expected), float(actual), 6, name)
+
+    def test_matches_python_properties(self):
+        self.assertMatchesProperties(UserFactory())
+        self.assertMatchesProperties(
+            UserFactory(
+                inc_primary_annual=Decimal('123456.78'),
+                inc_primary_tax_fed=22.5,
+                inc_primary_tax_state=6.33,
+                inc_variable_monthly=Decimal('0'),
+                inc_secondary_monthly=Decimal('0'),
+            )
+        )
+        self.assertMatchesProperties(EmptyUserFactory())
+
+    def test_null_semantics(self):
+        for field in ['inc_primary_tax_state', 'sav_market', 'exp_other_fixed']:
+            user = UserFactory()
+            setattr(user, field, None)
+            user.save()
+            self.assertMatchesProperties(user)
+        user = UserFactory(
+            inc_primary_annual=0, inc_variable_monthly=0, inc_secondary_monthly=0
+        )
+        self.assertIsNone(user.inc_annual_tax_net)
+        self.assertMatchesProperties(user)
+
+    def test_save_drops_annotated_values(self):
+        user = User.objects.all().with_financial_annotations().get(id=UserFactory().id)
+        old_value = user.inc_variable_monthly_net
+        user.inc_variable_monthly += Decimal('100')
+        user.save()
+        self.assertNotIn('inc_variable_monthly_net', user.__dict__)
+        self.assertGreater(user.inc_variable_monthly_net, old_value)
+
+    def test_derived_metrics_are_stored(self):
+        user = UserFactory(
+            exp_housing=Decimal('1500.25'),
+            exp_other_fixed=Decimal('300.10'),
+            exp_other_variable=Decimal('420'),
+            sav_retirement=Decimal('500.05'),
+            sav_market=Decimal('250'),
+        )
+        stored = User.objects.values(
+            'inc_total_monthly_net', 'inc_annual_tax_net', 'exp_total', 'sav_total'
+        ).get(id=user.id)
+        annotated = User.objects.all().with_financial_annotations().get(id=user.id)
+        total_net = (
+            annotated.inc_primary_monthly_net
+            + annotated.inc_variable_monthly_net
+            + annotated.inc_secondary_monthly_net
+        )
+        self.assertAlmostEqual(
+            float(total_net), float(stored['inc_total_monthly_net']), delta=0.005
+        )
+        self.assertEqual(
+            user.exp_housing + user.exp_other_fixed + user.exp_other_variable,
+            stored['exp_total'],
+        )
+        self.assertEqual(user.sav_market + user.sav_retirement, stored['sav_total'])
+
+    def test_filter_and_order_by_derived_metrics(self):
+        user = UserFactory()
+        self.client.force_authenticate(user)
+        low = UserFactory(exp_housing=100, exp_other_fixed=100, exp_other_variable=100)
+        high = UserFactory(
+            exp_housing=1000, exp_other_fixed=1000, exp_other_variable=1000
+        )
+        url = reverse('user_list')
+        response = self.client.get(url, data=dict(exp_total__lt=1000))
+        self.assertEqual([low.id], [row['id'] for row in response.data['results']])
+        response = self.client.get(url, data=dict(exp_total__gte=300))
+        self.assertEqual(2, len(response.data['results']))
+        response = self.client.get(
+            url, data=dict(sav_rate__gte=low.sav_rate, order_by='sav_rate')
+        )
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertIn(low.id, [row['id'] for row in response.data['results']])
+
+        for params in [dict(), dict(cursor='')]:
+            response = self.client.get(url, data=dict(order_by='-exp_total', **params))
+            self.assertEqual(status.HTTP_200_OK, response.status_code)
+            self.assertEqual(
+                [high.id, low.id], [row['id'] for row in response.data['results']]
+            )
+
+
+class TestUserStats(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = UserFactory(age=60)
+        self.client.force_authenticate(self.user)
+        self.url = reverse('user_stats')
+
+    def test_stats(self):
+        for age in [20, 30, 40, 50]:
+            UserFactory(age=age)
+        EmptyUserFactory(age=None)
+        response = self.client.get(self.url, data=dict(age__lt=55))
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(4, response.data['count'])
+        self.assertEqual(
+            dict(
+                count=4,
+                mean=35.0,
+                min=20.0,
+                max=50.0,
+                p10=23.0,
+                p25=27.5,
+                median=35.0,
+                p75=42.5,
+                p90=47.0,
+            ),
+            response.data['fields']['age'],
+        )
+
+        # NOTE: the requesting user is part of the cohort, NULLs are not
+        response = self.client.get(self.url)
+        self.assertEqual(6, response.data['count'])
+        self.assertEqual(5, response.data['fields']['age']['count'])
+        self.assertEqual(60.0, response.data['fields']['age']['max'])
+
+    def test_decimal_fields(self):
+        for net_worth in ['100.10', '200.20', '300.30']:
+            user = UserFactory()
+            User.objects.filter(id=user.id).update(net_worth=Decimal(net_worth))
+        User.objects.filter(id=self.user.id).update(net_worth=None)
+        stats = self.client.get(self.url).data['fields']['net_worth']
+        self.assertEqual(200.2, stats['mean'])
+        self.assertEqual(200.2, stats['median'])
+        self.assertEqual(100.1, stats['min'])
+
+    def test_empty_cohort(self):
+        response = self.client.get(self.url, data=dict(age__gt=100))
+        self.assertEqual(0, response.data['count'])
+        self.assertEqual(
+            dict(
+                count=0,
+                mean=None,
+                min=None,
+                max=None,
+                p10=None,
+                p25=None,
+                median=None,
+                p75=None,
+                p90=None,
+            ),
+            response.data['fields']['net_worth'],
+        )
+
+    def test_cache(self):
+        UserFactory(age=30)
+        other = UserFactory(age=10)
+        response = self.client.get(self.url, data={'age__gte': '30.0'})
+        self.assertEqual('MISS', response['X-Cache'])
+        response = self.client.get(self.url, data={'age__gte': '30'})
+        self.assertEqual('HIT', response['X-Cache'])
+        self.assertEqual(2, response.data['count'])
+
+        # NOTE: shared by every requesting user
+        self.client.force_authenticate(other)
+        response = self.client.get(self.url, data={'age__gte': '30'})
+        self.assertEqual('HIT', response['X-Cache'])
+
+        UserFactory(age=35)
+        response = self.client.get(self.url, data={'age__gte': '30'})
+        self.assertEqual('MISS', response['X-Cache'])
+        self.assertEqual(3, response.data['count'])
+
+    def test_invalid_filters(self):
+        response = self.client.get(self.url, data=dict(age='abc'))
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+
+
+class TestUserHistogram(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = UserFactory(age=60)
+        self.client.force_authenticate(self.user)
+        self.url = reverse('user_histogram')
+        for age in [20, 25, 30, 39, 40]:
+            UserFactory(age=age)
+
+    def test_histogram(self):
+        response = self.client.get(
+            self.url, data=dict(metric='age', buckets=4, age__lt=55)
+        )
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        # NOTE: bounds default to the cohort min and max, max is included
+        self.assertEqual(
+            dict(
+                edges=[20.0, 25.0, 30.0, 35.0, 40.0],
+                counts=[1, 1, 1, 2],
+                below=0,
+                above=0,
+            ),
+            response.data['metrics']['age'],
+        )
+
+        response = self.client.get(
+            self.url, data=dict(metric='age', buckets=2, min=25, max=35)
+        )
+        self.assertEqual(
+            dict(edges=[25.0, 30.0, 35.0], counts=[1, 1], below=1, above=3),
+            response.data['metrics']['age'],
+        )
+
+    def test_several_metrics(self):
+        User.objects.update(net_worth=Decimal('10.50'))
+        User.objects.filter(age=20).update(net_worth=None)
+        with self.assertNumQueries(2):
+            # NOTE: one for the default bounds, one for every histogram
+            response = self.client.get(
+                self.url, data=dict(metric='age,net_worth', buckets=2, min=',5')
+            )
+        metrics = response.data['metrics']
+        self.assertEqual([20.0, 40.0, 60.0], metrics['age']['edges'])
+        self.assertEqual([4, 2], metrics['age']['counts'])
+        self.assertEqual([5.0, 7.75, 10.5], metrics['net_worth']['edges'])
+        self.assertEqual([0, 5], metrics['net_worth']['counts'])
+
+        # a single value is a single bucket
+        response = self.client.get(self.url, data=dict(metric='net_worth'))
+        self.assertEqual(
+            [5] + [0] * 19, response.data['metrics']['net_worth']['counts']
+        )
+
+    def test_cache(self):
+        params = dict(metric='age', buckets=3)
+        self.assertEqual('MISS', self.client.get(self.url, data=params)['X-Cache'])
+        with self.assertNumQueries(0):
+            self.assertEqual('HIT', self.client.get(self.url, data=params)['X-Cache'])
+        # NOTE: the default bounds come from the cached cohort stats
+        stats = self.client.get(reverse('user_stats'))
+        self.assertEqual('HIT', stats['X-Cache'])
+
+        UserFactory(age=45)
+        response = self.client.get(self.url, data=params)
+        self.assertEqual('MISS', response['X-Cache'])
+        self.assertEqual(7, sum(response.data['metrics']['age']['counts']))
+
+    def test_empty_cohort(self):
+        response = self.client.get(self.url, data=dict(metric='age', age__gt=100))
+        self.assertEqual(
+            dict(edges=[], counts=[], below=0, above=0),
+            response.data['metrics']['age'],
+        )
+
+    def test_invalid(self):
+        for params in [
+            dict(),
+            dict(metric='password'),
+            dict(metric='age', buckets=0),
+            dict(metric='age', min='1,2'),
+            dict(metric='age', age='abc'),
+        ]:
+            response = self.client.get(self.url, data=params)
+            self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code, params)
+
+
+@override_settings(USER_COMPARE_MIN_GROUP_SIZE=2)
+class TestUserCompare(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.boston = MetropolitanAreaFactory(name='Boston-Cambridge-Newton, MA-NH')
+        self.denver = MetropolitanAreaFactory(name='Denver-Aurora-Lakewood, CO')
+        for metro, level, age in [
+            (self.boston, 1, 20),
+            (self.boston, 1, 30),
+            (self.boston, 2, 40),
+            (self.denver, 1, 50),
+            (self.denver, 1, 60),
+            (self.denver, 2, 70),
+        ]:
+            UserFactory(metro=metro, level=level, age=age)
+        self.user = User.objects.get(age=20)
+        self.client.force_authenticate(self.user)
+        self.url = reverse('user_compare')
+        self.params = dict(metro__in=f'{self.boston.id},{self.denver.id}')
+
+    def test_compare(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                self.url, data=dict(group_by='metro', metric='age', **self.params)
+            )
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        data = response.data
+        self.assertEqual(['metro'], data['group_by'])
+        self.assertEqual(6, data['total']['count'])
+        self.assertEqual(45.0, data['total']['fields']['age']['mean'])
+        self.assertEqual(
+            [(self.boston.id, 3, 30.0), (self.denver.id, 3, 60.0)],
+            [
+                (group['metro'], group['count'], group['fields']['age']['median'])
+                for group in data['groups']
+            ],
+        )
+        self.assertEqual(['age'], list(data['groups'][0]['fields']))
+        self.assertNotIn('subtotals', data)
+
+    def test_two_dimensions(self):
+        response = self.client.get(
+            self.url, data=dict(group_by='metro,level', **self.params)
+        )
+        data = response.data
+        # NOTE: the groups of a single user are left out
+        self.assertEqual(
+            [(self.boston.id, 1, 2, 25.0), (self.denver.id, 1, 2, 55.0)],
+            [
+                (
+                    group['metro'],
+                    group['level'],
+                    group['count'],
+                    group['fields']['age']['mean'],
+                )
+                for group in data['groups']
+            ],
+        )
+        self.assertEqual(
+            [(1, 4), (2, 2)],
+            [(group['level'], group['count']) for group in data['subtotals']['level']],
+        )
+        self.assertEqual(2, len(data['subtotals']['metro']))
+        self.assertEqual(
+            set(User.COHORT_STATS_FIELDS), set(data['groups'][0]['fields'])
+        )
+
+    def test_min_group_size(self):
+        with override_settings(USER_COMPARE_MIN_GROUP_SIZE=7):
+            response = self.client.get(
+                self.url, data=dict(group_by='metro', **self.params)
+            )
+        self.assertEqual(7, response.data['min_group_size'])
+        self.assertIsNone(response.data['total'])
+        self.assertEqual([], response.data['groups'])
+
+    def test_cache(self):
+        params = dict(group_by='level', metric='age', **self.params)
+        self.assertEqual('MISS', self.client.get(self.url, data=params)['X-Cache'])
+        with self.assertNumQueries(0):
+            self.assertEqual('HIT', self.client.get(self.url, data=params)['X-Cache'])
+        UserFactory(metro=self.boston, level=2, age=45)
+        response = self.client.get(self.url, data=params)
+        self.assertEqual('MISS', response['X-Cache'])
+        self.assertEqual(7, response.data['total']['count'])
+
+    def test_invalid(self):
+        for params in [
+            dict(),
+            dict(group_by='age'),
+            dict(group_by='metro,metro'),
+            dict(group_by='metro,level,gender'),
+            dict(group_by='metro', metric='password'),
+            dict(group_by='metro', age='abc'),
+        ]:
+            response = self.client.get(self.url, data=params)
+            self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code, params)
@@ -0,0 +1,50 @@
+from authentication.plans import (
+    PLAN_CASES,
+    check_plans,
+    load_baseline,
+    plan_issues,
+    regressions,
+)
+from authentication.simulation import copy_simulated_dataset
+from django.test import TestCase
+
+
+class TestUserFilterPlans(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # NOTE: large enough for the planner to prefer the indexes it would
+        #  use on a full dataset
+        copy_simulated_dataset(users_per_metro=4000, seed=1)
+
+    def test_no_regressions(self):
+        results = check_plans(analyze=True)
+        self.assertEqual([name for name, _, _ in PLAN_CASES], list(results))
+        self.assertEqual({}, regressions(results, load_baseline()))
+
+    def test_flags_regressions(self):
+        # as if the indexes were gone
+        results = check_plans(
+            settings=dict(enable_indexscan='off', enable_bitmapscan='off')
+        )
+        found = regressions(results, load_baseline())
+        self.assertIn('seq scan', found['default'])
+        self.assertIn('sort of users.net_worth', found['default'])
+
+    def test_plan_issues(self):
+        scan = {
+            'Node Type': 'Index Scan',
+            'Relation Name': 'users',
+            'Plan Rows': 100000,
+            'Actual Rows': 20,
+            'Actual Loops': 1,
+            'Rows Removed by Filter': 5000,
+        }
+        self.assertEqual(['index scan reading many rows'], plan_issues(scan, 1000))
+        self.assertEqual([], plan_issues(scan, 10000))
+        sort = {
+            'Node Type': 'Sort',
+            'Sort Key': ['users.age'],
+            'Plan Rows': 20,
+            'Plans': [{'Node Type': 'Index Scan', 'Plan Rows': 100000}],
+        }
+        self.assertEqual(['sort of users.age'], plan_issues(sort, 1000))
@@ -0,0 +1,92 @@
+from decimal import Decimal
+from io import StringIO
+
+from authentication.bitmaps import rebuild_user_bitmaps
+from authentication.factories import EmptyUserFactory, UserFactory
+from authentication.models import User, profile_cache_key, user_bitmaps
+from authentication.recompute import COMPUTED_COLUMNS, recompute_range
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db.models import Max, Min
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+
+from webservices.auth import CachedTokenAuthentication
+
+
+class TestRecomputeUserFields(APITestCase):
+    def setUp(self):
+        UserFactory.create_batch(20)
+        UserFactory(
+            inc_primary_annual=0, inc_variable_monthly=0, inc_secondary_monthly=0
+        )
+        UserFactory(inc_secondary_tax_state=None, lia_misc=None)
+        UserFactory(sav_market=None, assets_misc=None)
+        EmptyUserFactory()
+        # NOTE: what a formula change looks like, every computed field is stale
+        User.objects.update(
+            inc_total_annual=Decimal('1'),
+            net_monthly_profit_loss=None,
+            inc_total_monthly_net=Decimal('1'),
+            inc_annual_tax_net=1.0,
+            exp_total=Decimal('1'),
+            sav_total=None,
+            sav_rate=1.0,
+            assets_total=Decimal('1'),
+            lia_total=Decimal('1'),
+            net_worth=Decimal('1'),
+        )
+
+    def assertParity(self):
+        for user in User.objects.all():
+            stored = {name: getattr(user, name) for name in COMPUTED_COLUMNS}
+            user.recompute_fields()
+            for name in COMPUTED_COLUMNS:
+                expected = getattr(user, name)
+                if expected is None:
+                    self.assertIsNone(stored[name], name)
+                elif isinstance(expected, Decimal):
+                    self.assertEqual(
+                        expected.quantize(Decimal('0.01')), stored[name], name
+                    )
+                else:
+                    self.assertAlmostEqual(expected, stored[name], 9, name)
+
+    def test_parity_with_recompute_methods(self):
+        bounds = User.objects.aggregate(Min('id'), Max('id'))
+        first_id, last_id = bounds['id__min'], bounds['id__max']
+        stats = recompute_range(first_id, last_id, chunk_size=7)
+        self.assertEqual(User.objects.count(), stats['rows'])
+        self.assertEqual(User.objects.count(), stats['changed_rows'])
+        self.assertParity()
+
+        stats = recompute_range(first_id, last_id, chunk_size=7)
+        self.assertEqual(0, stats['changed_rows'])
+
+    def test_dry_run(self):
+        before = list(User.objects.values_list('net_worth', flat=True))
+        out = StringIO()
+        call_command('recompute_user_fields', dry_run=True, stdout=out)
+        self.assertIn(
+            f'{User.objects.count()} of {User.objects.count()} users', out.getvalue()
+        )
+        self.assertIn('net_worth:', out.getvalue())
+        self.assertEqual(before, list(User.objects.values_list('net_worth', flat=True)))
+
+    def test_command(self):
+        call_command('recompute_user_fields', chunk_size=5, stdout=StringIO())
+        self.assertParity()
+
+    def test_command_drops_cached_users(self):
+        user = User.objects.first()
+        backend = CachedTokenAuthentication()
+        token = Token.objects.create(user=user)
+        backend.authenticate_credentials(token.key)
+        cache.set(profile_cache_key(user.id), 'cached')
+        rebuild_user_bitmaps()
+        call_command('recompute_user_fields', stdout=StringIO())
+        self.assertIsNone(cache.get(profile_cache_key(user.id)))
+        self.assertFalse(user_bitmaps.is_built())
+        user.refresh_from_db()
+        principal, _ = backend.authenticate_credentials(token.key)
+        self.assertEqual(user.updated, principal.updated)
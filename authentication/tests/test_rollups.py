@@ -0,0 +1,224 @@
+import numpy as np
+from authentication.factories import MetropolitanAreaFactory, UserFactory
+from authentication.filters import UserFilter
+from authentication.models import CohortRollup, User
+from authentication.rollups import (
+    invalidate_cohort_rollups,
+    rebuild_cohort_rollups,
+    refresh_cohort_rollups,
+    rollup_filter,
+)
+from django.core.cache import cache
+from django.db.models import Count, Max, Min, Sum
+from rest_framework.authtoken.models import Token
+from rest_framework.reverse import reverse
+from rest_framework.test import APITestCase
+
+from webservices.sketch import QuantileSketch
+
+
+class TestQuantileSketch(APITestCase):
+    def test_relative_accuracy(self):
+        rng = np.random.default_rng(0)
+        values = np.concatenate(
+            [rng.lognormal(11, 1, 5000), -rng.lognormal(5, 1, 500), np.zeros(100)]
+        )
+        sketch = QuantileSketch.merged(
+            [
+                QuantileSketch.from_values(values[:3000]),
+                QuantileSketch.from_values(values[3000:]),
+            ]
+        )
+        self.assertEqual(len(values), sketch.count)
+        for fraction in [0, 0.01, 0.05, 0.25, 0.5, 0.9, 1]:
+            expected = np.quantile(values, fraction, method='lower')
+            self.assertLessEqual(
+                abs(sketch.quantile(fraction) - expected),
+                QuantileSketch.relative_accuracy * abs(expected),
+            )
+        below, equal = sketch.rank(float(np.median(values)))
+        self.assertLessEqual(below, len(values) // 2)
+        self.assertGreaterEqual(below + equal, len(values) // 2)
+        self.assertEqual((0, 0), sketch.rank(-1e12))
+        restored = QuantileSketch.from_dict(sketch.to_dict())
+        self.assertEqual(sketch.quantile(0.5), restored.quantile(0.5))
+
+    def test_empty(self):
+        self.assertIsNone(QuantileSketch.from_values(np.array([np.nan])).quantile(0.5))
+        self.assertIsNone(QuantileSketch.merged([]).quantile(0.5))
+
+
+class TestCohortRollups(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.boston = MetropolitanAreaFactory(name='Boston-Cambridge-Newton, MA-NH')
+        self.miami = MetropolitanAreaFactory(
+            name='Miami-Fort Lauderdale-West Palm Beach, FL'
+        )
+        for age in [31, 33, 35, 38, 52]:
+            UserFactory(metro=self.boston, level=3, gender='female', age=age)
+        UserFactory(metro=self.miami, level=3, gender='female', age=31)
+
+    def assertRollupMatches(self, rollup):
+        users = User.objects.filter(
+            metro=rollup.metro_id,
+            industry=rollup.industry_id,
+            job_title=rollup.job_title_id,
+            level=rollup.level,
+            gender=rollup.gender,
+            age__gte=rollup.age_band,
+            age__lt=rollup.age_band + 10,
+        )
+        self.assertEqual(users.count(), rollup.user_count)
+        expected = users.aggregate(
+            count=Count('net_worth'),
+            sum=Sum('net_worth'),
+            min=Min('net_worth'),
+            max=Max('net_worth'),
+        )
+        stats = rollup.stats['net_worth']
+        self.assertEqual(expected['count'], stats['count'])
+        self.assertAlmostEqual(float(expected['sum']), stats['sum'], 2)
+        self.assertEqual(float(expected['min']), stats['min'])
+        self.assertEqual(float(expected['max']), stats['max'])
+        self.assertEqual(expected['count'], sum(stats['sketch']['counts']))
+
+    def test_rebuild(self):
+        result = rebuild_cohort_rollups()
+        self.assertEqual(User.objects.count(), result['users'])
+        self.assertEqual(CohortRollup.objects.count(), result['cells'])
+        self.assertEqual(
+            User.objects.count(),
+            sum(CohortRollup.objects.values_list('user_count', flat=True)),
+        )
+        for rollup in CohortRollup.objects.filter(age_band__isnull=False):
+            self.assertRollupMatches(rollup)
+
+    def test_refresh_only_touches_dirty_cells(self):
+        rebuild_cohort_rollups()
+        user = User.objects.get(metro=self.miami)
+        previous_cell = user.cohort_cell
+        untouched = CohortRollup.objects.get(
+            cell=User.objects.filter(age=52).get().cohort_cell
+        )
+
+        user.metro = self.boston
+        user.save()
+        result = refresh_cohort_rollups()
+        self.assertFalse(result['full'])
+        self.assertEqual(2, result['cells'])
+        self.assertFalse(CohortRollup.objects.filter(cell=previous_cell).exists())
+        rollup = CohortRollup.objects.get(cell=user.cohort_cell)
+        self.assertRollupMatches(rollup)
+        self.assertEqual(
+            untouched.updated, CohortRollup.objects.get(id=untouched.id).updated
+        )
+
+        # nothing changed since
+        self.assertEqual(0, refresh_cohort_rollups()['cells'])
+
+    def test_refresh_with_deferred_dimensions(self):
+        rebuild_cohort_rollups()
+        user = User.objects.filter(metro=self.miami).only('id', 'metro').get()
+        previous_cell = user.cohort_cell
+        user = User.objects.only('id', 'age').get(id=user.id)
+        user.age = 45
+        user.save()
+        result = refresh_cohort_rollups()
+        self.assertEqual(2, result['cells'])
+        self.assertFalse(CohortRollup.objects.filter(cell=previous_cell).exists())
+        self.assertRollupMatches(
+            CohortRollup.objects.get(cell=User.objects.get(id=user.id).cohort_cell)
+        )
+
+    def test_refresh_rebuilds_when_invalidated(self):
+        rebuild_cohort_rollups()
+        invalidate_cohort_rollups()
+        self.assertTrue(refresh_cohort_rollups()['full'])
+
+    def test_rollup_filter(self):
+        def translate(**params):
+            filterset = UserFilter(params, queryset=User.objects.none())
+            self.assertTrue(filterset.is_valid())
+            return rollup_filter(filterset.form.cleaned_data)
+
+        self.assertIsNotNone(
+            translate(metro__in='1,2', level__gte='3', gender__in='male')
+        )
+        self.assertIsNotNone(translate(age__gte='30', age__lte='49'))
+        self.assertIsNone(translate(age__gte='31'))
+        self.assertIsNone(translate(age='30'))
+        self.assertIsNone(translate(net_worth__gt='100'))
+
+    def test_stats_endpoint(self):
+        self.client.force_authenticate(User.objects.first())
+        url = reverse('user_stats')
+        params = dict(metro__in=str(self.boston.id), age__gte='30', age__lt='40')
+        exact = self.client.get(url, data=params).data
+        self.assertFalse(exact['approximate'])
+
+        rebuild_cohort_rollups()
+        cache.delete_pattern('*user_stats*')
+        approximate = self.client.get(url, data=params).data
+        self.assertTrue(approximate['approximate'])
+        self.assertEqual(4, approximate['count'])
+        for name in ['net_worth', 'age']:
+            expected, actual = exact['fields'][name], approximate['fields'][name]
+            for key in ['count', 'mean', 'min', 'max']:
+                self.assertAlmostEqual(expected[key], actual[key], 1)
+            # NOTE: the sketch picks a rank where percentile_cont interpolates
+            self.assertGreaterEqual(actual['median'], expected['min'])
+            self.assertLessEqual(actual['median'], expected['max'])
+
+        # a band cut in half needs the users
+        data = self.client.get(url, data=dict(age__gte='31')).data
+        self.assertFalse(data['approximate'])
+
+    def test_percentiles_endpoint(self):
+        user = User.objects.filter(metro=self.boston, age=35).get()
+        self.client.force_authenticate(user)
+        url = reverse('user_percentiles')
+        params = dict(metro__in=str(self.boston.id), age__gte='30', age__lt='40')
+        exact = self.client.get(url, data=params).data
+        self.assertFalse(exact['approximate'])
+        self.assertEqual(4, exact['count'])
+        # NOTE: 31 and 33 below, counting itself as half
+        self.assertEqual(
+            dict(value=35.0, percentile=62.5, error=0), exact['fields']['age']
+        )
+
+        rebuild_cohort_rollups()
+        with self.assertNumQueries(1):
+            approximate = self.client.get(url, data=params).data
+        self.assertTrue(approximate['approximate'])
+        with self.assertNumQueries(0):
+            self.assertEqual(approximate, self.client.get(url, data=params).data)
+        for name, expected in exact['fields'].items():
+            actual = approximate['fields'][name]
+            self.assertEqual(expected['value'], actual['value'])
+            if expected['percentile'] is None:
+                self.assertIsNone(actual['percentile'])
+                continue
+            self.assertLessEqual(
+                abs(expected['percentile'] - actual['percentile']),
+                actual['error'] + 0.01,
+                name,
+            )
+
+        # NOTE: the values of the user come with the principal
+        token = Token.objects.create(user=user)
+        self.client.force_authenticate(None)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.client.get(url, data=params)
+        with self.assertNumQueries(0):
+            self.assertEqual(approximate, self.client.get(url, data=params).data)
+
+        # moves to the next band once refreshed
+        other = User.objects.filter(metro=self.boston, age=31).get()
+        other.age = 45
+        other.save()
+        self.assertEqual(approximate, self.client.get(url, data=params).data)
+        refresh_cohort_rollups()
+        data = self.client.get(url, data=params).data
+        self.assertEqual(3, data['count'])
+        self.assertEqual(50.0, data['fields']['age']['percentile'])
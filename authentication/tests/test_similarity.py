@@ -0,0 +1,124 @@
+import tempfile
+from decimal import Decimal
+
+import numpy as np
+from authentication.factories import (
+    IndustryFactory,
+    MetropolitanAreaFactory,
+    UserFactory,
+)
+from authentication.similarity import SEARCH_BLOCK_SIZE, nearest
+from authentication.snapshot import refresh_user_snapshot
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework import status
+from rest_framework.reverse import reverse
+from rest_framework.test import APITestCase
+
+
+class TestNearest(TestCase):
+    def test_blocks(self):
+        rng = np.random.default_rng(7)
+        features = rng.normal(size=(2 * SEARCH_BLOCK_SIZE + 10, 3)).astype(np.float32)
+        vector = features[5]
+        rows = np.arange(1, len(features))
+        found, distances = nearest(features, rows, vector, 4)
+        expected = np.sqrt(np.square(features[rows] - vector).sum(axis=1))
+        self.assertEqual(rows[np.argsort(expected)[:4]].tolist(), found.tolist())
+        np.testing.assert_allclose(np.sort(expected)[:4], distances, rtol=1e-5)
+
+        found, _ = nearest(features, rows[:2], vector, 4)
+        self.assertEqual(2, len(found))
+
+
+class TestUserSimilar(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.boston = MetropolitanAreaFactory(name='Boston-Cambridge-Newton, MA-NH')
+        self.software = IndustryFactory(name='SaaS Software')
+        self.finance = IndustryFactory(name='Finance')
+
+        def user(age, income, industry=self.software, metro=self.boston):
+            # NOTE: every amount follows the income, so the distances do not
+            #  depend on the random factory values
+            income = Decimal(income)
+            return UserFactory(
+                metro=metro,
+                industry=industry,
+                age=age,
+                level=3,
+                inc_primary_annual=income,
+                inc_variable_monthly=0,
+                inc_secondary_monthly=0,
+                exp_housing=income / 40,
+                exp_other_fixed=income / 100,
+                exp_other_variable=income / 100,
+                sav_retirement=income / 100,
+                sav_market=0,
+                assets_savings=income,
+                assets_property=0,
+                assets_misc=0,
+                lia_loans=0,
+                lia_credit_card=0,
+                lia_misc=0,
+            )
+
+        self.user = user(30, 100000)
+        self.close = user(31, 105000)
+        self.closer_elsewhere = user(30, 100000, industry=self.finance)
+        self.far = user(55, 400000)
+        user(
+            30,
+            100000,
+            metro=MetropolitanAreaFactory(name='Denver-Aurora-Lakewood, CO'),
+        )
+        self.client.force_authenticate(self.user)
+        self.url = reverse('user_similar')
+
+    def get_ids(self, **params):
+        response = self.client.get(self.url, data=params)
+        self.assertEqual(status.HTTP_200_OK, response.status_code, response.data)
+        return [card['id'] for card in response.data['results']]
+
+    def test_similar(self):
+        response = self.client.get(self.url)
+        results = response.data['results']
+        self.assertEqual([self.close.id, self.far.id], [r['id'] for r in results])
+        self.assertLess(results[0]['distance'], results[1]['distance'])
+        self.assertEqual(
+            dict(id=self.boston.id, name=self.boston.name), results[0]['metro']
+        )
+        self.assertEqual(str(self.close.uuid), results[0]['uuid'])
+        self.assertNotIn('email', results[0])
+
+        self.assertEqual(
+            [self.closer_elsewhere.id, self.close.id],
+            self.get_ids(same_industry='false', k=2),
+        )
+        self.assertEqual(
+            4, len(self.get_ids(same_metro='false', same_industry='false'))
+        )
+
+    def test_snapshot(self):
+        expected = [
+            self.get_ids(),
+            self.get_ids(same_industry='false', k=2),
+            self.get_ids(same_metro='false', same_industry='false', k=3),
+        ]
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        with override_settings(USER_SNAPSHOT_DIR=directory.name):
+            refresh_user_snapshot()
+            with self.assertNumQueries(1):
+                # NOTE: only the cards are read from the database
+                actual = [self.get_ids()]
+            actual += [
+                self.get_ids(same_industry='false', k=2),
+                self.get_ids(same_metro='false', same_industry='false', k=3),
+            ]
+        self.assertEqual(expected, actual)
+
+    def test_invalid(self):
+        for params in [dict(k=0), dict(k=51), dict(same_metro='maybe')]:
+            response = self.client.get(self.url, data=params)
+            self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code, params)
@@ -0,0 +1,136 @@
+from decimal import Decimal
+
+import numpy as np
+from authentication.models import MetropolitanArea, User
+from authentication.recompute import COMPUTED_COLUMNS
+from authentication.simulation import (
+    INDUSTRIES,
+    JOB_TITLES,
+    METRO_AREAS,
+    NET_WORTH_COLUMNS,
+    build_simulated_dataset,
+    copy_simulated_dataset,
+    generate_users,
+)
+from django.db import connection
+from django.test import TestCase
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+
+from webservices.auth import CachedTokenAuthentication
+
+
+class TestCopySimulatedDataset(TestCase):
+    def count_indexes(self) -> int:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM pg_indexes WHERE tablename = 'users'")
+            return cursor.fetchone()[0]
+
+    def snapshot(self) -> list:
+        return list(
+            # NOTE: handles hold the metro id, which changes between loads
+            User.objects.order_by('uuid').values_list(
+                'uuid',
+                'age',
+                'metro__name',
+                'inc_primary_annual',
+                'net_worth',
+            )
+        )
+
+    def test_copy_loader(self):
+        indexes = self.count_indexes()
+        self.assertEqual(5 * 30, copy_simulated_dataset(users_per_metro=30, seed=1))
+        self.assertEqual(indexes, self.count_indexes())
+        self.assertEqual(150, User.objects.count())
+        for metro in MetropolitanArea.objects.all():
+            self.assertEqual(30, metro.users.count())
+
+        for user in User.objects.all():
+            self.assertFalse(user.has_usable_password())
+            self.assertEqual(4, user.uuid.version)
+            stored = {name: getattr(user, name) for name in COMPUTED_COLUMNS}
+            user.recompute_fields()
+            for name in COMPUTED_COLUMNS:
+                expected = getattr(user, name)
+                if expected is None:
+                    self.assertIsNone(stored[name], name)
+                elif isinstance(expected, Decimal):
+                    self.assertEqual(
+                        expected.quantize(Decimal('0.01')), stored[name], name
+                    )
+                else:
+                    self.assertAlmostEqual(expected, stored[name], 9, name)
+
+    def test_deterministic(self):
+        copy_simulated_dataset(users_per_metro=10, seed=1)
+        first = self.snapshot()
+        copy_simulated_dataset(users_per_metro=10, seed=1)
+        self.assertEqual(first, self.snapshot())
+        copy_simulated_dataset(users_per_metro=10, seed=2)
+        self.assertNotEqual(first, self.snapshot())
+
+    def test_wipe_drops_cached_users(self):
+        user = User.objects.create_user(username='user', email='user', password='pw')
+        token = Token.objects.create(user=user)
+        backend = CachedTokenAuthentication()
+        backend.authenticate_credentials(token.key)
+        with connection.cursor() as cursor:
+            # NOTE: the foreign key checks of the test transaction block TRUNCATE
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        copy_simulated_dataset(users_per_metro=1, seed=1)
+        with self.assertRaises(AuthenticationFailed):
+            backend.authenticate_credentials(token.key)
+
+    def test_orm_loader(self):
+        self.assertEqual(5 * 10, build_simulated_dataset(users_per_metro=10, seed=1))
+        self.assertEqual(50, User.objects.filter(metro__isnull=False).count())
+
+
+class TestGenerateUsers(TestCase):
+    def generate(self, metro_name, size=20000, seed=0):
+        return generate_users(
+            np.random.default_rng(seed),
+            size,
+            metro_name,
+            list(enumerate(INDUSTRIES)),
+            list(enumerate(JOB_TITLES)),
+        )
+
+    def test_salary_follows_level_and_metro(self):
+        new_york, dallas = list(METRO_AREAS)[0], list(METRO_AREAS)[2]
+        columns = self.generate(new_york)
+        medians = [
+            np.nanmedian(columns['inc_primary_annual'][columns['level'] == level])
+            for level in [
+                User.LevelChoices.IC_ASSOCIATE,
+                User.LevelChoices.IC,
+                User.LevelChoices.IC_SENIOR,
+                User.LevelChoices.IC_STAFF,
+            ]
+        ]
+        self.assertEqual(sorted(medians), medians)
+        self.assertGreater(
+            np.nanmedian(columns['inc_primary_annual']),
+            np.nanmedian(self.generate(dallas)['inc_primary_annual']),
+        )
+
+    def test_shapes(self):
+        columns = self.generate(list(METRO_AREAS)[0])
+        self.assertTrue((columns['age'] >= 21).all())
+        self.assertTrue((columns['age'] <= 70).all())
+        # secondary income is sparse, net worth is skewed
+        secondary = columns['inc_secondary_monthly']
+        self.assertLess(np.mean(secondary[~np.isnan(secondary)] > 0), 0.2)
+        net_worth = columns['net_worth'][~np.isnan(columns['net_worth'])]
+        self.assertGreater(np.mean(net_worth), 1.5 * np.median(net_worth))
+        # some users have not filled in their net worth
+        missing = np.isnan(columns[NET_WORTH_COLUMNS[0]])
+        self.assertTrue(0.05 < missing.mean() < 0.2)
+        for name in NET_WORTH_COLUMNS:
+            self.assertTrue((np.isnan(columns[name]) == missing).all())
+
+    def test_deterministic(self):
+        first, second = self.generate('Anywhere', 100), self.generate('Anywhere', 100)
+        for name, values in first.items():
+            np.testing.assert_array_equal(values, second[name])
@@ -0,0 +1,127 @@
+import tempfile
+
+from authentication.factories import (
+    EmptyUserFactory,
+    MetropolitanAreaFactory,
+    UserFactory,
+)
+from authentication.filters import UserFilter
+from authentication.models import User
+from authentication.snapshot import get_user_snapshot, refresh_user_snapshot
+from authentication.views import UserStatsView
+from django.core.cache import cache
+from django.test import override_settings
+from rest_framework.reverse import reverse
+from rest_framework.test import APITestCase
+
+
+class TestUserSnapshot(APITestCase):
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(
+            USER_SNAPSHOT_DIR=directory.name, USER_SNAPSHOT_DELTA_OVERLAP=0
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.boston = MetropolitanAreaFactory(name='Boston-Cambridge-Newton, MA-NH')
+        for age in [25, 31, 38, 52]:
+            UserFactory(metro=self.boston, age=age, level=3, gender='female')
+        UserFactory.create_batch(4, metro=MetropolitanAreaFactory(name='Anywhere'))
+        EmptyUserFactory()
+
+    def assertMatches(self, **params):
+        filterset = UserFilter(params, queryset=User.objects.all())
+        self.assertTrue(filterset.is_valid())
+        snapshot = get_user_snapshot()
+        mask = snapshot.mask(filterset.form.cleaned_data)
+        self.assertEqual(
+            sorted(filterset.qs.values_list('id', flat=True)),
+            sorted(snapshot.columns['id'][mask].tolist()),
+            params,
+        )
+
+    def test_filters(self):
+        self.assertTrue(refresh_user_snapshot()['full'])
+        self.assertMatches()
+        self.assertMatches(metro__in=str(self.boston.id), age__gte='30')
+        self.assertMatches(metro=str(self.boston.id), age__lt='40')
+        self.assertMatches(gender__in='female,male', level__gte='3')
+        self.assertMatches(level__lt='3')
+        self.assertMatches(level__in='3,4', net_worth__gt='1000.50')
+        self.assertMatches(inc_total_annual__lte='100000', sav_rate__gt='0.1')
+        # NOTE: not in the snapshot, the database answers those
+        filterset = UserFilter(dict(handle='someone'), queryset=User.objects.all())
+        self.assertTrue(filterset.is_valid())
+        self.assertIsNone(get_user_snapshot().mask(filterset.form.cleaned_data))
+
+    def test_stats_match_the_database(self):
+        refresh_user_snapshot()
+        snapshot = get_user_snapshot()
+        view = UserStatsView()
+        fractions = [fraction for _, fraction in view.percentiles]
+        expected = view.get_stats(User.objects.all())
+        actual = snapshot.stats(snapshot.mask({}), User.COHORT_STATS_FIELDS, fractions)
+        self.assertEqual(expected['count'], actual['count'])
+        for name in User.COHORT_STATS_FIELDS:
+            for key in ['count', 'mean', 'min', 'max']:
+                self.assertAlmostEqual(
+                    float(expected['fields'][name][key]),
+                    actual['fields'][name][key],
+                    6,
+                    name,
+                )
+            for value, expected_value in zip(
+                actual['fields'][name]['quantiles'],
+                expected['fields'][name]['quantiles'],
+            ):
+                self.assertAlmostEqual(expected_value, value, 6, name)
+
+    def test_delta_refresh(self):
+        first = refresh_user_snapshot()
+        user = User.objects.filter(metro=self.boston, age=25).get()
+        user.age = 45
+        user.save()
+        new_user = UserFactory(metro=MetropolitanAreaFactory(name='Anywhere'))
+        result = refresh_user_snapshot()
+        self.assertFalse(result['full'])
+        self.assertEqual(2, result['changed'])
+        self.assertEqual(first['rows'] + 1, result['rows'])
+        self.assertNotEqual(first['generation'], result['generation'])
+        self.assertMatches(age__gte='40')
+        self.assertMatches(metro__in=str(new_user.metro_id))
+
+        self.assertEqual(0, refresh_user_snapshot()['changed'])
+
+        # deleted users are dropped without a full refresh, however they went
+        new_user.delete(hard_delete=True)
+        User.objects.filter(metro=self.boston, age=31).delete()
+        result = refresh_user_snapshot()
+        self.assertFalse(result['full'])
+        self.assertEqual(2, result['deleted'])
+        self.assertEqual(first['rows'] - 1, result['rows'])
+        self.assertMatches()
+
+    def test_periodic_rebuild(self):
+        refresh_user_snapshot()
+        self.assertFalse(refresh_user_snapshot()['full'])
+        with override_settings(USER_SNAPSHOT_REBUILD_INTERVAL=0):
+            self.assertTrue(refresh_user_snapshot()['full'])
+
+    def test_endpoints(self):
+        refresh_user_snapshot()
+        user = User.objects.filter(metro=self.boston, age=31).get()
+        self.client.force_authenticate(user)
+        params = dict(metro__in=str(self.boston.id), age__gte='30')
+        with self.assertNumQueries(0):
+            stats = self.client.get(reverse('user_stats'), data=params).data
+        self.assertEqual(3, stats['count'])
+        self.assertFalse(stats['approximate'])
+        self.assertEqual(31.0, stats['fields']['age']['min'])
+        with self.assertNumQueries(0):
+            percentiles = self.client.get(reverse('user_percentiles'), data=params).data
+        self.assertEqual(
+            dict(percentile=16.67, error=0, value=31.0), percentiles['fields']['age']
+        )
@@ -7,11 +7,18 @@ from authentication.factories import (
     MetropolitanAreaFactory,
     UserFactory,
 )
-from authentication.models import User
+from authentication.lookups import get_user_id_by
+from authentication.models import User, profile_cache_key
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from rest_framework import status
 from rest_framework.reverse import reverse
 from rest_framework.test import APITestCase
 
+from webservices.auth import _principal_key
+from webservices.cache import LocalLRUCache, get_model_version
+
 
 class TestUpdateHandle(APITestCase):
     def setUp(self):
@@ -42,6 +49,24 @@ class TestUpdateHandle(APITestCase):
         response = self.client.patch(url, data=dict(handle='existing_handle'))
         self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
 
+    def test_handle_resolution(self):
+        other = UserFactory(handle='taken_handle')
+        url = reverse('check_handle', kwargs=dict(uuid=str(self.user.uuid)))
+        response = self.client.post(url, data=dict(handle='taken_handle'))
+        self.assertFalse(response.data['available'])
+
+        # the cached resolution does not outlive the handle
+        other.handle = 'given_up'
+        other.save()
+        response = self.client.post(url, data=dict(handle='taken_handle'))
+        self.assertTrue(response.data['available'])
+
+        url = reverse('update_handle', kwargs=dict(uuid=str(self.user.uuid)))
+        self.client.patch(url, data=dict(handle='taken_handle'))
+        self.client.patch(url, data=dict(handle='newer_handle'))
+        self.assertIsNone(get_user_id_by('handle', 'taken_handle'))
+        self.assertEqual(self.user.id, get_user_id_by('handle', 'newer_handle'))
+
     def test_handle_is_valid(self):
         url = reverse('check_handle', kwargs=dict(uuid=str(self.user.uuid)))
         response = self.client.post(url, data=dict(handle='Not identifier'))
@@ -88,6 +113,72 @@ class TestUpdateProfile(APITestCase):
         self.assertEqual(status.HTTP_200_OK, response.status_code)
         self.assertEqual(self.user.age, response.data['age'])
 
+    def test_get_details_by_primary_key(self):
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(self.url)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        (query,) = [q['sql'] for q in context.captured_queries]
+        self.assertIn(f'"users"."id" = {self.user.id}', query)
+
+        for uuid in ['not-a-uuid', '00000000-0000-0000-0000-000000000000']:
+            url = reverse('user_detail', kwargs=dict(uuid=uuid))
+            self.assertEqual(
+                status.HTTP_404_NOT_FOUND, self.client.get(url).status_code
+            )
+
+    def test_not_modified(self):
+        response = self.client.get(self.url)
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        self.assertIn('no-cache', response['Cache-Control'])
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(status.HTTP_304_NOT_MODIFIED, response.status_code)
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(status.HTTP_304_NOT_MODIFIED, response.status_code)
+
+        # nested objects count as well
+        self.user.metro.name = 'Springfield'
+        self.user.metro.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual('Springfield', response.data['metro']['name'])
+
+        etag = response['ETag']
+        response = self.client.patch(self.url, data=dict(age=44))
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(44, response.data['age'])
+
+    def test_modified_within_the_second(self):
+        updated = User.objects.get(id=self.user.id).updated.replace(microsecond=0)
+        User.objects.filter(id=self.user.id).update(updated=updated)
+        response = self.client.get(self.url)
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        self.assertFalse(etag.startswith('W/'))
+
+        User.objects.filter(id=self.user.id).update(
+            updated=updated.replace(microsecond=500000)
+        )
+        response = self.client.get(
+            self.url, HTTP_IF_NONE_MATCH=etag, HTTP_IF_MODIFIED_SINCE=last_modified
+        )
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(last_modified, response['Last-Modified'])
+        self.assertNotEqual(etag, response['ETag'])
+
+    def test_local_lru_cache(self):
+        local = LocalLRUCache(2)
+        local.set('a', 1)
+        local.set('b', 2)
+        self.assertEqual(1, local.get('a'))
+        local.set('c', 3)
+        self.assertIsNone(local.get('b'))
+        self.assertEqual([1, 3], [local.get('a'), local.get('c')])
+        local.delete('a')
+        self.assertEqual(0, local.get('a', 0))
+
     def test_another_user_cannot_patch(self):
         other_user = UserFactory()
         self.client.force_authenticate(other_user)
@@ -164,6 +255,12 @@ class TestUpdateProfile(APITestCase):
         self.assertNotEqual(
             refreshed_user.net_monthly_profit_loss, old_user.net_monthly_profit_loss
         )
+        self.assertEqual(refreshed_user.inc_total_monthly_net, Decimal('29940'))
+        self.assertAlmostEqual(refreshed_user.inc_annual_tax_net, 0.2)
+        self.assertEqual(refreshed_user.exp_total, Decimal('3000'))
+        self.assertEqual(refreshed_user.sav_total, Decimal('2000'))
+        self.assertAlmostEqual(refreshed_user.sav_rate, 2000 / 29940 * 100)
+        self.assertEqual('3000.00', response.data['exp_total'])
         # ensure other fields were NOT updated
         self.assertEqual(refreshed_user.handle, old_user.handle)
         self.assertEqual(refreshed_user.gender, old_user.gender)
@@ -195,6 +292,25 @@ class TestUpdateProfile(APITestCase):
         self.assertEqual(refreshed_user.gender, old_user.gender)
         self.assertEqual(refreshed_user.inc_primary_annual, old_user.inc_primary_annual)
 
+    def test_cannot_set_derived_metrics(self):
+        old_user = User.objects.get()
+        payload = dict(exp_total='1', sav_total='1', sav_rate=99.0, age=30)
+        response = self.client.patch(self.url, data=payload)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        refreshed_user = User.objects.get()
+        self.assertEqual(refreshed_user.exp_total, old_user.exp_total)
+        self.assertEqual(refreshed_user.sav_total, old_user.sav_total)
+        self.assertEqual(refreshed_user.sav_rate, old_user.sav_rate)
+
+    def test_derived_metrics_are_cleared(self):
+        payload = dict(sav_market='')
+        response = self.client.patch(self.url, data=payload, format='json')
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        refreshed_user = User.objects.get()
+        self.assertIsNone(refreshed_user.sav_total)
+        self.assertIsNone(refreshed_user.sav_rate)
+        self.assertEqual(refreshed_user.exp_total, Decimal('3300'))
+
     def test_bad_fields(self):
         payload = dict(age='dfvfdvfsd')
         response = self.client.patch(self.url, data=payload)
@@ -207,3 +323,105 @@ class TestUpdateProfile(APITestCase):
         self.assertEqual(status.HTTP_200_OK, response.status_code)
         self.assertNotEqual(refreshed_user.handle, payload['handle'])
         self.assertEqual(refreshed_user.age, payload['age'])
+
+
+class TestUserDirtyFields(APITestCase):
+    def setUp(self):
+        user = UserFactory(
+            age=20, sav_retirement=Decimal('500'), sav_market=Decimal('250')
+        )
+        self.user = User.objects.get(id=user.id)
+
+    def assertSavedColumns(self, columns):
+        with CaptureQueriesContext(connection) as queries:
+            self.user.save()
+        if not columns:
+            self.assertEqual(0, len(queries))
+            return
+        self.assertEqual(1, len(queries))
+        sql = queries[0]['sql']
+        self.assertTrue(sql.startswith('UPDATE'))
+        assigned = sql[sql.index(' SET ') + 5 : sql.index(' WHERE ')]
+        # NOTE: auto_now, written along with anything else
+        self.assertEqual(
+            sorted([*columns, 'updated']),
+            sorted(part.split(' = ')[0].strip('"') for part in assigned.split(', ')),
+        )
+
+    def test_get_dirty_fields(self):
+        self.assertEqual({}, self.user.get_dirty_fields())
+        self.user.age = 21
+        self.user.metro = None
+        self.assertEqual(
+            dict(age=20, metro=self.user._saved_values['metro_id']),
+            self.user.get_dirty_fields(),
+        )
+        self.user.age = 20
+        self.assertEqual(['metro'], list(self.user.get_dirty_fields()))
+
+    def test_save_writes_changed_fields_only(self):
+        self.user.age = 30
+        self.user.handle = 'new_handle'
+        self.assertSavedColumns(['age', 'handle'])
+        self.assertEqual({}, self.user.get_dirty_fields())
+        self.assertSavedColumns([])
+        refreshed_user = User.objects.get(id=self.user.id)
+        self.assertEqual(30, refreshed_user.age)
+        self.assertEqual('new_handle', refreshed_user.handle)
+
+    def test_save_recomputes_on_input_change(self):
+        self.user.exp_housing = self.user.exp_housing + Decimal('100')
+        self.assertSavedColumns(['exp_housing', 'exp_total', 'net_monthly_profit_loss'])
+        refreshed_user = User.objects.get(id=self.user.id)
+        self.assertEqual(
+            refreshed_user.exp_housing
+            + refreshed_user.exp_other_fixed
+            + refreshed_user.exp_other_variable,
+            refreshed_user.exp_total,
+        )
+
+    def test_save_skips_recompute(self):
+        # NOTE: stale on purpose, recompute_fields would put it back
+        User.objects.filter(id=self.user.id).update(net_worth=Decimal('1'))
+        self.user = User.objects.get(id=self.user.id)
+        self.user.age = 30
+        self.assertSavedColumns(['age'])
+        self.assertEqual(Decimal('1'), User.objects.get(id=self.user.id).net_worth)
+
+    def test_deferred_fields(self):
+        self.user = User.objects.only('id', 'age').get(id=self.user.id)
+        self.assertEqual({}, self.user.get_dirty_fields())
+        self.user.handle
+        self.assertEqual({}, self.user.get_dirty_fields())
+        self.user.age = 30
+        self.assertSavedColumns(['age'])
+
+    def test_cache_version_bumps(self):
+        version = get_model_version(User)
+        self.user.set_password('a new password')
+        self.user.save()
+        self.assertEqual(version, get_model_version(User))
+        self.user.age = 30
+        self.user.save()
+        self.assertEqual(version + 1, get_model_version(User))
+
+    def test_noop_save_keeps_caches(self):
+        version = get_model_version(User)
+        keys = [_principal_key(self.user.id), profile_cache_key(self.user.id)]
+        cache.set_many({key: 'cached' for key in keys})
+        self.user.save()
+        self.user.save(update_fields=[])
+        self.assertEqual(version, get_model_version(User))
+        self.assertEqual({key: 'cached' for key in keys}, cache.get_many(keys))
+
+    def test_profile_patch(self):
+        self.client.force_authenticate(self.user)
+        url = reverse('user_detail', kwargs=dict(uuid=str(self.user.uuid)))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(url, data=dict(age=31, level=self.user.level))
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        updates = [
+            query['sql'] for query in queries if query['sql'].startswith('UPDATE')
+        ]
+        self.assertEqual(1, len(updates))
+        self.assertRegex(updates[0], r'SET "updated" = [^,]+, "age" = 31 WHERE')
@@ -13,6 +13,11 @@ class UpdateUserValidator(serializers.ModelSerializer):
             'handle',
             'inc_total_annual',
             'net_monthly_profit_loss',
+            'inc_total_monthly_net',
+            'inc_annual_tax_net',
+            'exp_total',
+            'sav_total',
+            'sav_rate',
             'lia_total',
             'net_worth',
         ]
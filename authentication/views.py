@@ -1,12 +1,23 @@
+import math
+from collections import Counter
 from datetime import timedelta
+from typing import List, Optional, Tuple
 
+from authentication.bitmaps import (
+    FOREIGN_KEY_DIMENSIONS,
+    INT_DIMENSIONS,
+    bitmap_constraints,
+    is_bitmap_param,
+)
 from authentication.chat_engine_helper import ChatEngineHelper
 from authentication.filters import (
     IndustryFilter,
     JobTitleFilter,
     MetropolitanAreaFilter,
     UserFilter,
+    UserSearchFilter,
 )
+from authentication.lookups import forget_user_id, get_user_by, get_user_id_by
 from authentication.models import (
     Industry,
     JobTitle,
@@ -17,19 +28,46 @@ from authentication.models import (
     User,
     VerifyEmailLink,
     WaitListEntry,
+    profile_cache_key,
+    user_bitmaps,
 )
+from authentication.rollups import cohort_sketches, cohort_stats, rollup_filter
 from authentication.serializers import (
     IndustrySerializer,
     JobTitleSerializer,
     MetropolitanAreaSerializer,
     ProfileSerializer,
+    UserCardSerializer,
+    UserListSerializer,
     UserSerializer,
 )
+from authentication.similarity import (
+    database_scaling,
+    distance_expression,
+    feature_vector,
+)
+from authentication.snapshot import get_user_snapshot
 from authentication.validators import HandleValidator, UpdateUserValidator
 from django.conf import settings
 from django.contrib.auth.password_validation import validate_password
+from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist
-from django.shortcuts import get_object_or_404
+from django.db import connection
+from django.db.models import (
+    Avg,
+    BooleanField,
+    Case,
+    Count,
+    ExpressionWrapper,
+    FloatField,
+    Max,
+    Min,
+    Q,
+    Value,
+    When,
+)
+from django.db.models.functions import Cast
+from django.http import Http404
 from django.utils import timezone
 from django_filters import rest_framework as filters
 from rest_framework import serializers, status
@@ -38,26 +76,91 @@ from rest_framework.filters import SearchFilter
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 
+from webservices.api.mixins import CachedListViewMixin
 from webservices.api.views import (
+    ConditionalGetMixin,
     CreateAPIView,
     DestroyAPIView,
     ListAPIView,
     RetrieveAPIView,
     UpdateAPIView,
+    UpdatedConditionalGetMixin,
+    VersionConditionalGetMixin,
 )
+from webservices.cache import canonical_filter_params, get_model_version, hash_key
 from webservices.celery import send_email
-from webservices.paginators import StandardPageNumberPagination
+from webservices.expressions import PercentileCont, WidthBucket
+from webservices.paginators import (
+    CachedCountPageNumberPagination,
+    PageNumberOrKeysetPagination,
+    StandardPageNumberPagination,
+)
 from webservices.permissions import AdminOrUserSelf, MethodSpecificPermission
 
 
-class ProfileView(RetrieveAPIView):
+class UserLookupMixin:
+    """
+    Looks the user of a detail route up by `lookup_field` through the cached
+    id resolutions of `authentication.lookups`, i.e. a primary key fetch
+    """
+
+    lookup_field = 'uuid'
+
+    def get_object(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        user = get_user_by(queryset, self.lookup_field, self.kwargs[lookup_url_kwarg])
+        if user is None:
+            raise Http404
+        self.check_object_permissions(self.request, user)
+        return user
+
+
+def cached_profile(user: User, context: dict) -> dict:
+    """
+    The `ProfileSerializer` payload of `user` and its strong ETag, cached until
+    the user or their chat user is next saved
+    """
+    key = profile_cache_key(user.id)
+    profile = cache.get(key)
+    # NOTE: `updated` of the principal, which the bulk writes that bypass
+    #  User.save drop along with the profile, see `forget_cached_users`
+    if profile is None or profile['updated'] != user.updated:
+        instance = User.objects.all().with_related_objects_selected().get(pk=user.pk)
+        data = ProfileSerializer(instance=instance, context=context).data
+        profile = dict(updated=instance.updated, etag=hash_key(data), data=data)
+        cache.set(key, profile, timeout=settings.PROFILE_CACHE_TIMEOUT)
+    return profile
+
+
+class ProfileView(ConditionalGetMixin, RetrieveAPIView):
+    """
+    The profile of the requesting user, loaded on every page. An unchanged
+    profile is answered with a 304, see `cached_profile`.
+    """
+
     permission_classes = (IsAuthenticated,)
     serializer_class = ProfileSerializer
     queryset = User.objects.all()
+    # NOTE: the browser has to check back, the profile changes with any edit
+    cache_control = dict(private=True, no_cache=True)
 
     def get_object(self):
         return self.request.user
 
+    def get_profile(self) -> dict:
+        if not hasattr(self, '_profile'):
+            self._profile = cached_profile(
+                self.request.user, self.get_serializer_context()
+            )
+        return self._profile
+
+    def get_etag(self, request) -> Optional[str]:
+        return self.get_profile()['etag']
+
+    def retrieve(self, request, *args, **kwargs):
+        return Response(self.get_profile()['data'], status=status.HTTP_200_OK)
+
 
 # TODO: ping this on the frontend
 class LogoutView(DestroyAPIView):
@@ -69,33 +172,29 @@ class LogoutView(DestroyAPIView):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class CheckHandleView(CreateAPIView):
+class CheckHandleView(UserLookupMixin, CreateAPIView):
     permission_classes = (IsAuthenticated, AdminOrUserSelf)
     validator_class = HandleValidator
     queryset = User.objects.all()
-    lookup_field = 'uuid'
 
     def post(self, request, *args, **kwargs):
         self.check_permissions(request)
         validator = self.get_validator(data=request.data)
         validator.is_valid(raise_exception=True)
         data = validator.validated_data
-        if (
-            User.objects.filter(handle=data['handle'])
-            .exclude(id=request.user.id)
-            .exists()
-        ):
+        if get_user_id_by('handle', data['handle']) not in (None, request.user.id):
             return Response(status=status.HTTP_200_OK, data=dict(available=False))
         else:
             return Response(status=status.HTTP_200_OK, data=dict(available=True))
 
 
-class UpdateHandleView(UpdateAPIView):
+class UpdateHandleView(UserLookupMixin, UpdateAPIView):
     permission_classes = (IsAuthenticated, AdminOrUserSelf)
     validator_class = HandleValidator
     serializer_class = UserSerializer
-    queryset = User.objects.all().with_related_objects_selected()
-    lookup_field = 'uuid'
+    queryset = (
+        User.objects.all().with_related_objects_selected().with_financial_annotations()
+    )
 
     def perform_update(self, validator):
         handle_value = validator.validated_data['handle']
@@ -105,6 +204,7 @@ class UpdateHandleView(UpdateAPIView):
             .exists()
         ):
             raise serializers.ValidationError('A user with this handle already exists')
+        previous_handle = validator.instance.handle
         validator.instance.handle = handle_value
         try:
             chat_user = validator.instance.chat_user
@@ -112,15 +212,23 @@ class UpdateHandleView(UpdateAPIView):
         except ObjectDoesNotExist:
             pass
         validator.instance.save()
+        if previous_handle and previous_handle != handle_value:
+            forget_user_id('handle', previous_handle)
         return validator.instance
 
 
-class UserDetailsView(UpdateAPIView, RetrieveAPIView):
+class UserDetailsView(
+    UpdatedConditionalGetMixin, UserLookupMixin, UpdateAPIView, RetrieveAPIView
+):
     permission_classes = (IsAuthenticated, AdminOrUserSelf)
     validator_class = UpdateUserValidator
     serializer_class = UserSerializer
-    queryset = User.objects.all().with_related_objects_selected()
-    lookup_field = 'uuid'
+    queryset = (
+        User.objects.all().with_related_objects_selected().with_financial_annotations()
+    )
+    # NOTE: the related objects selected are nested in the payload
+    conditional_related = ['metro', 'industry', 'job_title', 'chat_user']
+    cache_control = dict(private=True, no_cache=True)
 
     def get_permissions(self):
         return [
@@ -133,27 +241,909 @@ class UserDetailsView(UpdateAPIView, RetrieveAPIView):
         return validator.save()
 
 
-# TODO: provide averages for major list metrics
+class UserListPagination(PageNumberOrKeysetPagination):
+    # NOTE: safe because User.save bumps the users cache version
+    page_number_class = CachedCountPageNumberPagination
+
+
 # TODO: fix string lookups when there is a comma in them
 #  for now, we are just going to search using the FK id
-class UserListView(ListAPIView):
+class UserListView(CachedListViewMixin, ListAPIView):
     permission_classes = (IsAuthenticated,)
-    # ToDo: come up with a more lightweight serializer?
-    serializer_class = UserSerializer
-    queryset = User.objects.all().with_related_objects_selected()
-    pagination_class = StandardPageNumberPagination
-    filter_backends = [SearchFilter, filters.DjangoFilterBackend]
+    serializer_class = UserListSerializer
+    queryset = User.objects.all().with_financial_annotations()
+    pagination_class = UserListPagination
+    filter_backends = [UserSearchFilter, filters.DjangoFilterBackend]
     search_fields = ['handle', 'uuid']
+    search_rank_ordering = True
     filterset_class = UserFilter
+    ordering_fields = [
+        'id',
+        'handle',
+        'age',
+        'level',
+        'metro__name',
+        'industry__name',
+        'job_title__name',
+        'inc_primary_annual',
+        'inc_variable_monthly',
+        'inc_secondary_monthly',
+        'exp_housing',
+        'inc_total_annual',
+        'net_monthly_profit_loss',
+        'inc_total_monthly_net',
+        'inc_annual_tax_net',
+        'exp_total',
+        'sav_total',
+        'sav_rate',
+        'assets_total',
+        'lia_total',
+        'net_worth',
+        'inc_primary_monthly_net',
+        'inc_variable_monthly_net',
+        'inc_secondary_monthly_net',
+    ]
+
+    def get_order_by(self) -> str:
+        order_by = self.request.query_params.get('order_by', 'net_worth')
+        if order_by.lstrip('-') not in self.ordering_fields:
+            raise ValidationError(dict(order_by=f'Cannot order by {order_by}'))
+        return order_by
+
+    @property
+    def list_cache_timeout(self) -> int:
+        return settings.USER_LIST_CACHE_TIMEOUT
+
+    def get_list_cache_key(self, request) -> Optional[str]:
+        filterset = self.filterset_class(
+            request.query_params, queryset=User.objects.none(), request=request
+        )
+        if not filterset.is_valid():
+            # NOTE: let the filter backend report the errors
+            return None
+        query_params = request.query_params
+        # NOTE: the requesting user is excluded from the results
+        return 'user_list:{version}:{hash}'.format(
+            version=get_model_version(User),
+            hash=hash_key(
+                canonical_filter_params(filterset),
+                self.get_order_by(),
+                # NOTE: searches are ranked unless ordered explicitly
+                'order_by' in query_params,
+                query_params.get('search', '').strip(),
+                query_params.get('page', '1'),
+                query_params.get('page_size'),
+                query_params.get('cursor'),
+                request.user.id,
+            ),
+        )
 
     def get_queryset(self):
-        order_by = self.request.query_params.get('order_by', 'net_worth')
-        return (
-            super().get_queryset().exclude(id=self.request.user.id).order_by(order_by)
+        # NOTE: id is the tiebreaker so pages are stable across requests
+        queryset = (
+            super()
+            .get_queryset()
+            .exclude(id=self.request.user.id)
+            .order_by(self.get_order_by(), 'id')
         )
+        return UserListSerializer.project(queryset)
+
 
+class CohortStatsMixin:
+    """
+    Cohort summaries of the users matched by the `UserFilter` params of the
+    user list. With a user snapshot on the host they are computed from it on
+    every request. Otherwise they are cached per canonical filter under the
+    users cache version, filters on the cohort rollup dimensions are answered
+    from the rollups (approximate percentiles) and anything else with a single
+    aggregate query.
+    """
 
-class MetropolitanAreaSearch(ListAPIView):
+    permission_classes = (IsAuthenticated,)
+    queryset = User.objects.all()
+    filter_backends = [UserSearchFilter, filters.DjangoFilterBackend]
+    search_fields = ['handle', 'uuid']
+    filterset_class = UserFilter
+    stats_fields = User.COHORT_STATS_FIELDS
+    percentiles = [
+        ('p10', 0.1),
+        ('p25', 0.25),
+        ('median', 0.5),
+        ('p75', 0.75),
+        ('p90', 0.9),
+    ]
+    cache_header = 'X-Cache'
+
+    def get_valid_filterset(self, request):
+        filterset = self.filterset_class(
+            request.query_params, queryset=User.objects.none(), request=request
+        )
+        # NOTE: otherwise let the filter backend report the errors
+        return filterset if filterset.is_valid() else None
+
+    def get_cache_key(self, prefix: str, request, filterset, *parts) -> str:
+        # NOTE: unlike the list the requesting user is part of the cohort, so
+        #  the same entry is shared by every user
+        return '{prefix}:{version}:{hash}'.format(
+            prefix=prefix,
+            version=get_model_version(User),
+            hash=hash_key(
+                canonical_filter_params(filterset),
+                request.query_params.get('search', '').strip(),
+                *parts,
+            ),
+        )
+
+    def get_rollup_stats(self, request, filterset) -> Optional[dict]:
+        if request.query_params.get('search', '').strip():
+            return None
+        q = rollup_filter(filterset.form.cleaned_data)
+        if q is None:
+            return None
+        stats = cohort_stats(q, [fraction for _, fraction in self.percentiles])
+        if stats is None:
+            return None
+        for field in stats['fields'].values():
+            total = field.pop('sum')
+            field['mean'] = total / field['count'] if field['count'] else None
+        return stats
+
+    def get_stats(self, queryset) -> dict:
+        aggregates = dict(count=Count('id'))
+        for name in self.stats_fields:
+            aggregates.update(
+                {
+                    f'{name}__count': Count(name),
+                    f'{name}__mean': Avg(name),
+                    f'{name}__min': Min(name),
+                    f'{name}__max': Max(name),
+                    f'{name}__percentiles': PercentileCont(
+                        name, [fraction for _, fraction in self.percentiles]
+                    ),
+                }
+            )
+        row = queryset.order_by().aggregate(**aggregates)
+        fields = {
+            name: dict(
+                count=row[f'{name}__count'],
+                mean=row[f'{name}__mean'],
+                min=row[f'{name}__min'],
+                max=row[f'{name}__max'],
+                quantiles=row[f'{name}__percentiles'] or [None] * len(self.percentiles),
+            )
+            for name in self.stats_fields
+        }
+        return dict(count=row['count'], fields=fields)
+
+    def format_stats(self, stats: dict, approximate: bool) -> dict:
+        def number(value):
+            return None if value is None else round(float(value), 2)
+
+        fields = {}
+        for name, field in stats['fields'].items():
+            fields[name] = dict(
+                count=field['count'],
+                mean=number(field['mean']),
+                min=number(field['min']),
+                max=number(field['max']),
+                **{
+                    key: number(value)
+                    for (key, _), value in zip(self.percentiles, field['quantiles'])
+                },
+            )
+        return dict(count=stats['count'], approximate=approximate, fields=fields)
+
+    def get_snapshot_mask(self, request, filterset) -> Optional[tuple]:
+        """The user snapshot and the cohort rows in it, when it has the columns"""
+        snapshot = get_user_snapshot()
+        if snapshot is None or request.query_params.get('search', '').strip():
+            return None
+        mask = snapshot.mask(filterset.form.cleaned_data)
+        return None if mask is None else (snapshot, mask)
+
+    def get_cohort_stats(self, request, filterset) -> Tuple[dict, bool]:
+        """The formatted stats of the cohort, and whether they were cached"""
+        snapshot_mask = self.get_snapshot_mask(request, filterset)
+        if snapshot_mask is not None:
+            # NOTE: about as fast as a cache hit, and as fresh as the snapshot
+            snapshot, mask = snapshot_mask
+            stats = snapshot.stats(
+                mask, self.stats_fields, [fraction for _, fraction in self.percentiles]
+            )
+            return self.format_stats(stats, approximate=False), False
+        key = self.get_cache_key('user_stats', request, filterset)
+        data = cache.get(key)
+        if data is not None:
+            return data, True
+        stats = self.get_rollup_stats(request, filterset)
+        if stats is not None:
+            data = self.format_stats(stats, approximate=True)
+        else:
+            stats = self.get_stats(self.filter_queryset(self.get_queryset()))
+            data = self.format_stats(stats, approximate=False)
+        cache.set(key, data, settings.USER_STATS_CACHE_TIMEOUT)
+        return data, False
+
+
+class UserStatsView(CohortStatsMixin, ListAPIView):
+    def list(self, request, *args, **kwargs):
+        filterset = self.get_valid_filterset(request)
+        if filterset is None:
+            # raises the validation error
+            self.filter_queryset(self.get_queryset())
+        data, cached = self.get_cohort_stats(request, filterset)
+        response = Response(data, status=status.HTTP_200_OK)
+        response[self.cache_header] = 'HIT' if cached else 'MISS'
+        return response
+
+
+class UserHistogramView(CohortStatsMixin, ListAPIView):
+    """
+    Equal width histograms of one or more metrics over the cohort, every metric
+    is bucketed by the database in the same single scan. The bounds default to
+    the cohort min and max of the (cached) cohort stats, the upper one is
+    inclusive.
+    """
+
+    class Validator(serializers.Serializer):
+        metric = serializers.ListField(
+            child=serializers.ChoiceField(choices=User.COHORT_STATS_FIELDS),
+            min_length=1,
+            max_length=5,
+        )
+        buckets = serializers.IntegerField(min_value=1, max_value=100, default=20)
+        # NOTE: one bound per metric, in the same order, blanks are the default
+        min = serializers.ListField(
+            child=serializers.FloatField(allow_null=True), required=False
+        )
+        max = serializers.ListField(
+            child=serializers.FloatField(allow_null=True), required=False
+        )
+
+        def to_internal_value(self, data):
+            def split(name):
+                return [
+                    value.strip() or None
+                    for values in data.getlist(name)
+                    for value in values.split(',')
+                ]
+
+            values = dict(metric=split('metric'))
+            if 'buckets' in data:
+                values['buckets'] = data['buckets']
+            for name in ['min', 'max']:
+                if name in data:
+                    values[name] = split(name)
+            return super().to_internal_value(values)
+
+        def validate(self, attrs):
+            for name in ['min', 'max']:
+                if len(attrs.get(name, [])) > len(attrs['metric']):
+                    raise ValidationError({name: 'More bounds than metrics'})
+            return attrs
+
+    validator_class = Validator
+
+    def get_bounds(self, request, filterset, params) -> List[Tuple[float, float]]:
+        stats = None
+        bounds = []
+        for i, metric in enumerate(params['metric']):
+            low = (params.get('min') or [])[i : i + 1] or [None]
+            high = (params.get('max') or [])[i : i + 1] or [None]
+            low, high = low[0], high[0]
+            if low is None or high is None:
+                if stats is None:
+                    stats, _ = self.get_cohort_stats(request, filterset)
+                field = stats['fields'][metric]
+                low = field['min'] if low is None else low
+                high = field['max'] if high is None else high
+            bounds.append((low, high))
+        return bounds
+
+    def get_histograms(self, queryset, metrics, buckets, bounds) -> dict:
+        annotations = {}
+        for i, (metric, (low, high)) in enumerate(zip(metrics, bounds)):
+            if low is None or high is None or low > high:
+                continue
+            # NOTE: width_bucket needs low < high, one value is one bucket
+            high = high if high > low else low + 1
+            annotations[f'bucket_{i}'] = Case(
+                When(**{metric: high}, then=Value(buckets)),
+                default=WidthBucket(
+                    Cast(metric, FloatField()),
+                    Value(float(low)),
+                    Value(float(high)),
+                    Value(buckets),
+                ),
+            )
+            bounds[i] = (low, high)
+        counts = {i: Counter() for i in range(len(metrics))}
+        if annotations:
+            sql, params = (
+                queryset.order_by()
+                .annotate(**annotations)
+                .values(*annotations)
+                .query.sql_with_params()
+            )
+            indexes = [int(name.split('_')[1]) for name in annotations]
+            # NOTE: unnest turns every row into one (metric, bucket) row per
+            #  metric, so a single scan counts the buckets of all of them
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT m.metric, m.bucket, count(*) FROM ({sql}) AS t '
+                    'CROSS JOIN LATERAL unnest(ARRAY[{indexes}], ARRAY[{columns}]) '
+                    'AS m (metric, bucket) WHERE m.bucket IS NOT NULL '
+                    'GROUP BY m.metric, m.bucket'.format(
+                        sql=sql,
+                        indexes=', '.join(map(str, indexes)),
+                        columns=', '.join(f't.{name}' for name in annotations),
+                    ),
+                    params,
+                )
+                for i, bucket, count in cursor.fetchall():
+                    counts[i][bucket] = count
+
+        histograms = {}
+        for i, (metric, (low, high)) in enumerate(zip(metrics, bounds)):
+            if f'bucket_{i}' not in annotations:
+                histograms[metric] = dict(edges=[], counts=[], below=0, above=0)
+                continue
+            width = (high - low) / buckets
+            histograms[metric] = dict(
+                edges=[round(low + width * k, 2) for k in range(buckets)]
+                + [round(high, 2)],
+                counts=[counts[i][k] for k in range(1, buckets + 1)],
+                below=counts[i][0],
+                above=counts[i][buckets + 1],
+            )
+        return histograms
+
+    def list(self, request, *args, **kwargs):
+        validator = self.get_validator(data=request.query_params)
+        validator.is_valid(raise_exception=True)
+        params = validator.validated_data
+        filterset = self.get_valid_filterset(request)
+        if filterset is None:
+            # raises the validation error
+            self.filter_queryset(self.get_queryset())
+
+        key = self.get_cache_key(
+            'user_histogram',
+            request,
+            filterset,
+            params['metric'],
+            params['buckets'],
+            params.get('min'),
+            params.get('max'),
+        )
+        data = cache.get(key)
+        if data is not None:
+            response = Response(data, status=status.HTTP_200_OK)
+            response[self.cache_header] = 'HIT'
+            return response
+
+        bounds = self.get_bounds(request, filterset, params)
+        data = dict(
+            buckets=params['buckets'],
+            metrics=self.get_histograms(
+                self.filter_queryset(self.get_queryset()),
+                params['metric'],
+                params['buckets'],
+                bounds,
+            ),
+        )
+        cache.set(key, data, settings.USER_STATS_CACHE_TIMEOUT)
+        response = Response(data, status=status.HTTP_200_OK)
+        response[self.cache_header] = 'MISS'
+        return response
+
+
+class UserPercentilesView(CohortStatsMixin, ListAPIView):
+    """
+    Percentile of the requesting user's value of every stats field within the
+    cohort, i.e. the share of the cohort below it counting ties as half.
+
+    Cohorts are ranked against the user snapshot when there is one. Otherwise
+    cohorts on the rollup dimensions are ranked against the merged rollup
+    sketches, refreshed along with the rollups. Users in other sketch buckets
+    are known to be below or above the value, only the ones within
+    `QuantileSketch.relative_accuracy` (about 2% either way) are not, so the
+    percentile is off by at most half their share. That bound is returned as
+    `error`, in percentage points. Other cohorts are counted exactly.
+    """
+
+    @staticmethod
+    def percentile(count: int, below: float, equal: float, error: float) -> dict:
+        if not count:
+            return dict(percentile=None, error=None)
+        return dict(
+            percentile=round(100 * (below + equal / 2) / count, 2),
+            error=round(100 * error / count, 2),
+        )
+
+    def get_sketch_percentiles(self, request, filterset, values) -> Optional[dict]:
+        if request.query_params.get('search', '').strip():
+            return None
+        q = rollup_filter(filterset.form.cleaned_data)
+        if q is None:
+            return None
+        sketches = cohort_sketches(q, hash_key(canonical_filter_params(filterset)))
+        if sketches is None:
+            return None
+        fields = {}
+        for name, value in values.items():
+            if value is None:
+                fields[name] = self.percentile(0, 0, 0, 0)
+                continue
+            sketch = sketches['fields'][name]
+            below, equal = sketch.rank(value)
+            # NOTE: the bucket ties span the values within the relative accuracy
+            fields[name] = self.percentile(sketch.count, below, equal, equal / 2)
+        return dict(count=sketches['count'], approximate=True, fields=fields)
+
+    def get_snapshot_percentiles(self, request, filterset, values) -> Optional[dict]:
+        snapshot_mask = self.get_snapshot_mask(request, filterset)
+        if snapshot_mask is None:
+            return None
+        snapshot, mask = snapshot_mask
+        fields = {}
+        for name, value in values.items():
+            if value is None:
+                fields[name] = self.percentile(0, 0, 0, 0)
+                continue
+            count, below, equal = snapshot.rank(mask, name, value)
+            fields[name] = self.percentile(count, below, equal, 0)
+        return dict(count=int(mask.sum()), approximate=False, fields=fields)
+
+    def get_exact_percentiles(self, queryset, values) -> dict:
+        aggregates = dict(count=Count('id'))
+        for name, value in values.items():
+            if value is None:
+                continue
+            aggregates.update(
+                {
+                    f'{name}__count': Count(name),
+                    f'{name}__below': Count('id', filter=Q(**{f'{name}__lt': value})),
+                    f'{name}__equal': Count('id', filter=Q(**{name: value})),
+                }
+            )
+        row = queryset.order_by().aggregate(**aggregates)
+        fields = {}
+        for name, value in values.items():
+            if value is None:
+                fields[name] = self.percentile(0, 0, 0, 0)
+                continue
+            fields[name] = self.percentile(
+                row[f'{name}__count'], row[f'{name}__below'], row[f'{name}__equal'], 0
+            )
+        return dict(count=row['count'], approximate=False, fields=fields)
+
+    def list(self, request, *args, **kwargs):
+        filterset = self.get_valid_filterset(request)
+        if filterset is None:
+            # raises the validation error
+            self.filter_queryset(self.get_queryset())
+        user = request.user
+        values = {}
+        for name in self.stats_fields:
+            value = getattr(user, name)
+            values[name] = None if value is None else float(value)
+
+        data = self.get_snapshot_percentiles(request, filterset, values)
+        if data is None:
+            data = self.get_sketch_percentiles(request, filterset, values)
+        if data is None:
+            data = self.get_exact_percentiles(
+                self.filter_queryset(self.get_queryset()),
+                {name: getattr(user, name) for name in self.stats_fields},
+            )
+        for name, value in values.items():
+            data['fields'][name]['value'] = value
+        return Response(data, status=status.HTTP_200_OK)
+
+
+class UserCompareView(CohortStatsMixin, ListAPIView):
+    """
+    Stats of the cohort grouped by one or two dimensions, with the subtotals
+    of every dimension and the total, all from a single grouping sets query.
+    Groups of fewer than `USER_COMPARE_MIN_GROUP_SIZE` users are left out.
+    """
+
+    class Validator(serializers.Serializer):
+        group_by = serializers.ListField(
+            child=serializers.ChoiceField(
+                choices=['metro', 'industry', 'job_title', 'level', 'gender']
+            ),
+            min_length=1,
+            max_length=2,
+        )
+        metric = serializers.ListField(
+            child=serializers.ChoiceField(choices=User.COHORT_STATS_FIELDS),
+            required=False,
+        )
+
+        def to_internal_value(self, data):
+            def split(name):
+                return [
+                    value.strip()
+                    for values in data.getlist(name)
+                    for value in values.split(',')
+                    if value.strip()
+                ]
+
+            values = dict(group_by=split('group_by'))
+            if 'metric' in data:
+                values['metric'] = split('metric')
+            return super().to_internal_value(values)
+
+        def validate(self, attrs):
+            if len(set(attrs['group_by'])) < len(attrs['group_by']):
+                raise ValidationError({'group_by': 'Duplicate dimensions'})
+            return attrs
+
+    validator_class = Validator
+
+    def get_groups(self, queryset, group_by, metrics) -> List[tuple]:
+        """Group values and stats of every grouping set, see `format_groups`"""
+        columns = [
+            f'{name}_id' if name in FOREIGN_KEY_DIMENSIONS else name
+            for name in group_by
+        ]
+        inner, params = (
+            queryset.order_by().values(*columns, *metrics).query.sql_with_params()
+        )
+        fractions = 'ARRAY[{}]::float8[]'.format(
+            ', '.join(repr(float(fraction)) for _, fraction in self.percentiles)
+        )
+        aggregates = [
+            f'count({name}), avg({name}), min({name}), max({name}), '
+            f'percentile_cont({fractions}) WITHIN GROUP (ORDER BY {name}::float8)'
+            for name in metrics
+        ]
+        sets = [f'({", ".join(columns)})'] + (
+            [f'({column})' for column in columns] if len(columns) > 1 else []
+        )
+        sql = (
+            'SELECT {columns}, GROUPING({columns}), count(*){aggregates} '
+            'FROM ({inner}) AS cohort GROUP BY GROUPING SETS ({sets}, ()) '
+            'HAVING count(*) >= %s'
+        ).format(
+            columns=', '.join(columns),
+            aggregates=''.join(f', {aggregate}' for aggregate in aggregates),
+            inner=inner,
+            sets=', '.join(sets),
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [*params, settings.USER_COMPARE_MIN_GROUP_SIZE])
+            return cursor.fetchall()
+
+    def format_groups(self, rows, group_by, metrics) -> dict:
+        width = len(group_by)
+        data = dict(
+            group_by=group_by,
+            min_group_size=settings.USER_COMPARE_MIN_GROUP_SIZE,
+            total=None,
+            groups=[],
+        )
+        if width > 1:
+            data['subtotals'] = {name: [] for name in group_by}
+        for row in rows:
+            bits = row[width]
+            values = row[width + 2 :]
+            stats = dict(
+                count=row[width + 1],
+                fields={
+                    name: dict(
+                        count=values[5 * i],
+                        mean=values[5 * i + 1],
+                        min=values[5 * i + 2],
+                        max=values[5 * i + 3],
+                        quantiles=values[5 * i + 4] or [None] * len(self.percentiles),
+                    )
+                    for i, name in enumerate(metrics)
+                },
+            )
+            group = self.format_stats(stats, approximate=False)
+            del group['approximate']
+            # NOTE: GROUPING sets the bit of every column left out of the set,
+            #  the first column being the highest
+            if bits == 0:
+                data['groups'].append(
+                    {name: row[i] for i, name in enumerate(group_by)} | group
+                )
+            elif bits == 2**width - 1:
+                data['total'] = group
+            else:
+                i = 0 if bits == 1 else 1
+                data['subtotals'][group_by[i]].append({group_by[i]: row[i]} | group)
+
+        def sort_key(group):
+            keys = [group[name] for name in group_by if name in group]
+            return -group['count'], [(key is None, key or 0) for key in keys]
+
+        data['groups'].sort(key=sort_key)
+        for groups in data.get('subtotals', {}).values():
+            groups.sort(key=sort_key)
+        return data
+
+    def list(self, request, *args, **kwargs):
+        validator = self.get_validator(data=request.query_params)
+        validator.is_valid(raise_exception=True)
+        params = validator.validated_data
+        filterset = self.get_valid_filterset(request)
+        if filterset is None:
+            # raises the validation error
+            self.filter_queryset(self.get_queryset())
+        group_by = params['group_by']
+        metrics = params.get('metric') or self.stats_fields
+
+        key = self.get_cache_key(
+            'user_compare',
+            request,
+            filterset,
+            group_by,
+            metrics,
+            settings.USER_COMPARE_MIN_GROUP_SIZE,
+        )
+        data = cache.get(key)
+        if data is not None:
+            response = Response(data, status=status.HTTP_200_OK)
+            response[self.cache_header] = 'HIT'
+            return response
+
+        rows = self.get_groups(
+            self.filter_queryset(self.get_queryset()), group_by, metrics
+        )
+        data = self.format_groups(rows, group_by, metrics)
+        cache.set(key, data, settings.USER_STATS_CACHE_TIMEOUT)
+        response = Response(data, status=status.HTTP_200_OK)
+        response[self.cache_header] = 'MISS'
+        return response
+
+
+class UserFacetsView(CohortStatsMixin, ListAPIView):
+    """
+    Count of the cohort and the count of users per value of every categorical
+    dimension (`User.BITMAP_DIMENSIONS`) within it, ignoring the dimension's
+    own filter so the counts show what choosing other values would match.
+
+    Categorical filters are answered from the user bitmaps. With a search or
+    other filters, or before the bitmaps are built, a single grouping sets
+    query counts every dimension and the result is cached like the stats.
+    """
+
+    dimensions = User.BITMAP_DIMENSIONS
+
+    @staticmethod
+    def decode(name: str, value: str):
+        if value == '':
+            return None
+        return int(value) if name in INT_DIMENSIONS else value
+
+    def format_facets(self, count: int, facets: dict) -> dict:
+        def sort_key(facet):
+            value = facet['value']
+            return -facet['count'], value is None, 0 if value is None else value
+
+        return dict(
+            count=count,
+            facets={
+                name: sorted(
+                    (
+                        dict(value=value, count=value_count)
+                        for value, value_count in facets[name].items()
+                        if value_count
+                    ),
+                    key=sort_key,
+                )
+                for name in self.dimensions
+            },
+        )
+
+    def get_bitmap_facets(self, request, filterset) -> Optional[dict]:
+        if request.query_params.get('search', '').strip():
+            return None
+        constraints = bitmap_constraints(filterset.form.cleaned_data)
+        if constraints is None:
+            return None
+        result = user_bitmaps.facets(constraints)
+        if result is None:
+            return None
+        facets = {
+            name: {
+                self.decode(name, value): count
+                for value, count in result['facets'][name].items()
+            }
+            for name in self.dimensions
+        }
+        return self.format_facets(result['count'], facets)
+
+    def get_facets(self, request, filterset) -> dict:
+        cleaned_data = filterset.form.cleaned_data
+        constraints = bitmap_constraints(
+            {
+                name: value
+                for name, value in cleaned_data.items()
+                if is_bitmap_param(name)
+            }
+        )
+        # NOTE: the other filters and the search narrow the rows, the
+        #  categorical ones become match flags so that every dimension can
+        #  ignore its own
+        other_params = request.query_params.copy()
+        for name in cleaned_data:
+            if is_bitmap_param(name):
+                other_params.pop(name, None)
+        queryset = UserSearchFilter().filter_queryset(
+            request, self.get_queryset(), self
+        )
+        queryset = self.filterset_class(
+            other_params, queryset=queryset, request=request
+        ).qs
+        matches = {}
+        for name, values in constraints.items():
+            lookup = (
+                f'{name}_id__in' if name in FOREIGN_KEY_DIMENSIONS else f'{name}__in'
+            )
+            matches[f'match_{name}'] = (
+                ExpressionWrapper(
+                    Q(**{lookup: [self.decode(name, value) for value in values]}),
+                    output_field=BooleanField(),
+                )
+                if values
+                else Value(False)
+            )
+        columns = [
+            f'{name}_id' if name in FOREIGN_KEY_DIMENSIONS else name
+            for name in self.dimensions
+        ]
+        inner, params = (
+            queryset.order_by()
+            .annotate(**matches)
+            .values(*columns, *matches)
+            .query.sql_with_params()
+        )
+
+        def condition(names) -> str:
+            return ' AND '.join(f'match_{name}' for name in names) or 'TRUE'
+
+        sql = (
+            'SELECT {columns}, GROUPING({columns}), count(*) FILTER (WHERE {all}), '
+            '{counts} FROM ({inner}) AS cohort '
+            'GROUP BY GROUPING SETS ({sets}, ())'
+        ).format(
+            columns=', '.join(columns),
+            all=condition(constraints),
+            counts=', '.join(
+                f'count(*) FILTER (WHERE {condition([d for d in constraints if d != name])})'
+                for name in self.dimensions
+            ),
+            inner=inner,
+            sets=', '.join(f'({column})' for column in columns),
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+
+        # NOTE: GROUPING sets the bit of every column left out of the set, the
+        #  first column being the highest
+        width = len(columns)
+        grouping = {(2**width - 1) ^ (1 << (width - 1 - i)): i for i in range(width)}
+        count = 0
+        facets = {name: {} for name in self.dimensions}
+        for row in rows:
+            bits = row[width]
+            if bits == 2**width - 1:
+                count = row[width + 1]
+                continue
+            i = grouping[bits]
+            facets[self.dimensions[i]][row[i]] = row[width + 2 + i]
+        return self.format_facets(count, facets)
+
+    def list(self, request, *args, **kwargs):
+        filterset = self.get_valid_filterset(request)
+        if filterset is None:
+            # raises the validation error
+            self.filter_queryset(self.get_queryset())
+
+        data = self.get_bitmap_facets(request, filterset)
+        if data is not None:
+            response = Response(data, status=status.HTTP_200_OK)
+            response[self.cache_header] = 'MISS'
+            return response
+        key = self.get_cache_key('user_facets', request, filterset)
+        data = cache.get(key)
+        if data is not None:
+            response = Response(data, status=status.HTTP_200_OK)
+            response[self.cache_header] = 'HIT'
+            return response
+        data = self.get_facets(request, filterset)
+        cache.set(key, data, settings.USER_STATS_CACHE_TIMEOUT)
+        response = Response(data, status=status.HTTP_200_OK)
+        response[self.cache_header] = 'MISS'
+        return response
+
+
+class UserSimilarView(ListAPIView):
+    """
+    The `k` users whose financial profile is the closest to the requesting
+    user's (see authentication.similarity), within their metro and industry
+    unless asked otherwise, nearest first.
+
+    With a user snapshot on the host the features are searched in memory,
+    otherwise the database orders the candidates by their distance.
+    """
+
+    permission_classes = (IsAuthenticated,)
+    queryset = User.objects.all()
+
+    class Validator(serializers.Serializer):
+        k = serializers.IntegerField(min_value=1, max_value=50, default=10)
+        same_metro = serializers.BooleanField(default=True)
+        same_industry = serializers.BooleanField(default=True)
+
+    validator_class = Validator
+
+    def get_scope(self, user, params) -> dict:
+        scope = {}
+        for name in ['metro', 'industry']:
+            value = getattr(user, f'{name}_id')
+            if params[f'same_{name}'] and value is not None:
+                scope[name] = value
+        return scope
+
+    def get_snapshot_neighbours(self, user, scope, k) -> Optional[list]:
+        snapshot = get_user_snapshot()
+        if snapshot is None:
+            return None
+        mask = snapshot.mask(scope)
+        mask &= snapshot.columns['id'] != user.id
+        ids, distances = snapshot.nearest(mask, user, k)
+        return list(zip(ids.tolist(), distances.tolist()))
+
+    def get_database_neighbours(self, user, scope, k) -> list:
+        key = f'user_similarity_scaling:{get_model_version(User)}'
+        scaling = cache.get(key)
+        if scaling is None:
+            scaling = database_scaling(self.get_queryset())
+            cache.set(key, scaling, settings.USER_STATS_CACHE_TIMEOUT)
+        distance = distance_expression(feature_vector(user, scaling), scaling)
+        rows = (
+            self.get_queryset()
+            .filter(**scope)
+            .exclude(id=user.id)
+            .annotate(distance=distance)
+            .order_by('distance', 'id')
+            .values_list('id', 'distance')[:k]
+        )
+        return [(user_id, math.sqrt(distance)) for user_id, distance in rows]
+
+    def list(self, request, *args, **kwargs):
+        validator = self.get_validator(data=request.query_params)
+        validator.is_valid(raise_exception=True)
+        params = validator.validated_data
+        user = request.user
+        scope = self.get_scope(user, params)
+
+        neighbours = self.get_snapshot_neighbours(user, scope, params['k'])
+        if neighbours is None:
+            neighbours = self.get_database_neighbours(user, scope, params['k'])
+        rows = {
+            row.id: row
+            for row in UserCardSerializer.project(
+                User.objects.filter(id__in=[user_id for user_id, _ in neighbours])
+            )
+        }
+        # NOTE: users deleted since the snapshot are skipped
+        results = [
+            dict(UserCardSerializer(rows[user_id]).data, distance=round(distance, 4))
+            for user_id, distance in neighbours
+            if user_id in rows
+        ]
+        return Response(dict(results=results), status=status.HTTP_200_OK)
+
+
+class MetropolitanAreaSearch(VersionConditionalGetMixin, ListAPIView):
     permission_classes = (IsAuthenticated,)
     serializer_class = MetropolitanAreaSerializer
     queryset = MetropolitanArea.objects.all().order_by('name')
@@ -161,9 +1151,11 @@ class MetropolitanAreaSearch(ListAPIView):
     filter_backends = [SearchFilter, filters.DjangoFilterBackend]
     search_fields = ['name']
     filterset_class = MetropolitanAreaFilter
+    conditional_models = [MetropolitanArea]
+    cache_control = dict(private=True, max_age=settings.ENTITY_SEARCH_MAX_AGE)
 
 
-class IndustrySearch(ListAPIView):
+class IndustrySearch(VersionConditionalGetMixin, ListAPIView):
     permission_classes = (IsAuthenticated,)
     serializer_class = IndustrySerializer
     queryset = Industry.objects.all().order_by('name')
@@ -171,9 +1163,11 @@ class IndustrySearch(ListAPIView):
     filter_backends = [SearchFilter, filters.DjangoFilterBackend]
     search_fields = ['name']
     filterset_class = IndustryFilter
+    conditional_models = [Industry]
+    cache_control = dict(private=True, max_age=settings.ENTITY_SEARCH_MAX_AGE)
 
 
-class JobTitleSearch(ListAPIView):
+class JobTitleSearch(VersionConditionalGetMixin, ListAPIView):
     permission_classes = (IsAuthenticated,)
     serializer_class = JobTitleSerializer
     queryset = JobTitle.objects.all().order_by('name')
@@ -181,17 +1175,18 @@ class JobTitleSearch(ListAPIView):
     filter_backends = [SearchFilter, filters.DjangoFilterBackend]
     search_fields = ['name']
     filterset_class = JobTitleFilter
+    conditional_models = [JobTitle]
+    cache_control = dict(private=True, max_age=settings.ENTITY_SEARCH_MAX_AGE)
 
 
 # NOTE: this lets one user create a chat user for another member, somewhat at will...this is because
 # we are creating chat users on demand as users try to chat to save cost with ChatEngine.io
 # That is why we are excluding the AdminOrUserSelf permission here
-class GetOrCreateChatUserView(CreateAPIView):
+class GetOrCreateChatUserView(UserLookupMixin, CreateAPIView):
     class Validator(serializers.Serializer):
         agreed_to_terms = serializers.BooleanField(required=True)
 
     queryset = User.objects.all()
-    lookup_field = 'uuid'
     permission_classes = (IsAuthenticated,)
     validator_class = Validator
     serializer_class = UserSerializer
@@ -209,12 +1204,11 @@ class GetOrCreateChatUserView(CreateAPIView):
         )
 
 
-class UpdateChatTermsAgreementView(CreateAPIView):
+class UpdateChatTermsAgreementView(UserLookupMixin, CreateAPIView):
     class Validator(serializers.Serializer):
         agreed_to_terms = serializers.BooleanField(required=True)
 
     queryset = User.objects.all()
-    lookup_field = 'uuid'
     permission_classes = (IsAuthenticated, AdminOrUserSelf)
     validator_class = Validator
     serializer_class = UserSerializer
@@ -250,7 +1244,9 @@ class ReportUserView(CreateAPIView):
         validator.is_valid(raise_exception=True)
         data = validator.validated_data
         user = self.get_object()
-        other_user = get_object_or_404(User, handle=data["handle"])
+        other_user = get_user_by(User.objects.all(), 'handle', data["handle"])
+        if other_user is None:
+            raise Http404
         ReportedMisconduct.objects.create(
             plaintiff=user,
             defendant=other_user,
@@ -382,9 +1378,9 @@ class VerifyEmailView(CreateAPIView):
         user.email_verified = True
         user.save()
         VerifyEmailLink.objects.filter(user=user).delete()
-        return Response(
-            status=status.HTTP_200_OK, data=self.get_serializer(instance=user).data
-        )
+        # NOTE: the save dropped the cached profile, this caches the new one
+        profile = cached_profile(user, self.get_serializer_context())
+        return Response(status=status.HTTP_200_OK, data=profile['data'])
 
 
 class RequestResetPasswordView(CreateAPIView):
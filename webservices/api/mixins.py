@@ -1,3 +1,6 @@
+from typing import Optional
+
+from django.core.cache import cache
 from rest_framework import status
 from rest_framework.response import Response
 
@@ -51,3 +54,35 @@ class DestroyViewMixin:
         instance = self.get_object()
         self.perform_destroy(instance)
         return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class CachedListViewMixin:
+    """
+    Read-through cache for serialized list responses. The cache key should be
+    scoped to a cache version (see `webservices.cache.get_model_version`) so that
+    invalidation is a single counter bump instead of finding every entry.
+    """
+
+    list_cache_timeout: Optional[int] = None
+    list_cache_header = 'X-Cache'
+
+    def get_list_cache_key(self, request) -> Optional[str]:
+        raise NotImplementedError(
+            'You should implement `get_list_cache_key` for <{cls}> view'.format(
+                cls=self.__class__.__name__
+            )
+        )
+
+    def list(self, request, *args, **kwargs):
+        key = self.get_list_cache_key(request)
+        data = cache.get(key) if key is not None else None
+        if data is not None:
+            response = Response(data, status=status.HTTP_200_OK)
+            response[self.list_cache_header] = 'HIT'
+            return response
+
+        response = super().list(request, *args, **kwargs)
+        if key is not None and response.status_code == status.HTTP_200_OK:
+            cache.set(key, response.data, self.list_cache_timeout)
+        response[self.list_cache_header] = 'MISS'
+        return response
@@ -1,9 +1,15 @@
-from typing import Iterable
+from datetime import datetime
+from typing import Iterable, List, Optional
 
+from django.core.exceptions import ObjectDoesNotExist
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
 from rest_framework import mixins as drf_mixins
 from rest_framework import serializers
 from rest_framework.generics import GenericAPIView
 
+from webservices.cache import get_model_version, hash_key
+
 from . import mixins
 
 
@@ -39,6 +45,95 @@ class BaseView(GenericAPIView):
         )
 
 
+class ConditionalGetMixin:
+    """
+    Answers a GET whose `If-None-Match` or `If-Modified-Since` still holds with
+    a 304, before serializing anything, and sets `ETag`, `Last-Modified` and
+    `Cache-Control` on the response. Views implement whichever of `get_etag`
+    and `get_last_modified` they can compute cheaply.
+    """
+
+    # NOTE: `patch_cache_control` arguments, i.e. dict(private=True, no_cache=True)
+    cache_control: Optional[dict] = None
+
+    def get_etag(self, request) -> Optional[str]:
+        return None
+
+    def get_last_modified(self, request) -> Optional[datetime]:
+        return None
+
+    def get(self, request, *args, **kwargs):
+        etag = self.get_etag(request)
+        etag = quote_etag(etag) if etag is not None else None
+        last_modified = self.get_last_modified(request)
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            if etag is not None:
+                response['ETag'] = etag
+            if timestamp is not None:
+                response['Last-Modified'] = http_date(timestamp)
+            if self.cache_control:
+                patch_cache_control(response, **self.cache_control)
+        return response
+
+
+class UpdatedConditionalGetMixin(ConditionalGetMixin):
+    """
+    `ConditionalGetMixin` of a detail view, off the `updated` timestamp of the
+    object and of the `conditional_related` objects nested in its payload.
+    The object is fetched once per request.
+
+    `Last-Modified` only has whole seconds, so the strong `ETag` sent along
+    with it hashes the timestamps to the microsecond, and `If-None-Match` takes
+    precedence over `If-Modified-Since` for the clients that send both.
+    """
+
+    conditional_related: List[str] = []
+
+    def get_object(self):
+        if not hasattr(self, '_conditional_object'):
+            self._conditional_object = super().get_object()
+        return self._conditional_object
+
+    def get_updated(self) -> List[Optional[datetime]]:
+        obj = self.get_object()
+        updated = [obj.updated]
+        for name in self.conditional_related:
+            try:
+                related = getattr(obj, name)
+            except ObjectDoesNotExist:
+                related = None
+            updated.append(related.updated if related is not None else None)
+        return updated
+
+    def get_etag(self, request) -> Optional[str]:
+        updated = [u.isoformat() if u is not None else None for u in self.get_updated()]
+        # NOTE: payloads may depend on who asks
+        return hash_key(self.get_object().pk, updated, request.user.pk)
+
+    def get_last_modified(self, request) -> Optional[datetime]:
+        return max(updated for updated in self.get_updated() if updated is not None)
+
+
+class VersionConditionalGetMixin(ConditionalGetMixin):
+    """
+    `ConditionalGetMixin` of a list view, off the cache versions of the tables
+    of `conditional_models` (see `webservices.cache.get_model_version`) and the
+    query params, so a 304 costs no query at all
+    """
+
+    conditional_models: List = []
+
+    def get_etag(self, request) -> Optional[str]:
+        return hash_key(
+            [get_model_version(model) for model in self.conditional_models],
+            sorted(request.query_params.lists()),
+        )
+
+
 # Concrete view classes that provide method handlers
 # by composing the mixin classes with the base view.
 
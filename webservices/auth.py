@@ -0,0 +1,158 @@
+import hashlib
+from typing import Iterable, List, Optional
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import router
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+from webservices.cache import LocalLRUCache
+
+# NOTE: token to user id of this process, the principal in redis is still
+#  checked on every request, so a revoked token fails right away
+_local_token_users = LocalLRUCache(
+    settings.TOKEN_AUTH_LOCAL_CACHE_SIZE,
+    timeout=settings.TOKEN_AUTH_LOCAL_CACHE_TIMEOUT,
+)
+
+
+def _token_key(key: str) -> str:
+    # NOTE: the token itself is never stored
+    return 'auth_token:' + hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def principal_fields(user_model) -> List[str]:
+    """
+    The fields authentication loads of a user, `PRINCIPAL_FIELDS` of the user
+    model or every one but the password
+    """
+    names = getattr(user_model, 'PRINCIPAL_FIELDS', None)
+    if names is None:
+        names = [
+            field.name
+            for field in user_model._meta.concrete_fields
+            if field.name != 'password'
+        ]
+    return names
+
+
+def _principal_key(user_id: int) -> str:
+    return f'auth_principal:{user_id}'
+
+
+def forget_principal(user_id: Optional[int]):
+    """Drops the cached user, the next request authenticates against the database"""
+    if user_id is not None:
+        cache.delete(_principal_key(user_id))
+
+
+def forget_principals(user_ids: Iterable[int]):
+    """`forget_principal` of many users at once, i.e. after a bulk write"""
+    keys = [_principal_key(user_id) for user_id in user_ids]
+    if keys:
+        cache.delete_many(keys)
+
+
+def _revoked_key(token_key: str) -> str:
+    return f'{token_key}:revoked'
+
+
+def forget_token(key: str, user_id: int):
+    """Drops a token once it is deleted, and the user it authenticated"""
+    token_key = _token_key(key)
+    _local_token_users.delete(token_key)
+    # NOTE: a request that read the token before the delete checks this once
+    #  it cached it, see `CachedTokenAuthentication.remember`
+    cache.set(_revoked_key(token_key), True, settings.TOKEN_AUTH_REVOKED_TIMEOUT)
+    cache.delete_many([token_key, _principal_key(user_id)])
+
+
+def forget_deleted_token(sender, instance, **kwargs):
+    """`post_delete` receiver of the token model, however it is deleted"""
+    forget_token(instance.key, instance.user_id)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    `TokenAuthentication` without the token and users join on every request.
+    The user is a lean principal, only `principal_fields` are loaded and the
+    first read of any other loads the rest of the row. Those fields are cached
+    in redis along with the token, and the token to user id mapping in this
+    process too.
+
+    The cache is dropped by every `User.save`, including changes of the
+    password or `is_active`, and whenever a token is deleted, after which the
+    token is checked against the database again.
+    """
+
+    def authenticate_credentials(self, key):
+        token_key = _token_key(key)
+        user_id = _local_token_users.get(token_key)
+        if user_id is None:
+            user_id = cache.get(token_key)
+        principal = cache.get(_principal_key(user_id)) if user_id else None
+        if principal is None or principal['token'] != token_key:
+            _local_token_users.delete(token_key)
+            user, token = self.fetch_credentials(key)
+            self.remember(token_key, user)
+        else:
+            _local_token_users.set(token_key, user_id)
+            user = self.principal_user(principal['fields'])
+            token = self.get_model()(key=key, user=user)
+        if hasattr(user, 'load_deferred_together'):
+            user.load_deferred_together()
+        return user, token
+
+    def fetch_credentials(self, key):
+        """`TokenAuthentication.authenticate_credentials`, loading a lean user"""
+        model = self.get_model()
+        user_model = get_user_model()
+        fields = [f'user__{name}' for name in principal_fields(user_model)]
+        try:
+            token = (
+                model.objects.select_related('user')
+                .only('key', 'user', *fields)
+                .get(key=key)
+            )
+        except model.DoesNotExist:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+        return token.user, token
+
+    def remember(self, token_key: str, user):
+        attnames = [
+            user._meta.get_field(name).attname
+            for name in principal_fields(user.__class__)
+        ]
+        fields = {attname: getattr(user, attname) for attname in attnames}
+        timeout = settings.TOKEN_AUTH_CACHE_TIMEOUT
+        cache.set_many(
+            {
+                token_key: user.id,
+                _principal_key(user.id): dict(token=token_key, fields=fields),
+            },
+            timeout=timeout,
+        )
+        # NOTE: revoked while it was being read, checked after the write so a
+        #  `forget_token` in between is not undone either
+        if cache.get(_revoked_key(token_key)):
+            cache.delete_many([token_key, _principal_key(user.id)])
+            return
+        _local_token_users.set(token_key, user.id)
+
+    def principal_user(self, fields: dict):
+        # NOTE: as loaded from the database, fields left out stay deferred
+        user_model = get_user_model()
+        return user_model.from_db(
+            router.db_for_read(user_model),
+            list(fields),
+            [
+                fields[field.attname]
+                for field in user_model._meta.concrete_fields
+                if field.attname in fields
+            ],
+        )
@@ -0,0 +1,197 @@
+from typing import Dict, Iterable, List, Optional, Sequence
+from uuid import uuid4
+
+import numpy as np
+from django.core.cache import cache
+from django_redis import get_redis_connection
+
+
+class BitmapIndex:
+    """
+    Redis bitmaps over integer ids, one per value of every dimension: bit `i` of
+    a value's bitmap is set when row `i` has that value. A filter on any mix of
+    dimensions is then a few BITOPs and its count a BITCOUNT, whatever the
+    number of rows. NULL is the value ''.
+
+    The values seen of every dimension are kept in a set next to the bitmaps.
+    """
+
+    def __init__(self, name: str, dimensions: Sequence[str]):
+        self.name = name
+        self.dimensions = list(dimensions)
+
+    @staticmethod
+    def encode(value) -> str:
+        return '' if value is None else str(value)
+
+    def _key(self, dimension: str, value: str) -> str:
+        return cache.make_key(f'bitmap:{self.name}:{dimension}:{value}')
+
+    def _values_key(self, dimension: str) -> str:
+        return cache.make_key(f'bitmap:{self.name}:{dimension}')
+
+    def _built_key(self) -> str:
+        return f'bitmap:{self.name}:built'
+
+    @staticmethod
+    def _redis():
+        return get_redis_connection('default')
+
+    def is_built(self) -> bool:
+        return cache.get(self._built_key()) is not None
+
+    def invalidate(self):
+        """For writes that bypass the updates, until the next rebuild"""
+        cache.delete(self._built_key())
+
+    def values(self, dimension: str) -> List[str]:
+        return sorted(
+            value.decode('utf-8')
+            for value in self._redis().smembers(self._values_key(dimension))
+        )
+
+    def update(self, row_id: int, old: Dict[str, str], new: Dict[str, str]):
+        """
+        Moves a row from its `old` values to its `new` ones, dimensions missing
+        from `old` are added and dimensions missing from `new` are left alone
+        """
+        pipe = self._redis().pipeline(transaction=False)
+        for dimension, value in new.items():
+            if dimension in old:
+                if old[dimension] == value:
+                    continue
+                pipe.setbit(self._key(dimension, old[dimension]), row_id, 0)
+            pipe.setbit(self._key(dimension, value), row_id, 1)
+            pipe.sadd(self._values_key(dimension), value)
+        if len(pipe):
+            pipe.execute()
+
+    def remove(self, row_id: int, values: Dict[str, str]):
+        """Clears a row from its `values`, or from every value when incomplete"""
+        if set(values) != set(self.dimensions):
+            self.set_row(row_id, None)
+            return
+        pipe = self._redis().pipeline(transaction=False)
+        for dimension, value in values.items():
+            pipe.setbit(self._key(dimension, value), row_id, 0)
+        pipe.execute()
+
+    def set_row(self, row_id: int, values: Optional[Dict[str, str]]):
+        """
+        Clears the row from every value and sets it on `values`, for rows whose
+        previous values are not known. None removes the row.
+        """
+        redis = self._redis()
+        pipe = redis.pipeline(transaction=False)
+        for dimension in self.dimensions:
+            for value in redis.smembers(self._values_key(dimension)):
+                pipe.setbit(self._key(dimension, value.decode('utf-8')), row_id, 0)
+            if values is not None:
+                pipe.setbit(self._key(dimension, values[dimension]), row_id, 1)
+                pipe.sadd(self._values_key(dimension), values[dimension])
+        pipe.execute()
+
+    def rebuild(self, ids: np.ndarray, columns: Dict[str, Sequence[str]]):
+        """
+        Replaces the bitmaps with the values of `columns` for the rows `ids`,
+        the values encoded like `encode` does
+        """
+        redis = self._redis()
+        size = int(ids.max()) + 1 if len(ids) else 0
+        for dimension in self.dimensions:
+            values, inverse = np.unique(
+                np.asarray(columns[dimension], dtype=str), return_inverse=True
+            )
+            inverse = inverse.reshape(-1)
+            pipe = redis.pipeline(transaction=True)
+            for value in redis.smembers(self._values_key(dimension)):
+                if value.decode('utf-8') not in values:
+                    pipe.delete(self._key(dimension, value.decode('utf-8')))
+            pipe.delete(self._values_key(dimension))
+            for i, value in enumerate(values):
+                bits = np.zeros(size, dtype=bool)
+                bits[ids[inverse == i]] = True
+                # NOTE: bit 0 of a redis bitmap is the high bit of its first byte
+                pipe.set(
+                    self._key(dimension, value),
+                    np.packbits(bits, bitorder='big').tobytes(),
+                )
+                pipe.sadd(self._values_key(dimension), value)
+            pipe.execute()
+        cache.set(self._built_key(), True, timeout=None)
+
+    def facets(self, constraints: Dict[str, Iterable[str]]) -> Optional[dict]:
+        """
+        Count of the rows matching `constraints` (the values allowed per
+        dimension), and the count per value of every dimension. The counts of a
+        dimension ignore its own constraint, so they show what choosing other
+        values would match. None when the index is not built.
+        """
+        if not self.is_built():
+            return None
+        redis = self._redis()
+        pipe = redis.pipeline(transaction=False)
+        for dimension in self.dimensions:
+            pipe.smembers(self._values_key(dimension))
+        registry = {
+            dimension: sorted(value.decode('utf-8') for value in values)
+            for dimension, values in zip(self.dimensions, pipe.execute())
+        }
+        token = uuid4().hex
+        temporary: List[str] = []
+
+        def temporary_key(suffix: str) -> str:
+            temporary.append(cache.make_key(f'bitmap:{self.name}:tmp:{token}:{suffix}'))
+            return temporary[-1]
+
+        # NOTE: the rest is a single round trip
+        pipe = redis.pipeline(transaction=False)
+        unions = {}
+        for dimension, values in constraints.items():
+            unions[dimension] = temporary_key(dimension)
+            keys = [self._key(dimension, value) for value in values]
+            if keys:
+                pipe.bitop('OR', unions[dimension], *keys)
+
+        intersections: Dict[str, str] = {}
+
+        def intersection(dimensions: List[str]) -> Optional[str]:
+            keys = [unions[dimension] for dimension in dimensions]
+            if len(keys) <= 1:
+                return keys[0] if keys else None
+            name = '&'.join(dimensions)
+            if name not in intersections:
+                intersections[name] = temporary_key(name)
+                pipe.bitop('AND', intersections[name], *keys)
+            return intersections[name]
+
+        # NOTE: pipeline position, dimension and value of every BITCOUNT
+        counted = []
+        total = intersection(list(constraints))
+        if total is not None:
+            counted.append((len(pipe), None, None))
+            pipe.bitcount(total)
+        scratch = temporary_key('scratch')
+        for dimension in self.dimensions:
+            base = intersection([d for d in constraints if d != dimension])
+            for value in registry[dimension]:
+                key = self._key(dimension, value)
+                if base is not None:
+                    pipe.bitop('AND', scratch, base, key)
+                    key = scratch
+                counted.append((len(pipe), dimension, value))
+                pipe.bitcount(key)
+        pipe.delete(*temporary)
+        results = pipe.execute()
+
+        facets: Dict[str, Dict[str, int]] = {d: {} for d in self.dimensions}
+        count = None
+        for position, dimension, value in counted:
+            if dimension is None:
+                count = results[position]
+            else:
+                facets[dimension][value] = results[position]
+        if count is None:
+            # NOTE: every row has one value per dimension, NULL included
+            count = sum(facets[self.dimensions[0]].values())
+        return dict(count=count, facets=facets)
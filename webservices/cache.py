@@ -0,0 +1,118 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from decimal import Decimal
+from typing import Any, Iterable, List, Optional, Tuple
+
+from django.core.cache import cache
+from django_redis import get_redis_connection
+
+
+def hash_key(*parts) -> str:
+    """Stable hash of json serializable parts, for use in cache keys"""
+    payload = json.dumps(parts, sort_keys=True, default=str, separators=(',', ':'))
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def _version_key(model) -> str:
+    return f'version:{model._meta.db_table}'
+
+
+def get_model_version(model) -> int:
+    """
+    Generation counter for everything cached off of a model's table. Bumping it
+    invalidates all of those entries at once without having to find them.
+    """
+    return cache.get_or_set(_version_key(model), 1, timeout=None)
+
+
+def bump_model_version(model) -> int:
+    key = _version_key(model)
+    cache.add(key, 1, timeout=None)
+    return cache.incr(key)
+
+
+def _dirty_key(name: str) -> str:
+    return cache.make_key(f'dirty:{name}')
+
+
+def add_dirty_keys(name: str, keys: Iterable[str]):
+    """
+    Records keys whose derived data needs a refresh in a redis set, so a
+    periodic task only has to refresh those (see `pop_dirty_keys`)
+    """
+    keys = list(keys)
+    if keys:
+        get_redis_connection('default').sadd(_dirty_key(name), *keys)
+
+
+def pop_dirty_keys(name: str, count: int) -> List[str]:
+    """Removes and returns up to `count` of the recorded keys"""
+    keys = get_redis_connection('default').spop(_dirty_key(name), count)
+    return [key.decode('utf-8') for key in keys or []]
+
+
+def clear_dirty_keys(name: str):
+    get_redis_connection('default').delete(_dirty_key(name))
+
+
+def canonical_filter_params(filterset) -> dict:
+    """
+    Cleaned filterset data with empty values dropped and values normalised, so
+    `metro__in=2,1&age__gt=21.0` and `age__gt=21&metro__in=1,2` are the same.
+    Expects a valid filterset.
+    """
+    params = {}
+    for name, value in filterset.form.cleaned_data.items():
+        if value is None or value == '' or value == []:
+            continue
+        if isinstance(value, (list, tuple)):
+            value = sorted(str(v) for v in value)
+        elif isinstance(value, Decimal):
+            value = str(value.normalize())
+        params[name] = value
+    return params
+
+
+class LocalLRUCache:
+    """
+    Least recently used entries of one process, in front of the shared cache
+    for values read on every request. Other processes are not told about a
+    delete, so only cache what can be checked or can not go stale, or set a
+    `timeout` in seconds that bounds how long a stale entry is served.
+    """
+
+    def __init__(self, maxsize: int, timeout: Optional[float] = None):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self._entries: 'OrderedDict[str, Tuple[Optional[float], Any]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, default=None) -> Optional[Any]:
+        with self._lock:
+            if key not in self._entries:
+                return default
+            expires, value = self._entries[key]
+            if expires is not None and expires <= time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any):
+        expires = None if self.timeout is None else time.monotonic() + self.timeout
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,52 @@
+from typing import Sequence
+
+from django.contrib.postgres.fields import ArrayField
+from django.db.models import Aggregate, DecimalField, FloatField, Func, IntegerField
+
+
+class ToNumeric(Func):
+    """
+    Casts to an unconstrained postgres numeric, `Cast(..., DecimalField())`
+    would need a precision and round the value
+    """
+
+    template = '(%(expressions)s)::numeric'
+    arity = 1
+    output_field = DecimalField()
+
+
+class PercentileCont(Aggregate):
+    """
+    Postgres `percentile_cont` ordered-set aggregate, every fraction in one sort
+    of the group, i.e. `PercentileCont('age', [0.25, 0.5, 0.75])` gives
+    `[p25, median, p75]` (NULLs are ignored)
+    """
+
+    function = 'PERCENTILE_CONT'
+    template = (
+        '%(function)s(%(fractions)s) WITHIN GROUP (ORDER BY (%(expressions)s)::float8)'
+    )
+    arity = 1
+
+    def __init__(self, expression, fractions: Sequence[float], **extra):
+        fractions = [float(fraction) for fraction in fractions]
+        if not fractions or not all(0 <= fraction <= 1 for fraction in fractions):
+            raise ValueError('Percentile fractions must be between 0 and 1')
+        # NOTE: validated floats, safe to inline in the SQL
+        super().__init__(
+            expression,
+            fractions='ARRAY[{}]::float8[]'.format(', '.join(map(repr, fractions))),
+            output_field=ArrayField(FloatField()),
+            **extra,
+        )
+
+
+class WidthBucket(Func):
+    """
+    Postgres `width_bucket(operand, low, high, count)`: 1 to `count` for the
+    equal width buckets of [low, high), 0 below and `count + 1` from high up
+    """
+
+    function = 'WIDTH_BUCKET'
+    arity = 4
+    output_field = IntegerField()
@@ -1,6 +1,10 @@
+from typing import Any, Dict, Iterable, Optional
+
 from django.db import models
 from django.utils import timezone
 
+from webservices.cache import bump_model_version
+
 
 class SoftDeleteModelMixin(models.Model):
     class Meta:
@@ -26,9 +30,145 @@ class SoftDeleteModelMixin(models.Model):
         return super().delete(*args, **kwargs)
 
 
+class VersionedModelMixin(models.Model):
+    """
+    Bumps the cache version of the table (see webservices.cache) on every save
+    and delete. Bulk writes have to bump it themselves.
+    """
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        bump_model_version(self.__class__)
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        bump_model_version(self.__class__)
+        return result
+
+
 class TimeStampedModel(models.Model):
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
 
     class Meta:
         abstract = True
+
+
+class LazyDeferredFieldsMixin(models.Model):
+    """
+    An instance loaded with a few fields, e.g. by `.only()`, reads one deferred
+    field per query. Once `load_deferred_together` is called, the first read of
+    a deferred field loads all of them instead.
+    """
+
+    class Meta:
+        abstract = True
+
+    def load_deferred_together(self):
+        self.__dict__['_load_deferred_together'] = True
+
+    def refresh_from_db(self, using=None, fields=None):
+        if fields is not None and self.__dict__.pop('_load_deferred_together', False):
+            fields = list({*fields, *self.get_deferred_fields()})
+        super().refresh_from_db(using=using, fields=fields)
+
+
+class DirtyFieldsModelMixin(models.Model):
+    """
+    Keeps the field values as they were loaded from, or last written to, the
+    database. A save without `update_fields` then only writes the fields that
+    changed (plus `auto_now` ones), and skips the query when nothing did.
+    """
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._snapshot_fields()
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None):
+        super().refresh_from_db(using=using, fields=fields)
+        self._snapshot_fields(fields)
+
+    def _snapshot_fields(self, field_names: Optional[Iterable[str]] = None):
+        saved_values = self.__dict__.setdefault('_saved_values', {})
+        if field_names is not None:
+            field_names = set(field_names)
+        for field in self._meta.concrete_fields:
+            if field_names is not None and not (
+                field.name in field_names or field.attname in field_names
+            ):
+                continue
+            # NOTE: deferred fields are not loaded, reading them would query
+            if field.attname in self.__dict__:
+                saved_values[field.attname] = self.__dict__[field.attname]
+
+    def get_dirty_fields(self) -> Dict[str, Any]:
+        """
+        Fields changed since the instance was loaded or saved, mapped to their
+        previous value (None when it was never loaded)
+        """
+        saved_values = self.__dict__.get('_saved_values', {})
+        dirty = {}
+        for field in self._meta.concrete_fields:
+            if field.primary_key or field.attname not in self.__dict__:
+                continue
+            if field.attname not in saved_values:
+                dirty[field.name] = None
+            elif saved_values[field.attname] != self.__dict__[field.attname]:
+                dirty[field.name] = saved_values[field.attname]
+        return dirty
+
+    def get_save_update_fields(self) -> Optional[list]:
+        """`update_fields` for a save that did not specify any"""
+        if self._state.adding or '_saved_values' not in self.__dict__:
+            return None
+        update_fields = list(self.get_dirty_fields())
+        if update_fields:
+            update_fields.extend(
+                field.name
+                for field in self._meta.concrete_fields
+                if getattr(field, 'auto_now', False) and field.name not in update_fields
+            )
+        return update_fields
+
+    def save(self, *args, update_fields=None, **kwargs):
+        if update_fields is None:
+            update_fields = self.get_save_update_fields()
+        super().save(*args, update_fields=update_fields, **kwargs)
+        self._snapshot_fields(update_fields)
+
+
+class annotatable_property:
+    """
+    Read only property whose value can be supplied by a queryset annotation of
+    the same name, so it is computed by the database instead of per instance.
+    Annotated values should be dropped whenever the inputs change.
+    """
+
+    def __init__(self, func):
+        self.func = func
+        self.__doc__ = func.__doc__
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        try:
+            return instance.__dict__[self.name]
+        except KeyError:
+            return self.func(instance)
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.name] = value
+
+    def __delete__(self, instance):
+        instance.__dict__.pop(self.name, None)
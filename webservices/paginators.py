@@ -1,4 +1,39 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+from base64 import b64decode, b64encode
+from collections import OrderedDict
+from decimal import InvalidOperation
+from functools import partial
+from typing import Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.paginator import Paginator as DjangoPaginator
+from django.db.models import F, Q
+from django.db.models.constants import LOOKUP_SEP
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (
+    BasePagination,
+    PageNumberPagination,
+    _positive_int,
+)
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from webservices.cache import get_model_version, hash_key
+
+
+class CountedPaginator(DjangoPaginator):
+    def __init__(self, object_list, per_page, count_function=None, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.count_function = count_function
+
+    @cached_property
+    def count(self) -> int:
+        if self.count_function is None:
+            return super().count
+        return self.count_function(self.object_list)
 
 
 class StandardPageNumberPagination(PageNumberPagination):
@@ -8,3 +43,222 @@ class StandardPageNumberPagination(PageNumberPagination):
     page_size_query_param = 'page_size'
     page_size_query_description = 'Number of results to return per page.'
     max_page_size = 100
+    # NOTE: only enable for models that bump their cache version on save,
+    #  see `CachedCountPageNumberPagination`
+    count_cache_timeout: Optional[int] = None
+    approximate_count_threshold: Optional[int] = None
+
+    def __init__(self):
+        self.count_exact = True
+        self.django_paginator_class = partial(
+            CountedPaginator, count_function=self.get_count
+        )
+
+    def get_count(self, queryset) -> int:
+        if not self.count_cache_timeout:
+            count, self.count_exact = self.compute_count(queryset)
+            return count
+        # NOTE: the compiled WHERE clause is the canonical form of the filter,
+        #  search and exclusion params, whatever order they came in
+        sql, params = queryset.order_by().query.sql_with_params()
+        key = 'count:{table}:{version}:{hash}'.format(
+            table=queryset.model._meta.db_table,
+            version=get_model_version(queryset.model),
+            hash=hash_key(sql, params, self.approximate_count_threshold),
+        )
+        cached = cache.get(key)
+        if cached is None:
+            cached = self.compute_count(queryset)
+            cache.set(key, cached, self.count_cache_timeout)
+        count, self.count_exact = cached
+        return count
+
+    def compute_count(self, queryset) -> Tuple[int, bool]:
+        if self.approximate_count_threshold is not None:
+            estimate = self.estimate_count(queryset)
+            if estimate >= self.approximate_count_threshold:
+                return estimate, False
+        return queryset.count(), True
+
+    def estimate_count(self, queryset) -> int:
+        """Row estimate of the postgres planner for the queryset"""
+        plan = json.loads(queryset.order_by().explain(format='json'))
+        return int(plan[0]['Plan']['Plan Rows'])
+
+
+class CachedCountPageNumberPagination(StandardPageNumberPagination):
+    @property
+    def count_cache_timeout(self) -> Optional[int]:
+        return settings.PAGINATION_COUNT_CACHE_TIMEOUT
+
+    @property
+    def approximate_count_threshold(self) -> Optional[int]:
+        return settings.PAGINATION_APPROXIMATE_COUNT_THRESHOLD
+
+    def get_paginated_response(self, data):
+        # NOTE: false when the count is the estimate of the planner
+        return Response(
+            OrderedDict(
+                [
+                    ('count', self.page.paginator.count),
+                    ('count_exact', self.count_exact),
+                    ('next', self.get_next_link()),
+                    ('previous', self.get_previous_link()),
+                    ('results', data),
+                ]
+            )
+        )
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset (seek) pagination that follows the ordering already applied to the
+    queryset, i.e. `order_by('-net_worth')`. The cursor holds the sort value of
+    the last row on the page plus its id as a tiebreaker, so every page is an
+    indexed range scan instead of an `OFFSET n` scan and no COUNT(*) is run.
+
+    Ties are always ascending by id, like the page number ordering. NULLs keep
+    the postgres defaults: last when ascending, first when descending.
+    """
+
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    tiebreaker = 'id'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering_key = self.get_ordering_key(queryset)
+        self.field_name = self.ordering_key.lstrip('-')
+        self.descending = self.ordering_key.startswith('-')
+
+        queryset = queryset.order_by(*self.get_order_expressions())
+        position = self.decode_cursor(request)
+        if position is not None:
+            try:
+                queryset = queryset.filter(self.get_seek_filter(*position))
+            except (DjangoValidationError, InvalidOperation, TypeError, ValueError):
+                raise NotFound(self.invalid_cursor_message)
+
+        rows = list(queryset[: self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        self.page = rows[: self.page_size]
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response(
+            OrderedDict([('next', self.get_next_link()), ('results', data)])
+        )
+
+    def get_page_size(self, request):
+        if self.page_size_query_param:
+            try:
+                return _positive_int(
+                    request.query_params[self.page_size_query_param],
+                    strict=True,
+                    cutoff=self.max_page_size,
+                )
+            except (KeyError, ValueError):
+                pass
+        return self.page_size
+
+    def get_ordering_key(self, queryset) -> str:
+        ordering = queryset.query.order_by
+        if not ordering or not isinstance(ordering[0], str):
+            raise AssertionError(
+                'Keyset pagination requires a queryset ordered by a field name'
+            )
+        return ordering[0]
+
+    def get_order_expressions(self) -> list:
+        if self.descending:
+            expressions = [F(self.field_name).desc(nulls_first=True)]
+        else:
+            expressions = [F(self.field_name).asc(nulls_last=True)]
+        if self.field_name != self.tiebreaker:
+            expressions.append(F(self.tiebreaker).asc())
+        return expressions
+
+    def get_seek_filter(self, value, last_id) -> Q:
+        field = self.field_name
+        if field == self.tiebreaker:
+            return Q(**{f'{field}__{"lt" if self.descending else "gt"}': last_id})
+        id_lookup = f'{self.tiebreaker}__gt'
+        if value is None:
+            after_nulls = Q(**{f'{field}__isnull': True, id_lookup: last_id})
+            if self.descending:
+                # NULLs come first, so every non null row is still ahead of us
+                return after_nulls | Q(**{f'{field}__isnull': False})
+            return after_nulls
+        value_lookup = f'{field}__{"lt" if self.descending else "gt"}'
+        seek = Q(**{value_lookup: value}) | Q(**{field: value, id_lookup: last_id})
+        if not self.descending:
+            seek |= Q(**{f'{field}__isnull': True})
+        return seek
+
+    def get_position_value(self, row, lookup):
+        if isinstance(row, dict):
+            return row[lookup]
+        if hasattr(row, '_fields'):
+            # named rows of values_list(named=True)
+            return getattr(row, lookup)
+        value = row
+        for attr in lookup.split(LOOKUP_SEP):
+            value = getattr(value, attr, None)
+            if value is None:
+                break
+        return value
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        last_row = self.page[-1]
+        cursor = self.encode_cursor(
+            self.get_position_value(last_row, self.field_name),
+            self.get_position_value(last_row, self.tiebreaker),
+        )
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def encode_cursor(self, value, last_id) -> str:
+        if value is not None and not isinstance(value, (int, float, str)):
+            value = str(value)
+        payload = json.dumps(dict(o=self.ordering_key, v=value, id=last_id))
+        return b64encode(payload.encode('utf-8')).decode('ascii')
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            payload = json.loads(b64decode(encoded.encode('ascii')).decode('utf-8'))
+            ordering_key, value, last_id = payload['o'], payload['v'], payload['id']
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        # a cursor is only meaningful for the ordering it was generated with
+        if ordering_key != self.ordering_key or not isinstance(last_id, int):
+            raise NotFound(self.invalid_cursor_message)
+        return value, last_id
+
+
+class PageNumberOrKeysetPagination(BasePagination):
+    """
+    Page number pagination by default, keyset pagination as soon as the client
+    sends the `cursor` query param (empty for the first page).
+    """
+
+    page_number_class = StandardPageNumberPagination
+    keyset_class = KeysetPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.keyset_class.cursor_query_param in request.query_params:
+            self.paginator = self.keyset_class()
+        else:
+            self.paginator = self.page_number_class()
+        return self.paginator.paginate_queryset(queryset, request, view=view)
+
+    def get_paginated_response(self, data):
+        return self.paginator.get_paginated_response(data)
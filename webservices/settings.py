@@ -17,6 +17,8 @@ from urllib.parse import urlparse
 from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 
+from celery.schedules import crontab
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -181,11 +183,48 @@ CACHES = {
     }
 }
 
+# PAGINATION
+# NOTE: cached counts are invalidated by the model version, see webservices.cache
+PAGINATION_COUNT_CACHE_TIMEOUT = 60 * 10  # 10 minutes
+# NOTE: above this many rows (as estimated by the query planner) the count is
+#  estimated instead of exact, None to always count exactly
+PAGINATION_APPROXIMATE_COUNT_THRESHOLD = None
+# NOTE: invalidated by the users cache version as well
+USER_LIST_CACHE_TIMEOUT = 60 * 5  # 5 minutes
+USER_STATS_CACHE_TIMEOUT = 60 * 10  # 10 minutes
+# NOTE: the stats endpoint merges at most this many cohort rollup cells, past
+#  that scanning the users is about as fast
+COHORT_ROLLUP_MAX_CELLS = 5000
+# NOTE: merged cohort sketches each process keeps for the percentiles endpoint
+COHORT_SKETCH_CACHE_SIZE = 256
+# NOTE: directory of the columnar user snapshot on the host of the web workers,
+#  see authentication.snapshot, unset to query the database instead
+USER_SNAPSHOT_DIR = os.environ.get('USER_SNAPSHOT_DIR') or None
+# NOTE: seconds of saves before the last refresh that the next one fetches again
+USER_SNAPSHOT_DELTA_OVERLAP = 60
+# NOTE: seconds after which a refresh fetches every user again
+USER_SNAPSHOT_REBUILD_INTERVAL = 60 * 60 * 24  # 1 day
+# NOTE: groups of the comparison endpoint with fewer users are left out, so
+#  that no group singles out a handful of users
+USER_COMPARE_MIN_GROUP_SIZE = 10
+# NOTE: uuid and handle to user id resolutions, see authentication.lookups
+USER_LOOKUP_CACHE_TIMEOUT = 60 * 60 * 24  # 1 day
+USER_LOOKUP_LOCAL_CACHE_SIZE = 10000
+# NOTE: users authenticated by token, see webservices.auth. Every
+#  save of the user and every token deletion invalidates them.
+TOKEN_AUTH_CACHE_TIMEOUT = 60 * 10  # 10 minutes
+TOKEN_AUTH_LOCAL_CACHE_TIMEOUT = 60
+TOKEN_AUTH_LOCAL_CACHE_SIZE = 10000
+TOKEN_AUTH_REVOKED_TIMEOUT = 60
+# NOTE: dropped by every save of the user or their chat user
+PROFILE_CACHE_TIMEOUT = 60 * 60  # 1 hour
+# NOTE: seconds browsers reuse a metro, industry or job title search without
+#  checking back, they are seldom added
+ENTITY_SEARCH_MAX_AGE = 60 * 5  # 5 minutes
+
 # REST framework
 REST_FRAMEWORK = {
-    'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
-    ),
+    'DEFAULT_AUTHENTICATION_CLASSES': ('webservices.auth.CachedTokenAuthentication',),
     'DEFAULT_FILTER_BACKENDS': ('django_filters.rest_framework.DjangoFilterBackend',),
     'DEFAULT_PAGINATION_CLASS': 'webservices.paginators.StandardPageNumberPagination',
 }
@@ -220,8 +259,25 @@ CELERY_TASK_ALWAYS_EAGER = False
 # TODO
 #  use this for weekly digests, daily summaries for dashboards, etc.
 # TASK SCHEDULER
-# add this to requirements: django-celery-beat==2.4.0
-# CELERY_BEAT_SCHEDULE = {}
+# NOTE: run `celery -A webservices beat` next to the workers, add
+#  django-celery-beat==2.4.0 to requirements to manage these from the admin
+CELERY_BEAT_SCHEDULE = {
+    'refresh-cohort-rollups': {
+        'task': 'authentication.tasks.refresh_cohort_rollups_task',
+        'schedule': 60 * 5,  # 5 minutes
+    },
+    # NOTE: picks up the writes that bypass User.save
+    'rebuild-cohort-rollups': {
+        'task': 'authentication.tasks.refresh_cohort_rollups_task',
+        'schedule': crontab(hour=3, minute=0),
+        'kwargs': {'full': True},
+    },
+    # NOTE: rebuilds the user bitmaps after writes that bypass User.save
+    'ensure-user-bitmaps': {
+        'task': 'authentication.tasks.ensure_user_bitmaps_task',
+        'schedule': 60 * 5,  # 5 minutes
+    },
+}
 
 # CHAT ENGINE
 CHAT_ENGINE_BASE_URL = "https://api.chatengine.io/"
@@ -0,0 +1,114 @@
+import math
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+
+
+class QuantileSketch:
+    """
+    Mergeable quantile sketch with a relative error guarantee (DDSketch): values
+    are counted in logarithmic buckets, so whatever the distribution a quantile
+    is within `relative_accuracy` of the true value. Two sketches merge by
+    adding their bucket counts, which is what makes them useful for rollups.
+
+    A bucket key is `sign * (index + KEY_OFFSET)`, 0 is the bucket of zeros, so
+    sorting the keys sorts the buckets by value.
+    """
+
+    relative_accuracy = 0.01
+    # NOTE: bucket indexes of anything from 1e-300 to 1e300 stay above zero
+    KEY_OFFSET = 40000
+    # NOTE: smaller magnitudes count as zero
+    MIN_VALUE = 1e-9
+
+    def __init__(
+        self, keys: Optional[np.ndarray] = None, counts: Optional[np.ndarray] = None
+    ):
+        self.keys = np.zeros(0, dtype=np.int64) if keys is None else keys
+        self.counts = np.zeros(0, dtype=np.int64) if counts is None else counts
+
+    @classmethod
+    def gamma(cls) -> float:
+        return (1 + cls.relative_accuracy) / (1 - cls.relative_accuracy)
+
+    @classmethod
+    def bucket_keys(cls, values: np.ndarray) -> np.ndarray:
+        """Bucket key of every value, values must not be NaN"""
+        magnitudes = np.abs(values)
+        keys = np.zeros(values.shape, dtype=np.int64)
+        nonzero = magnitudes >= cls.MIN_VALUE
+        indexes = np.ceil(np.log(magnitudes[nonzero]) / math.log(cls.gamma()))
+        keys[nonzero] = np.sign(values[nonzero]).astype(np.int64) * (
+            indexes.astype(np.int64) + cls.KEY_OFFSET
+        )
+        return keys
+
+    @classmethod
+    def bucket_values(cls, keys: np.ndarray) -> np.ndarray:
+        """Representative value of every bucket key"""
+        gamma = cls.gamma()
+        indexes = np.abs(keys) - cls.KEY_OFFSET
+        with np.errstate(over='ignore'):
+            values = 2 * np.power(gamma, indexes.astype(np.float64)) / (gamma + 1)
+        return np.where(keys == 0, 0.0, np.sign(keys) * values)
+
+    @classmethod
+    def from_values(cls, values: np.ndarray) -> 'QuantileSketch':
+        values = values[~np.isnan(values)]
+        keys, counts = np.unique(cls.bucket_keys(values), return_counts=True)
+        return cls(keys, counts.astype(np.int64))
+
+    @classmethod
+    def merged(cls, sketches: Iterable['QuantileSketch']) -> 'QuantileSketch':
+        sketches = list(sketches)
+        if not sketches:
+            return cls()
+        keys = np.concatenate([sketch.keys for sketch in sketches])
+        counts = np.concatenate([sketch.counts for sketch in sketches])
+        unique_keys, inverse = np.unique(keys, return_inverse=True)
+        return cls(
+            unique_keys,
+            np.bincount(inverse, weights=counts, minlength=len(unique_keys)).astype(
+                np.int64
+            ),
+        )
+
+    @property
+    def count(self) -> int:
+        return int(self.counts.sum())
+
+    def quantile(self, fraction: float) -> Optional[float]:
+        """
+        Value of rank `fraction * (count - 1)`, the lower of the two values
+        `percentile_cont` would interpolate between
+        """
+        count = self.count
+        if not count:
+            return None
+        rank = fraction * (count - 1)
+        position = int(np.searchsorted(np.cumsum(self.counts), rank, side='right'))
+        return float(self.bucket_values(self.keys[position : position + 1])[0])
+
+    def rank(self, value: float) -> Tuple[int, int]:
+        """
+        Counts of the values in the buckets below the bucket of `value` and in
+        its bucket. Values below are smaller than `value` and values above are
+        larger, only the ones in the same bucket are within a factor `gamma` of
+        it either way.
+        """
+        key = self.bucket_keys(np.array([value], dtype=np.float64))[0]
+        position = int(np.searchsorted(self.keys, key))
+        below = int(self.counts[:position].sum())
+        if position < len(self.keys) and self.keys[position] == key:
+            return below, int(self.counts[position])
+        return below, 0
+
+    def to_dict(self) -> dict:
+        return dict(keys=self.keys.tolist(), counts=self.counts.tolist())
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'QuantileSketch':
+        return cls(
+            np.array(data['keys'], dtype=np.int64),
+            np.array(data['counts'], dtype=np.int64),
+        )
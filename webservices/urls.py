@@ -30,8 +30,14 @@ from authentication.views import (
     SignUpView,
     UpdateChatTermsAgreementView,
     UpdateHandleView,
+    UserCompareView,
     UserDetailsView,
+    UserFacetsView,
+    UserHistogramView,
     UserListView,
+    UserPercentilesView,
+    UserSimilarView,
+    UserStatsView,
     VerifyEmailView,
 )
 from django.conf import settings
@@ -67,6 +73,16 @@ urlpatterns = [
         name='update_chat_terms',
     ),
     path('api/users/', UserListView.as_view(), name='user_list'),
+    path('api/users/stats/', UserStatsView.as_view(), name='user_stats'),
+    path(
+        'api/users/percentiles/',
+        UserPercentilesView.as_view(),
+        name='user_percentiles',
+    ),
+    path('api/users/histogram/', UserHistogramView.as_view(), name='user_histogram'),
+    path('api/users/facets/', UserFacetsView.as_view(), name='user_facets'),
+    path('api/users/compare/', UserCompareView.as_view(), name='user_compare'),
+    path('api/users/similar/', UserSimilarView.as_view(), name='user_similar'),
     path('api/metros/', MetropolitanAreaSearch.as_view(), name='metro_list'),
     path('api/industries/', IndustrySearch.as_view(), name='industry_list'),
     path('api/job_titles/', JobTitleSearch.as_view(), name='job_title_list'),